@@ -0,0 +1,143 @@
+# file for batch LCA calculations over routes, regions, years and METHODS
+"""
+Impact scores of many demands (e.g. every aggregate production route in every region)
+for all METHODS, without Brightway and without refactorizing the technosphere for
+every demand.
+
+A system (one scenario and year) is a sparse technosphere matrix A (products x
+activities, production positive, inputs negative) and a biosphere matrix B (flows x
+activities). For every system:
+- A is factorized once (sparse LU, scipy splu) and all demand vectors are solved
+  together: X = A^-1 F, with F the products x demands matrix
+- the characterization matrix C of all methods (methods x flows) is multiplied with
+  B once, the scores of all methods and demands are one sparse product: (C B) X
+Systems that share the same technosphere matrix object also share its factorization.
+
+The result is a tidy cube with a row per scenario, year, demand (e.g. route and
+region) and method.
+
+Example:
+    systems = {("SSP2-Base-image", 2030): (A_2030, B_2030), ...}
+    demands = pd.DataFrame({"route": [...], "region": [...], "activity": [...], "amount": 1.0})
+    C = characterization_matrix(cfs, flows)
+    df_scores = batch_lca(systems, demands, C)
+"""
+
+# imports
+from typing import Optional
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+from statics import METHODS, METHOD_SAFE_NAME, METHOD_UNITS
+
+
+def characterization_matrix(cfs: dict, flows: list, methods: list = METHODS) -> sparse.csr_matrix:
+    """stack the characterization factors {method: {flow: factor}} of all methods to a methods x flows matrix"""
+    unknown = [method for method in cfs if method not in methods]
+    if unknown:
+        raise BaseException(f"Characterization factors for unknown methods: {unknown}")
+    flow_idx = {flow: i for i, flow in enumerate(flows)}
+    rows, cols, values = [], [], []
+    for m, method in enumerate(methods):
+        for flow, factor in cfs.get(method, {}).items():
+            if flow not in flow_idx:
+                raise BaseException(f"'{method}' has a factor for unknown flow '{flow}'")
+            rows.append(m)
+            cols.append(flow_idx[flow])
+            values.append(factor)
+    return sparse.csr_matrix((values, (rows, cols)), shape=(len(methods), len(flows)))
+
+
+def config_routes(config: dict) -> dict:
+    """return the activity (name, reference product) of every production pathway of config.yaml"""
+    return {route: (settings["ecoinvent alias"]["name"], settings["ecoinvent alias"]["reference product"])
+            for route, settings in (config.get("production pathways") or {}).items()}
+
+
+def route_demands(activities: pd.DataFrame, routes: dict, regions: list, amount: float = 1.0) -> pd.DataFrame:
+    """return demands of amount of every route in every region
+
+    activities has the name, reference product and location of every product (row i
+    is product i), a route without an activity in a region is left out.
+    """
+    idx = {tuple(key): i for i, key in enumerate(activities[["name", "reference product", "location"]].to_numpy())}
+    demands = [(route, region, idx[(name, product, region)], amount)
+               for route, (name, product) in routes.items() for region in regions
+               if (name, product, region) in idx]
+    return pd.DataFrame(demands, columns=["route", "region", "activity", "amount"])
+
+
+def demand_matrix(demands: pd.DataFrame, n_products: int) -> np.ndarray:
+    """return the products x demands matrix of demands with an 'activity' (product number) and 'amount' column"""
+    F = np.zeros((n_products, len(demands)))
+    F[demands["activity"].to_numpy(dtype=int), np.arange(len(demands))] = demands["amount"].to_numpy(dtype=float)
+    return F
+
+
+def factorize(technosphere: sparse.spmatrix):
+    """return the sparse LU factorization of a technosphere matrix"""
+    if technosphere.shape[0] != technosphere.shape[1]:
+        raise BaseException(f"The technosphere matrix must be square, not {technosphere.shape}")
+    try:
+        return splu(sparse.csc_matrix(technosphere))
+    except RuntimeError as error:
+        raise BaseException(f"The technosphere matrix can not be factorized: {error}")
+
+
+def batch_scores(lu, biosphere: sparse.spmatrix, characterization: sparse.spmatrix, F: np.ndarray) -> np.ndarray:
+    """return the methods x demands scores of all demands (columns of F) of a factorized system"""
+    supply = lu.solve(F)  # activities x demands
+    return (characterization @ biosphere) @ supply
+
+
+def batch_lca(systems: dict,
+              demands: pd.DataFrame,
+              characterization: sparse.spmatrix,
+              methods: list = METHODS,
+              path: Optional[str] = None) -> pd.DataFrame:
+    """calculate the scores of all demands and methods for every system
+
+    systems is {(scenario, year): (technosphere, biosphere)}. demands has the product
+    number of the demand ('activity') and its 'amount', all other columns (e.g.
+    'route' and 'region') label the demand in the result.
+
+    Returns (and writes to path as csv if given) a tidy frame with scenario, year, the
+    demand labels, method, unit and score.
+    """
+    if characterization.shape[0] != len(methods):
+        raise BaseException(f"The characterization matrix has {characterization.shape[0]} rows, "
+                            f"not one per method ({len(methods)})")
+    for (scenario, year), (technosphere, biosphere) in systems.items():
+        if biosphere.shape[1] != technosphere.shape[0]:
+            raise BaseException(f"System {(scenario, year)}: the biosphere matrix has {biosphere.shape[1]} "
+                                f"activities, the technosphere matrix {technosphere.shape[0]}")
+        if characterization.shape[1] != biosphere.shape[0]:
+            raise BaseException(f"System {(scenario, year)}: the characterization matrix has "
+                                f"{characterization.shape[1]} flows, the biosphere matrix {biosphere.shape[0]}")
+    labels = demands.drop(columns=["activity", "amount"]).reset_index(drop=True)
+    method_names = np.asarray([METHOD_SAFE_NAME.get(method, method) for method in methods], dtype=object)
+    method_units = np.asarray([METHOD_UNITS.get(method, "") for method in methods], dtype=object)
+
+    factorizations = {}  # id of technosphere matrix: factorization
+    data = []
+    for (scenario, year), (technosphere, biosphere) in systems.items():
+        if id(technosphere) not in factorizations:
+            factorizations[id(technosphere)] = (technosphere, factorize(technosphere))  # keep A alive for its id
+        lu = factorizations[id(technosphere)][1]
+        scores = batch_scores(lu, biosphere, characterization, demand_matrix(demands, technosphere.shape[0]))
+
+        # methods x demands to rows of demands (outer) and methods (inner)
+        frame = labels.loc[labels.index.repeat(len(methods))].reset_index(drop=True)
+        frame.insert(0, "year", year)
+        frame.insert(0, "scenario", scenario)
+        frame["method"] = np.tile(method_names, len(labels))
+        frame["unit"] = np.tile(method_units, len(labels))
+        frame["score"] = scores.T.ravel()
+        data.append(frame)
+
+    df = pd.concat(data, ignore_index=True)
+    if path is not None:
+        df.to_csv(path, index=False)
+    return df
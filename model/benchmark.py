@@ -0,0 +1,174 @@
+# file for benchmarking the model steps on synthetic data
+"""
+Benchmark of clean_and_reorganize, calculate_availability and reorder on synthetic
+material_output data (see synthetic_data), no workbook or premise install is needed.
+
+Every case in CASES scales one dimension of the data: regions (up to 1000s of
+sub-national units), years, materials, building types or conversion rate scenarios.
+For every stage the wall time (fastest of `repeats` runs), the peak memory (traced
+with tracemalloc in a separate run) and the rows per second (input rows / wall time)
+are reported.
+
+The results are compared with a saved baseline, stages that are more than
+`tolerance` times slower or use more memory than in the baseline are reported as
+regressions. The baseline is machine specific and is saved locally (BASELINE_PATH).
+
+Run from the 'model' folder: python benchmark.py
+"""
+
+# imports
+from typing import Callable, Tuple
+from time import perf_counter
+import json
+import os
+import tracemalloc
+
+from synthetic_data import synthetic_material_output, synthetic_region_names, MATERIALS
+from extract_stock_data import clean_and_reorganize, calculate_availability
+from scenario_sweep import conversion_rate_ramp, sweep_conversion_rates
+from stock_to_scenario_formatting import select_scenario_data, reorder
+from statics import MARKET_SHARES
+
+BASELINE_PATH = os.path.join(".cache", "benchmark_baseline.json")
+UPDATE_BASELINE = False  # overwrite the baseline with the results of this run
+TOLERANCE = 1.5  # a stage is a regression when it is TOLERANCE times slower/bigger than the baseline
+
+# benchmark cases, the arguments of synthetic_material_output and
+# - keep: BUILDING_DIMENSIONS kept in clean_and_reorganize
+# - n_scenarios: number of conversion rate scenarios in calculate_availability
+CASES = {
+    "base": {},
+    "260 regions": {"n_regions": 260},
+    "2600 regions": {"n_regions": 2600},
+    "years 1900-2100": {"years": range(1900, 2101)},
+    "7 materials": {"materials": MATERIALS},
+    "32 types": {"n_types": 32},
+    "keep type and area": {"keep": ["type", "area"]},
+    "20 scenarios": {"n_scenarios": 20},
+}
+
+
+def measure(func: Callable, repeats: int = 3) -> Tuple[object, dict]:
+    """run func and return its result and the wall time (s, fastest of repeats) and peak memory (MB)"""
+    wall_time = None
+    for _ in range(repeats):
+        t = perf_counter()
+        result = func()
+        wall_time = min(perf_counter() - t, wall_time or float("inf"))
+
+    # memory in a separate run, tracemalloc slows down the run
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, {"wall time (s)": wall_time, "peak memory (MB)": peak / 1024 ** 2}
+
+
+def run_case(n_regions: int = 26,
+             years=range(1970, 2051),
+             materials: list = ("concrete",),
+             n_types: int = 8,
+             n_areas: int = 3,
+             keep: list = None,
+             n_scenarios: int = 1,
+             repeats: int = 3) -> dict:
+    """benchmark the stages of the model for one case, returns {stage: measurements}"""
+    df_orig = synthetic_material_output(n_regions, years, materials, n_types, n_areas)
+    region_names = synthetic_region_names(n_regions)
+    results = {}
+
+    def clean():
+        return clean_and_reorganize(df_orig, prints="none", materials=list(materials),
+                                    keep=keep, region_names=region_names)
+
+    df_clean, results["clean"] = measure(clean, repeats)
+    results["clean"]["rows"] = len(df_orig)
+
+    # sand and gravel supply is only defined for concrete (see MATERIAL_PROD_SPLIT)
+    df_concrete = df_clean.loc[df_clean["material"] == "concrete"].drop(columns="material")
+    rate = conversion_rate_ramp()
+
+    def availability():
+        if n_scenarios == 1:
+            # multi-material pass over all materials, like in the clean stage
+            return calculate_availability(df_clean, rate, rate)
+        scenarios = {f"ramp {i}": {"outflow_conversion_rate": conversion_rate_ramp(end_rate=(i + 1) / n_scenarios),
+                                   "inflow_conversion_rate": rate}
+                     for i in range(n_scenarios)}
+        return sweep_conversion_rates(df_concrete, scenarios)
+
+    df_done, results["availability"] = measure(availability, repeats)
+    results["availability"]["rows"] = len(df_clean) if n_scenarios == 1 else len(df_concrete) * n_scenarios
+
+    # the routes of the scenario data come from the concrete supply
+    if "material" in df_done.columns:
+        df_done = df_done.loc[df_done["material"] == "concrete"].drop(columns="material")
+
+    def scenario_data():
+        return reorder(select_scenario_data(df_done), None if n_scenarios > 1 else "SSP2-Base-image", MARKET_SHARES)
+
+    _, results["reorder"] = measure(scenario_data, repeats)
+    results["reorder"]["rows"] = len(df_done)
+
+    for stage in results.values():
+        stage["rows/s"] = stage["rows"] / stage["wall time (s)"]
+    return results
+
+
+def run_benchmark(cases: dict = CASES, repeats: int = 3, prints: bool = True) -> dict:
+    """benchmark all cases, returns {case: {stage: measurements}}"""
+    results = {}
+    for name, case in cases.items():
+        results[name] = run_case(**case, repeats=repeats)
+        if prints:
+            for stage, m in results[name].items():
+                print(f"{name:<20} {stage:<13} {m['wall time (s)']:8.3f}s {m['peak memory (MB)']:9.1f}MB "
+                      f"{m['rows/s']:12,.0f} rows/s")
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list:
+    """return the regressions of results compared to baseline, as (case, stage, measurement, ratio)"""
+    regressions = []
+    for case, stages in results.items():
+        for stage, m in stages.items():
+            base = baseline.get(case, {}).get(stage)
+            if base is None:
+                continue
+            for measurement in ["wall time (s)", "peak memory (MB)"]:
+                if base[measurement] > 0 and m[measurement] / base[measurement] > tolerance:
+                    regressions.append((case, stage, measurement, m[measurement] / base[measurement]))
+    return regressions
+
+
+def save_baseline(results: dict, path: str = BASELINE_PATH) -> None:
+    """store benchmark results as the baseline"""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_baseline(path: str = BASELINE_PATH) -> dict:
+    """load the baseline, empty if there is none"""
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    results = run_benchmark()
+
+    baseline = load_baseline()
+    if not baseline or UPDATE_BASELINE:
+        save_baseline(results)
+        print(f"Baseline saved to {BASELINE_PATH}")
+    else:
+        regressions = compare(results, baseline)
+        for case, stage, measurement, ratio in regressions:
+            print(f"Regression: {case} | {stage} | {measurement} {ratio:.2f}x the baseline")
+        if not regressions:
+            print(f"No regressions compared to {BASELINE_PATH} (tolerance {TOLERANCE}x)")
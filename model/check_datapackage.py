@@ -0,0 +1,217 @@
+# file for checking the consistency of the datapackage before a premise run
+"""
+Checks datapackage.json, scenario_data.csv, config.yaml and aggregate_LCI.csv against
+each other. The files are read once, lookup tables (sets and dicts) are built from
+them and all checks are done on those, with vectorized checks on the scenario data
+columns. Every mismatch is reported, not only the first one.
+
+Checks:
+- scenario_data: columns match the schema in datapackage.json, number columns are
+  numbers, string columns are not empty, no duplicate rows, one unit per variable,
+  regions are PREMISE regions and scenarios match the 'scenarios' block
+- config: every 'Production|*' variable of the scenario data has a production pathway
+  and every production pathway variable is in the scenario data, markets only
+  include known pathways
+- inventory: every dataset in config that does not exist in the original database
+  is in aggregate_LCI.csv, exchange columns are in the schema of datapackage.json,
+  every activity has one production exchange of its own reference product and
+  exchanges within the inventory link to an activity of the inventory
+
+Run from the 'model' folder: python check_datapackage.py
+"""
+
+# imports
+from typing import Optional
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from utils import Stage
+from inventory import Inventory, load_inventory
+from statics import PREMISE_REGIONS
+
+DATAPACKAGE_DIR = os.path.join("..", "datapackage")
+
+
+def read_datapackage(datapackage_dir: str = DATAPACKAGE_DIR, cache_dir: Optional[str] = None) -> dict:
+    """read datapackage.json and its resources, returns {'datapackage', 'resources', <resource name>: data}"""
+    with open(os.path.join(datapackage_dir, "datapackage.json"), "r", encoding="utf-8") as f:
+        datapackage = json.load(f)
+    data = {"datapackage": datapackage, "resources": {r["name"]: r for r in datapackage.get("resources", [])}}
+    for name, resource in data["resources"].items():
+        path = os.path.join(datapackage_dir, resource["path"])
+        if not os.path.isfile(path):
+            data[name] = None
+        elif resource.get("format") == "yaml":
+            with open(path, "r", encoding=resource.get("encoding", "utf-8")) as f:
+                data[name] = yaml.safe_load(f)
+        elif name == "inventories":
+            data[name] = load_inventory(path, cache_dir) if cache_dir is not None else Inventory.from_csv(path)
+        else:
+            # everything as text, so the types can be checked against the schema
+            data[name] = pd.read_csv(path, dtype=str, keep_default_na=False,
+                                     encoding=resource.get("encoding", "utf-8"))
+    return data
+
+
+def check_scenario_data(df: pd.DataFrame, resource: dict, scenarios: dict) -> list:
+    """check the scenario data against its schema and the scenarios of datapackage.json"""
+    errors = []
+    fields = resource.get("schema", {}).get("fields", [])
+    names = [field["name"] for field in fields]
+    if list(df.columns) != names:
+        errors.append(f"scenario_data columns {list(df.columns)} do not match the schema {names}")
+    missing_values = set(resource.get("schema", {}).get("missingValues", [""]))
+
+    for field in fields:
+        if field["name"] not in df.columns:
+            continue
+        values = df[field["name"]]
+        missing = values.isin(missing_values).to_numpy()
+        if field["type"] == "number":
+            invalid = pd.to_numeric(values.where(~missing), errors="coerce").isna().to_numpy() & ~missing
+            rows = np.flatnonzero(invalid)
+        else:
+            rows = np.flatnonzero(missing)
+        if len(rows):
+            kind = "not a number" if field["type"] == "number" else "empty"
+            errors.append(f"scenario_data column '{field['name']}' is {kind} in {len(rows)} rows "
+                          f"(first rows: {(rows[:5] + 2).tolist()})")
+
+    keys = [col for col in ["scenario", "region", "variables"] if col in df.columns]
+    duplicated = df.duplicated(keys, keep=False).to_numpy()
+    if duplicated.any():
+        errors.append(f"scenario_data has {duplicated.sum()} duplicate rows for {keys}: "
+                      f"{df.loc[duplicated, keys].drop_duplicates().head(5).values.tolist()}")
+    if "unit" in df.columns and "variables" in df.columns:
+        units = df.groupby("variables")["unit"].nunique()
+        for variable in units.index[units > 1]:
+            errors.append(f"scenario_data variable '{variable}' has several units")
+    if "region" in df.columns:
+        for region in sorted(set(df["region"]) - set(PREMISE_REGIONS.values())):
+            errors.append(f"scenario_data region '{region}' is not a PREMISE region")
+    if "scenario" in df.columns:
+        data_scenarios = set(df["scenario"])
+        for scenario in sorted(data_scenarios - set(scenarios)):
+            errors.append(f"scenario '{scenario}' is in scenario_data but not in datapackage.json 'scenarios'")
+        for scenario in sorted(set(scenarios) - data_scenarios):
+            errors.append(f"scenario '{scenario}' is in datapackage.json 'scenarios' but not in scenario_data")
+    return errors
+
+
+def check_config(config: dict, variables: set) -> list:
+    """check that the production pathways of config match the Production|* variables of the scenario data"""
+    errors = []
+    pathways = config.get("production pathways") or {}
+    pathway_variables = {}
+    for pathway, settings in pathways.items():
+        variable = (settings.get("production volume") or {}).get("variable")
+        if variable is None:
+            errors.append(f"config production pathway '{pathway}' has no production volume variable")
+        else:
+            pathway_variables[variable] = pathway
+
+    production = {variable for variable in variables if variable.startswith("Production|")}
+    for variable in sorted(production - set(pathway_variables)):
+        errors.append(f"scenario_data variable '{variable}' has no production pathway in config")
+    for variable in sorted(set(pathway_variables) - production):
+        errors.append(f"config production pathway '{pathway_variables[variable]}' variable '{variable}' "
+                      f"is not in scenario_data")
+
+    for market in config.get("markets") or []:
+        for pathway in sorted(set(market.get("includes") or []) - set(pathways)):
+            errors.append(f"config market '{market.get('name')}' includes unknown pathway '{pathway}'")
+    return errors
+
+
+def new_datasets(config: dict) -> list:
+    """return (where, name, reference product) of every config dataset that does not exist in the original database"""
+    datasets = [(f"regionalize dataset '{d.get('name')}'", d.get("name"), d.get("reference product"))
+                for d in (config.get("regionalize") or {}).get("datasets") or []
+                if d.get("exists in original database") is False]
+    datasets += [(f"production pathway '{pathway}'", alias.get("name"), alias.get("reference product"))
+                 for pathway, settings in (config.get("production pathways") or {}).items()
+                 for alias in [settings.get("ecoinvent alias") or {}]
+                 if alias.get("exists in original database") is False]
+    return datasets
+
+
+def column_is(inventory: Inventory, column: str, value: str) -> np.ndarray:
+    """return a mask of the exchanges with value in a text column, all False if the column does not exist"""
+    if column not in inventory.columns or value not in inventory.strings:
+        return np.zeros(len(inventory.columns["amount"]), dtype=bool)
+    return np.asarray(inventory.columns[column]) == inventory.strings.index(value)
+
+
+def check_inventory(inventory: Inventory, resource: dict, config: dict) -> list:
+    """check the inventory against its schema, the new datasets of config and its own links"""
+    errors = []
+    fields = {field["name"] for field in resource.get("schema", {}).get("fields", [])}
+    for column in sorted(set(inventory.columns) - fields):
+        errors.append(f"inventory exchange column '{column}' is not in the schema of datapackage.json")
+
+    products = {(name, product) for name, product, _ in inventory.index}
+    for where, name, product in new_datasets(config):
+        if (name, product) not in products:
+            errors.append(f"config {where} ('{name}', '{product}') does not exist in the original database "
+                          f"and is not in the inventory")
+
+    df = inventory.to_frame()
+    is_production = column_is(inventory, "type", "production")
+    production = df.loc[is_production]
+    # production exchanges per activity (so per name, reference product and location, like premise)
+    counts = np.zeros(len(inventory), dtype=int)
+    starts = inventory.exchange_start[:-1]
+    has_exchanges = np.diff(inventory.exchange_start) > 0  # reduceat needs the start of a non-empty range
+    if has_exchanges.any():
+        counts[has_exchanges] = np.add.reduceat(is_production.astype(int), starts[has_exchanges])
+    keys = list(inventory.index)
+    for i in np.flatnonzero(counts != 1):
+        errors.append(f"inventory activity {keys[i]} has {counts[i]} production exchanges, not 1")
+    own_product = ((production["name"] == production["activity name"])
+                   & (production["reference product"] == production["activity reference product"]))
+    for _, row in production.loc[~own_product].iterrows():
+        errors.append(f"inventory activity '{row['activity name']}' ('{row['activity reference product']}') "
+                      f"produces '{row['name']}' ('{row['reference product']}')")
+
+    internal = df.loc[column_is(inventory, "database", inventory.database) & ~is_production]
+    linked = pd.Series(list(zip(internal["name"], internal["reference product"], internal["location"])),
+                       index=internal.index, dtype=object).isin(set(inventory.index))
+    for _, row in internal.loc[~linked.to_numpy()].iterrows():
+        errors.append(f"inventory activity '{row['activity name']}' has an exchange with "
+                      f"('{row['name']}', '{row['reference product']}', '{row['location']}') "
+                      f"that is not in the inventory")
+    return errors
+
+
+def check_datapackage(datapackage_dir: str = DATAPACKAGE_DIR, cache_dir: Optional[str] = None) -> list:
+    """check all files of the datapackage, returns a list of all errors (empty if consistent)"""
+    data = read_datapackage(datapackage_dir, cache_dir)
+    errors = [f"resource '{name}' file '{resource['path']}' does not exist"
+              for name, resource in data["resources"].items() if data[name] is None]
+    for name in ["scenario_data", "config", "inventories"]:
+        if name not in data["resources"]:
+            errors.append(f"datapackage.json has no resource '{name}'")
+    df, config, inventory = data.get("scenario_data"), data.get("config"), data.get("inventories")
+
+    if df is not None:
+        errors += check_scenario_data(df, data["resources"]["scenario_data"],
+                                      data["datapackage"].get("scenarios", {}))
+    if config is not None:
+        errors += check_config(config, set(df["variables"]) if df is not None and "variables" in df else set())
+    if inventory is not None:
+        errors += check_inventory(inventory, data["resources"]["inventories"], config or {})
+    return errors
+
+
+if __name__ == "__main__":
+    with Stage("check", message="Datapackage checked", prints="end"):
+        errors = check_datapackage()
+    for error in errors:
+        print(f"- {error}")
+    print(f"{len(errors)} errors found")
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,82 @@
+# file for checking and compiling conversion rates
+"""
+Conversion rates are given as a single number or as a dict with an 'any' default and
+one value per year, region or year/region pair (e.g. {2030: 0.2}, {"Brazil": 0.2} or
+{"2030/Brazil": 0.2}). They are compiled once to a dense region x year float array
+that the stock balance can index directly.
+"""
+
+# imports
+from typing import Union
+import numpy as np
+
+KEY_TYPES = ["year", "region", "year/region", "region/year"]
+
+
+def check_key_type(key_type: str) -> None:
+    """raise if key_type is not one of the supported conversion rate key types"""
+    if key_type not in KEY_TYPES:
+        raise BaseException(f"'key_type' should be 'year', 'region' or 'year/region' but got '{key_type}'")
+
+
+def convert_check_types(variable: Union[float, int, dict], var_name: str) -> dict:
+    """Ensure that variables are in correct format and possible"""
+
+    # ensure format
+    if isinstance(variable, (float, int)):
+        variable = {
+            "any": float(variable)
+        }
+    elif isinstance(variable, dict):
+        if "any" not in variable.keys():
+            raise BaseException(f"Variable '{var_name}' is given as dict, it MUST contain 'any' as key")
+    else:
+        raise BaseException(f"variable must be of type `dict`, `float` or `int` "
+                            f"but type for '{var_name}' given was {type(variable)}")
+
+    # ensure rates are possible, all values are checked at once
+    keys = list(variable.keys())
+    values = np.array(list(variable.values()), dtype=float)
+    impossible = ~((values >= 0) & (values <= 1))
+    if impossible.any():
+        wrong = ", ".join(f"{keys[i]} for {values[i]}" for i in np.flatnonzero(impossible))
+        raise BaseException(f"Conversions rates must be higher or equal to 0 (0%) "
+                            f"and lower or equal to 1 (100%), rate is: "
+                            f"{var_name}: {wrong}")
+    return variable
+
+
+def compile_rate(variable: Union[float, int, dict],
+                 var_name: str,
+                 regions: np.ndarray,
+                 years: np.ndarray,
+                 key_type: str = "year") -> np.ndarray:
+    """check a conversion rate and compile it to a dense region x year float array
+
+    Keys that do not match any of the regions/years are ignored, all other region/year
+    combinations get the 'any' rate. For 'year' and 'region' key types the result is
+    a read-only broadcast of a single row/column.
+    """
+    variable = convert_check_types(variable, var_name)
+    check_key_type(key_type)
+    default = float(variable["any"])
+
+    if key_type == "year":
+        rates = np.array([variable.get(year, default) for year in years], dtype=float)
+        return np.broadcast_to(rates[np.newaxis, :], (len(regions), len(years)))
+    if key_type == "region":
+        rates = np.array([variable.get(region, default) for region in regions], dtype=float)
+        return np.broadcast_to(rates[:, np.newaxis], (len(regions), len(years)))
+
+    # year/region keys are parsed once and written to the grid directly
+    region_pos = {str(region): i for i, region in enumerate(regions)}
+    year_pos = {str(year): j for j, year in enumerate(years)}
+    grid = np.full((len(regions), len(years)), default)
+    for key, value in variable.items():
+        if key == "any":
+            continue
+        year, _, region = str(key).partition("/")
+        i, j = region_pos.get(region), year_pos.get(year)
+        if i is not None and j is not None:
+            grid[i, j] = value
+    return grid
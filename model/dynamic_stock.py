@@ -0,0 +1,140 @@
+# file for the dynamic stock model: outflow from inflow and building lifetimes
+"""
+Inflow-driven dynamic stock model. Instead of taking 'outflow (kt)' from the Deetman
+et al. (2020) data, the outflow is calculated from the inflow and a lifetime
+distribution: material that flows into the stock in year t leaves it in year t + a with
+the probability that a building reaches an age of a years:
+
+    outflow[t] = sum_a inflow[t - a] * discard[a]
+
+This is a convolution of every inflow series with the discard distribution. It is
+calculated with a (real) FFT, batched over all series (regions, building types, ...)
+and lifetime variants at once, instead of a direct convolution per series.
+
+Lifetimes are given per region or building type, with a 'default' for all others:
+    lifetimes = {
+        "default": {"dist": "weibull", "shape": 2.0, "scale": 75},
+        "India": {"dist": "normal", "mean": 50, "std": 15},
+        "residential": {"dist": "weibull", "shape": 1.8, "scale": 90},  # needs keep=["type"]
+    }
+A region lifetime has priority over a type lifetime. Normal distributions are
+truncated at age 0.
+
+Only inflow within the data is used (no stock built before the first year), so the
+outflow of the first decades is lower than that of the original data.
+
+Example:
+    df_dynamic = dynamic_outflow(df_clean, lifetimes)
+    df_done = calculate_availability(df_dynamic, ...)
+"""
+
+# imports
+from typing import Tuple
+import json
+
+import numpy as np
+import pandas as pd
+from scipy import fft, stats
+
+from frame_schema import float_dtype
+from statics import UNIT, BUILDING_DIMENSIONS
+
+LIFETIMES = {
+    # default lifetime of buildings, Weibull distributed with a mean of about 66 years
+    "default": {"dist": "weibull", "shape": 2.0, "scale": 75},
+}
+
+
+def discard_distribution(spec: dict, n_years: int) -> np.ndarray:
+    """return the probability that material leaves the stock at age 0, 1, ..., n_years - 1"""
+    ages = np.arange(n_years + 1, dtype=float)
+    dist = spec["dist"]
+    if dist == "weibull":
+        if spec["shape"] <= 0 or spec["scale"] <= 0:
+            raise BaseException(f"Weibull shape and scale must be > 0: {spec}")
+        cdf = stats.weibull_min.cdf(ages, spec["shape"], scale=spec["scale"])
+    elif dist == "normal":
+        if spec["std"] <= 0:
+            raise BaseException(f"Normal std must be > 0: {spec}")
+        below_zero = stats.norm.cdf(0, spec["mean"], spec["std"])
+        cdf = (stats.norm.cdf(ages, spec["mean"], spec["std"]) - below_zero) / (1 - below_zero)
+    else:
+        raise BaseException(f"Unknown lifetime distribution '{dist}', options are weibull, normal")
+    return np.diff(cdf)
+
+
+def convolve_outflow(inflow: np.ndarray, discard: np.ndarray) -> np.ndarray:
+    """return the outflow of inflow series and discard distributions, year is the last axis
+
+    inflow and discard must be broadcastable, e.g. (series, year) and
+    (variant, series, year) give a (variant, series, year) outflow.
+    """
+    n_years = inflow.shape[-1]
+    n = fft.next_fast_len(2 * n_years - 1, real=True)  # zero padded, so the convolution is not circular
+    outflow = fft.irfft(fft.rfft(inflow, n) * fft.rfft(discard, n), n)[..., :n_years]
+    return np.maximum(outflow, 0.0)  # remove round-off below 0
+
+
+def series_arrays(df: pd.DataFrame) -> Tuple[list, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """reshape cleaned data to a series x year inflow array (a series per material, region and building dimensions)
+
+    Returns the series keys, the years, the series and year index of every row in df
+    and the inflow array.
+    """
+    keys = [col for col in ["material", "Region"] + BUILDING_DIMENSIONS if col in df.columns]
+    series_idx = df.groupby(keys, observed=True, sort=False).ngroup().to_numpy()
+    years, year_idx = np.unique(df["year"].to_numpy(), return_inverse=True)
+    if len(years) > 1 and np.any(np.diff(years) != 1):
+        raise BaseException("The dynamic stock model needs data for every year, years are not consecutive")
+    inflow = np.zeros((series_idx.max() + 1 if len(df) else 0, len(years)))
+    inflow[series_idx, year_idx] = df[f"inflow ({UNIT})"].to_numpy(dtype=float)
+    return keys, years, series_idx, year_idx, inflow
+
+
+def series_lifetimes(df: pd.DataFrame, keys: list, series_idx: np.ndarray, lifetimes: dict) -> list:
+    """return the lifetime spec of every series: of its region, else of its type, else 'default'"""
+    first = pd.Series(np.arange(len(df))).groupby(series_idx).first().to_numpy()
+    series = df[keys].iloc[first]
+    regions = series["Region"].astype(str).to_numpy()
+    types = series["type"].astype(str).to_numpy() if "type" in keys else [None] * len(series)
+    specs = []
+    for region, building_type in zip(regions, types):
+        spec = lifetimes.get(region, lifetimes.get(building_type, lifetimes.get("default")))
+        if spec is None:
+            raise BaseException(f"No lifetime for '{region}' and no 'default' lifetime")
+        specs.append(spec)
+    return specs
+
+
+def discard_array(specs: list, n_years: int) -> np.ndarray:
+    """return the series x age discard array of lifetime specs, every unique spec is calculated once"""
+    unique = {}
+    rows = [unique.setdefault(json.dumps(spec, sort_keys=True), len(unique)) for spec in specs]
+    distributions = np.stack([discard_distribution(json.loads(spec), n_years) for spec in unique])
+    return distributions[rows]
+
+
+def lifetime_variants(df: pd.DataFrame, variants: dict) -> dict:
+    """calculate the outflow for several lifetime variants in one batched FFT
+
+    df is cleaned data (clean_and_reorganize, optionally with materials or building
+    dimensions) and variants is {name: lifetimes}. Returns {name: df with the
+    calculated outflow}, which can be used directly in calculate_availability.
+    """
+    keys, years, series_idx, year_idx, inflow = series_arrays(df)
+    discard = np.stack([discard_array(series_lifetimes(df, keys, series_idx, lifetimes), len(years))
+                        for lifetimes in variants.values()])
+    outflow = convolve_outflow(inflow, discard)  # variant x series x year
+
+    dtype = float_dtype(df)
+    results = {}
+    for v, name in enumerate(variants):
+        result = df.copy()
+        result[f"outflow ({UNIT})"] = outflow[v, series_idx, year_idx].astype(dtype, copy=False)
+        results[name] = result
+    return results
+
+
+def dynamic_outflow(df: pd.DataFrame, lifetimes: dict = LIFETIMES) -> pd.DataFrame:
+    """return cleaned data with the outflow calculated from the inflow and lifetimes"""
+    return lifetime_variants(df, {"lifetimes": lifetimes})["lifetimes"]
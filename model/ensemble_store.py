@@ -0,0 +1,228 @@
+# file for storing large scenario ensembles on disk
+"""
+Chunked, memory-mapped store for scenario x variables x region x year arrays (e.g. the
+output of sweeps, Monte Carlo draws or many generated scenarios).
+
+A store is a folder with:
+- index.json: the coordinates of every dimension, the unit, the chunk size and the chunks
+- chunk_00000.npy, ...: .npy files with up to chunk_size scenarios each
+
+Scenarios are appended while they are calculated (append, append_frame), only the
+chunk that is written to is open. Readers memory-map the chunks, so selecting one
+region or variable only reads that part from disk. Any selection can be exported in
+the premise scenario_data layout (to_scenario_data).
+
+Example:
+    store = EnsembleStore.create("ensemble", variables, regions, years)
+    for df_scenario in scenario_frames:  # e.g. reorder output per scenario
+        store.append_frame(df_scenario)
+    store = EnsembleStore("ensemble")
+    bra = store.select(region="BRA")  # scenario x variables x year array
+    store.to_scenario_data("scenario_data.csv", scenario=["SSP2-Base-image"])
+"""
+
+# imports
+from typing import Optional, Union
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from statics import UNIT
+
+DIMS = ["scenario", "variables", "region", "year"]
+INDEX_FILE = "index.json"
+CHUNK_SIZE = 64  # scenarios per chunk file
+
+
+class EnsembleStore:
+    """chunked scenario x variables x region x year array on disk"""
+
+    def __init__(self, path: str):
+        """open an existing store"""
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), "r") as f:
+            self.index = json.load(f)
+        self._chunk = None  # chunk that is open for writing: (chunk number, memmap)
+
+    @classmethod
+    def create(cls,
+               path: str,
+               variables: list,
+               regions: list,
+               years: list,
+               chunk_size: int = CHUNK_SIZE,
+               dtype: str = "float64",
+               unit: str = UNIT) -> "EnsembleStore":
+        """create a new (empty) store, the variables, regions and years are fixed"""
+        if os.path.exists(os.path.join(path, INDEX_FILE)):
+            raise BaseException(f"A store already exists in '{path}'")
+        os.makedirs(path, exist_ok=True)
+        index = {
+            "dims": DIMS,
+            "coords": {"scenario": [], "variables": [str(v) for v in variables],
+                       "region": [str(r) for r in regions], "year": [int(y) for y in years]},
+            "unit": unit,
+            "dtype": dtype,
+            "chunk_size": chunk_size,
+            "chunks": [],
+        }
+        _write_index(path, index)
+        return cls(path)
+
+    @property
+    def scenarios(self) -> list:
+        return self.index["coords"]["scenario"]
+
+    @property
+    def shape(self) -> tuple:
+        return tuple(len(self.index["coords"][dim]) for dim in DIMS)
+
+    def _chunk_file(self, number: int) -> str:
+        return os.path.join(self.path, f"chunk_{number:05d}.npy")
+
+    def _open_chunk(self, number: int, mode: str = "r") -> np.memmap:
+        """memory-map a chunk file, a new chunk is created in mode 'w+'"""
+        path = self._chunk_file(number)
+        if mode == "w+":
+            shape = (self.index["chunk_size"],) + self.shape[1:]
+            chunk = np.lib.format.open_memmap(path, mode="w+", dtype=self.index["dtype"], shape=shape)
+            chunk[:] = np.nan
+            return chunk
+        return np.load(path, mmap_mode=mode)
+
+    def append(self, scenarios: list, values: np.ndarray) -> None:
+        """append scenarios with a scenario x variables x region x year array of values"""
+        values = np.asarray(values)
+        if values.shape != (len(scenarios),) + self.shape[1:]:
+            raise BaseException(f"Values must have shape {(len(scenarios),) + self.shape[1:]}, "
+                                f"not {values.shape}")
+        stored = set(self.scenarios)
+        duplicate = sorted({s for s in scenarios if s in stored or list(scenarios).count(s) > 1})
+        if duplicate:
+            raise BaseException(f"Scenarios are already in the store or given twice: {duplicate}")
+
+        chunk_size = self.index["chunk_size"]
+        written = 0
+        while written < len(scenarios):
+            n_stored = len(self.scenarios)
+            number, position = divmod(n_stored, chunk_size)
+            if self._chunk is None or self._chunk[0] != number:
+                self.flush()
+                mode = "r+" if position > 0 else "w+"
+                self._chunk = (number, self._open_chunk(number, mode))
+                if mode == "w+":
+                    self.index["chunks"].append({"file": os.path.basename(self._chunk_file(number)),
+                                                 "start": n_stored, "stop": n_stored})
+            n = min(chunk_size - position, len(scenarios) - written)
+            self._chunk[1][position:position + n] = values[written:written + n]
+            self.scenarios.extend(str(s) for s in scenarios[written:written + n])
+            self.index["chunks"][number]["stop"] = n_stored + n
+            written += n
+        self.flush()
+
+    def append_frame(self, df: pd.DataFrame) -> None:
+        """append the scenarios of a frame in the scenario_data layout (e.g. from reorder)
+
+        Variables, regions and years that are not in the store are ignored, missing
+        values are NaN.
+        """
+        coords = self.index["coords"]
+        scenarios = list(pd.unique(df["scenario"].astype(str)))
+        values = np.full((len(scenarios),) + self.shape[1:], np.nan, dtype=self.index["dtype"])
+        scenario_idx = pd.Index(scenarios).get_indexer(df["scenario"].astype(str))
+        variable_idx = pd.Index(coords["variables"]).get_indexer(df["variables"].astype(str))
+        region_idx = pd.Index(coords["region"]).get_indexer(df["region"].astype(str))
+        rows = (variable_idx >= 0) & (region_idx >= 0)
+        for y, year in enumerate(coords["year"]):
+            if str(year) in df.columns:
+                values[scenario_idx[rows], variable_idx[rows], region_idx[rows], y] = \
+                    df[str(year)].to_numpy(dtype=float)[rows]
+        self.append(scenarios, values)
+
+    def flush(self) -> None:
+        """write the open chunk and the index to disk"""
+        if self._chunk is not None:
+            self._chunk[1].flush()
+        _write_index(self.path, self.index)
+
+    def select(self,
+               scenario: Union[str, list, None] = None,
+               variables: Union[str, list, None] = None,
+               region: Union[str, list, None] = None,
+               year: Union[int, list, None] = None) -> np.ndarray:
+        """return a selection as array, only the selected part of the chunks is read
+
+        Every dimension can be a single value (the dimension is dropped), a list of
+        values or None (all values).
+        """
+        selection = [_positions(self.index["coords"][dim], value)
+                     for dim, value in zip(DIMS, [scenario, variables, region, year])]
+        scenario_pos = selection[0][0]
+        chunk_size = self.index["chunk_size"]
+
+        result = np.empty((len(scenario_pos),) + tuple(len(pos) for pos, _ in selection[1:]),
+                          dtype=self.index["dtype"])
+        chunk_numbers = scenario_pos // chunk_size
+        for number in np.unique(chunk_numbers):
+            chunk = self._open_chunk(number)
+            rows = np.flatnonzero(chunk_numbers == number)
+            # one indexing of the memmap with all dimensions, so only the selected block is read
+            result[rows] = chunk[np.ix_(scenario_pos[rows] - number * chunk_size,
+                                        *[pos for pos, _ in selection[1:]])]
+
+        drop = tuple(axis for axis, (_, single) in enumerate(selection) if single)
+        return result.squeeze(axis=drop) if drop else result
+
+    def to_scenario_data(self,
+                         path: Optional[str] = None,
+                         scenario: Union[str, list, None] = None,
+                         variables: Union[str, list, None] = None,
+                         region: Union[str, list, None] = None,
+                         year: Union[int, list, None] = None) -> pd.DataFrame:
+        """return a selection in the premise scenario_data layout, written to path (csv) if given
+
+        Rows (scenario, region, variables) without any value are left out.
+        """
+        coords = self.index["coords"]
+        selection = {dim: [coords[dim][i] for i in _positions(coords[dim], value)[0]]
+                     for dim, value in zip(DIMS, [scenario, variables, region, year])}
+        values = self.select(*[selection[dim] for dim in DIMS])  # scenario x variables x region x year
+
+        values = values.transpose(0, 2, 1, 3).reshape(-1, len(selection["year"]))  # rows: scenario, region, variables
+        grid = np.meshgrid(np.arange(len(selection["scenario"])), np.arange(len(selection["region"])),
+                           np.arange(len(selection["variables"])), indexing="ij")
+        df = pd.DataFrame({
+            "scenario": np.asarray(selection["scenario"], dtype=object)[grid[0].ravel()],
+            "region": np.asarray(selection["region"], dtype=object)[grid[1].ravel()],
+            "variables": np.asarray(selection["variables"], dtype=object)[grid[2].ravel()],
+            "unit": self.index["unit"],
+        })
+        df = pd.concat([df, pd.DataFrame(values, columns=[str(y) for y in selection["year"]])], axis=1)
+        df = df.loc[~np.isnan(values).all(axis=1)].reset_index(drop=True)
+
+        if path is not None:
+            df.to_csv(path, index=False)
+        return df
+
+
+def _positions(coords: list, value) -> tuple:
+    """return the positions of value(s) in coords and whether a single value was given"""
+    if value is None:
+        return np.arange(len(coords)), False
+    single = not isinstance(value, (list, tuple, np.ndarray))
+    values = [value] if single else list(value)
+    lookup = {c: i for i, c in enumerate(coords)}
+    missing = [v for v in values if v not in lookup]
+    if missing:
+        raise BaseException(f"Not in the store: {missing}")
+    return np.array([lookup[v] for v in values], dtype=int), single
+
+
+def _write_index(path: str, index: dict) -> None:
+    """write the index atomically"""
+    tmp_path = os.path.join(path, f"{INDEX_FILE}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp_path, os.path.join(path, INDEX_FILE))
@@ -0,0 +1,92 @@
+# file for caching excel sheets as columnar (feather) files
+"""
+Reading the Deetman et al. (2020) workbook with pd.read_excel takes most of the runtime.
+The first read of a sheet is stored as a feather file, keyed by the content hash of the
+workbook and the sheet name, later reads memory-map that file instead.
+
+The cache is capped to CACHE_MAX_BYTES, least recently used files are evicted first.
+Use clear_cache to invalidate (part of) the cache.
+"""
+
+# imports
+from typing import Optional, Tuple, Union
+import hashlib
+import os
+import re
+
+import pandas as pd
+
+from utils import write_feather, read_feather
+
+CACHE_DIR = os.path.join(".cache", "excel")
+CACHE_MAX_BYTES = 2 * 1024 ** 3  # 2 GB
+
+
+def file_hash(path: str, chunk_size: int = 1024 ** 2) -> str:
+    """return the sha256 hash of the content of a file"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_path(workbook_hash: str, sheet_name: Union[str, int], cache_dir: str = CACHE_DIR) -> str:
+    """return the cache file path for a sheet of a workbook"""
+    safe_sheet = re.sub(r"[^\w\-]+", "_", str(sheet_name))
+    return os.path.join(cache_dir, f"{workbook_hash[:32]}-{safe_sheet}.feather")
+
+
+def read_cache(path: str) -> pd.DataFrame:
+    """memory-map a feather cache file and mark it as recently used for the eviction"""
+    df = read_feather(path)
+    os.utime(path)
+    return df
+
+
+def evict(cache_dir: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES) -> list:
+    """remove least recently used cache files until the cache is at most max_bytes, returns removed files"""
+    if not os.path.isdir(cache_dir):
+        return []
+    files = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir) if f.endswith(".feather")]
+    files.sort(key=os.path.getmtime, reverse=True)  # most recently used first
+
+    removed = []
+    total = 0
+    for path in files:
+        total += os.path.getsize(path)
+        if total > max_bytes:
+            os.remove(path)
+            removed.append(path)
+    return removed
+
+
+def clear_cache(cache_dir: str = CACHE_DIR, workbook: Optional[str] = None) -> list:
+    """invalidate the cache, only for one workbook file if given, returns removed files"""
+    if not os.path.isdir(cache_dir):
+        return []
+    prefix = file_hash(workbook)[:32] if workbook is not None else ""
+    removed = []
+    for f in os.listdir(cache_dir):
+        if f.startswith(prefix) and (f.endswith(".feather") or f.endswith(".tmp")):
+            os.remove(os.path.join(cache_dir, f))
+            removed.append(os.path.join(cache_dir, f))
+    return removed
+
+
+def read_excel_cached(workbook: str,
+                      sheet_name: Union[str, int] = 0,
+                      cache_dir: str = CACHE_DIR,
+                      max_bytes: int = CACHE_MAX_BYTES) -> Tuple[pd.DataFrame, bool]:
+    """read a sheet from an excel workbook through the cache
+
+    Returns the dataframe and whether the read was a cache hit.
+    """
+    path = cache_path(file_hash(workbook), sheet_name, cache_dir)
+    if os.path.isfile(path):
+        return read_cache(path), True
+
+    df = pd.read_excel(workbook, sheet_name=sheet_name)
+    write_feather(df, path)
+    evict(cache_dir, max_bytes)
+    return df, False
@@ -16,21 +16,41 @@ Deetman et al. 2020: https://doi.org/10.1016/j.jclepro.2019.118658
 """
 
 # imports
-from typing import Union, Tuple
+from typing import Union, Tuple, Optional
 import pandas as pd
 import numpy as np
 from copy import deepcopy
 from time import time
 
-from utils import df_status
-from statics import UNIT, IMAGE_REGIONS, GRAVEL_SAND_PROD_SPLIT, GRAVEL_SAND_USE_SPLIT
+from utils import write_feather, Stage, profiled
+from excel_cache import read_excel_cached
+from stock_balance import stock_balance
+from frame_schema import apply_schema, float_dtype, memory_report
+from conversion_rates import convert_check_types, check_key_type, compile_rate
+from statics import (UNIT, IMAGE_REGIONS, GRAVEL_SAND_PROD_SPLIT, GRAVEL_SAND_USE_SPLIT,
+                     MATERIAL_PROD_SPLIT, MATERIAL_USE_SPLIT, BUILDING_DIMENSIONS)
 
 
 def clean_and_reorganize(df: pd.DataFrame, 
-                         prints: str ="end") -> pd.DataFrame:
+                         prints: str ="end",
+                         materials: Union[str, list] = "concrete",
+                         keep: Optional[list] = None,
+                         region_names: dict = IMAGE_REGIONS,
+                         float32: bool = False) -> pd.DataFrame:
     """remove un-needed data and reorganize format.
     
     output format is a list with columns: Region, year, inflow and outflow
+
+    materials is the material to keep, or a list of materials. A list of materials is
+    processed in a single groupby/melt/pivot and the output gets 'material' as first column.
+
+    keep is an optional list of BUILDING_DIMENSIONS ('type', 'area') that are kept
+    (as categoricals, after 'Region') instead of summed.
+
+    region_names maps the region codes to region names, IMAGE_REGIONS by default.
+
+    The output has the column types of frame_schema.py (e.g. 'Region' as categorical), with
+    float32 amounts if float32.
     
     prints is optional variable for printing convenience data, options are 
     - all (print every step)
@@ -38,48 +58,54 @@ def clean_and_reorganize(df: pd.DataFrame,
     - anything else (don't print)
     """
 
-    t = time()
+    with Stage("clean_and_reorganize", df, "Cleaned and reorganized", prints) as stage:
+        # drop all "material" that are not in materials
+        multi_material = not isinstance(materials, str)
+        df = df.loc[df["material"].isin(materials if multi_material else [materials])]
+        stage.step(f"Filtered to only {materials} material flows", df)
+
+        # drop all "flow" that are not "stock"
+        df = df.loc[df["flow"] != "stock"]
+        stage.step("Filtered to only non-'stock' material flows", df)
+
+        # write correct region names from region codes
+        df["Region"] = df["Region"].apply(lambda x: region_names[x])
+
+        # merge all "type" and "area" (that are not kept) for given ("material",) "Region" and "flow"
+        keep = [dim for dim in BUILDING_DIMENSIONS if dim in (keep or [])]
+        keys = (["material"] if multi_material else []) + ["Region"] + keep + ["flow"]
+        df = df.drop(columns=[dim for dim in BUILDING_DIMENSIONS if dim not in keep]
+                             + ([] if multi_material else ["material"]))
+        # only the kept columns are converted (astype splits the frame into a block per year column)
+        df = df.assign(**{dim: df[dim].astype("category") for dim in keep})
+        df = df.groupby(keys, observed=True).sum().reset_index()
+        stage.step("Grouped flows with same 'type' and 'area'", df)
+
+        # transform from table to list 
+        df = df.melt(id_vars=keys, var_name="year", value_name=f"amount ({UNIT})")
+        df = df.pivot(index=keys[:-1] + ["year"], columns="flow", values=f"amount ({UNIT})").reset_index()
+        df.columns.name = None
+        df.rename(columns={"inflow": f"inflow ({UNIT})", "outflow": f"outflow ({UNIT})"}, inplace=True)
+        stage.step("Converted to list", df)
+
+        # finally, convert to the compact column types of the schema (e.g. 'year' to int16)
+        df_compact = apply_schema(df, float32)
+        stage.step("Applied schema", df_compact)
+        if prints == "all":
+            print(f"Memory usage: {memory_report(df, df_compact)}")
+        df = stage.output(df_compact)
 
-    # drop all "material" that are not "concrete"
-    df = df.loc[df["material"] == "concrete"]
-    if prints == "all":
-        print(f"Filtered to only 'concrete' material flows: {df_status(df)}")
-    
-    # drop all "flow" that are not "stock"
-    df = df.loc[df["flow"] != "stock"]
-    if prints == "all":
-        print(f"Filtered to only non-'stock' material flows: {df_status(df)}")
-
-    # write correct region names from region codes
-    df["Region"] = df["Region"].apply(lambda x: IMAGE_REGIONS[x])
-    
-    # merge all "type" and "area" for given "Region" and "flow"
-    df = df.drop(columns=["type", "area", "material"])
-    df = df.groupby(["Region", "flow"]).sum().reset_index()
-    if prints == "all":
-        print(f"Grouped flows with same 'type' and 'area': {df_status(df)}")
-    
-    # transform from table to list 
-    df = df.melt(id_vars=["Region", "flow"], var_name="year", value_name=f"amount ({UNIT})")
-    df = df.pivot(index=["Region", "year"], columns="flow", values=f"amount ({UNIT})").reset_index()
-    df.columns.name = None
-    df.rename(columns={"inflow": f"inflow ({UNIT})", "outflow": f"outflow ({UNIT})"}, inplace=True)
-    if prints == "all":
-        print(f"Converted to list: {df_status(df)}")
-    elif prints == "end":
-        print(f"Cleaned and reorganized: {df_status(df, time() - t)}")
-        
-    # finally, convert the unit type of column 'year' to int
-    df.astype({"year": "int32"}).dtypes
-    
     return df
 
 
-def calculate_availability(df: pd.DataFrame,
-                           outflow_conversion_rate: Union[dict, float, int] = 1.0,
-                           inflow_conversion_rate: Union[dict, float, int] = 1.0,
-                           key_type: str = "year") -> pd.DataFrame:
-    """calculate and add columns for sand and gravel supply and stock
+def calculate_availability_loop(df: pd.DataFrame,
+                                outflow_conversion_rate: Union[dict, float, int] = 1.0,
+                                inflow_conversion_rate: Union[dict, float, int] = 1.0,
+                                key_type: str = "year") -> pd.DataFrame:
+    """calculate and add columns for sand and gravel supply and stock, row by row
+
+    Reference implementation of `calculate_availability`, kept to validate the
+    vectorized version against.
 
     Calculates how much of old building stock is converted to new recycled
     inflow. Takes into account stock for unused recycled production. Stock is
@@ -100,29 +126,6 @@ def calculate_availability(df: pd.DataFrame,
     given as key_type (year, region or year/region).
     """
 
-    def convert_check_types(variable: Union[float, int, dict], var_name: str) -> dict:
-        """Ensure that variables are in correct format and possible"""
-
-        # ensure format
-        if isinstance(variable, (float, int)):
-            variable = {
-                "any": float(variable)
-            }
-        elif isinstance(variable, dict):
-            if "any" not in variable.keys():
-                raise BaseException(f"Variable '{var_name}' is given as dict, it MUST contain 'any' as key")
-        else:
-            raise BaseException(f"variable must be of type `dict`, `float` or `int` "
-                                f"but type for '{var_name}' given was {type(variable)}")
-
-        # ensure rates are possible
-        for key, value in variable.items():
-            if value > 1 or value < 0:
-                raise BaseException(f"Conversions rates must be higher or equal to 0 (0%) "
-                                    f"and lower or equal to 1 (100%), rate is: "
-                                    f"{var_name}: {key} for {value}")
-        return variable
-
     def balance_check(balance, max_demand, max_rec_supply, stock) -> Tuple[float, float]:
         """calculate supply from recycled sources based on max supply and existing material stock."""
         # 3 options for balance
@@ -166,8 +169,7 @@ def calculate_availability(df: pd.DataFrame,
     inflow_conversion_rate = convert_check_types(inflow_conversion_rate, "inflow_conversion_rate")
 
     # check key_type:
-    if key_type not in ["year", "region", "year/region", "region/year"]:
-        raise BaseException(f"'key_type' should be 'year', 'region' or 'year/region' but got '{key_type}'")
+    check_key_type(key_type)
 
     # create columns for stock of sand and gravel
     last_row = {col: 0 for col in df.columns}
@@ -181,16 +183,16 @@ def calculate_availability(df: pd.DataFrame,
 
         if row["Region"] != last_row["Region"]:
             # reset stock if we start on a new region
-            last_row[sand_stock_name] = 0
-            last_row[gravel_stock_name] = 0
+            # (make a new dict, the previous last_row is already stored in data)
+            last_row = {**last_row, sand_stock_name: 0, gravel_stock_name: 0}
 
         # set correct key
         if key_type == "year":
             key = row["year"]
         elif key_type == "region":
-            key = row["region"]
+            key = row["Region"]
         else:
-            key = f'{row["year"]}/{row["region"]}'
+            key = f'{row["year"]}/{row["Region"]}'
 
         # find available outflow and inflow, moderated by conversions
         ocr = outflow_conversion_rate.get(key, outflow_conversion_rate["any"])
@@ -259,43 +261,237 @@ def calculate_availability(df: pd.DataFrame,
     df = pd.DataFrame(data)
     return df
 
-# read data
-# Original file is from Deetman et al. (2020): https://github.com/SPDeetman/BUMA
-# in the folder 'output'
-ts = time()
-df_orig = pd.read_excel("Supplementary Data (Original model).xlsx",
-                   sheet_name="material_output")
-print(f"Data loaded: {df_status(df_orig, time() - ts)}")
-
-# clean data
-df_clean = clean_and_reorganize(df_orig)
-
-# generate conversion rate per year
-
-# linspace explanation:
-# first number is lower rate, second higher, last the steps
-# steps is 32, first step is lowest number (but we want 1 higher)
-# the first is deleted, the 31 remaining are 2020-2050
-
-# assume market share of 0% to (max) 50% growing between 2025-2050
-outflow_conversion_rate = np.linspace(0, 0.5, (2050 - 2025 + 2))
-outflow_conversion_rate = {2025 + i: rate for i, rate in enumerate(outflow_conversion_rate[1:])}
-outflow_conversion_rate["any"] = 0
-# outflow_conversion_rate = 1  # set if no limit
-
-# assume market share of 0% to (max) 50% growing between 2025-2050
-inflow_conversion_rate = np.linspace(0, 0.5, (2050 - 2025 + 2))
-inflow_conversion_rate = {2025 + i: rate for i, rate in enumerate(inflow_conversion_rate[1:])}
-inflow_conversion_rate["any"] = 0
-# inflow_conversion_rate = 1  # set if no limit
-
-# calculate new stock data
-t = time()
-df_done = calculate_availability(df_clean,
-                                 outflow_conversion_rate=outflow_conversion_rate,
-                                 inflow_conversion_rate=inflow_conversion_rate)
-print(f"Data converted: {df_status(df_done, time() - t)}")
-
-# export to excel
-df_done.to_csv("filtered_to_list.csv", index=False)
-print(f"Exported data | Total time taken: {round(time() - ts, 1)}s")
+def region_year_arrays(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray,
+                                                   np.ndarray, np.ndarray, np.ndarray]:
+    """reshape a (sorted) cleaned dataframe to region x year inflow and outflow arrays
+
+    Missing region/year combinations are left at 0 in/outflow so that they carry the
+    stock over unchanged (like skipping a row).
+
+    Returns the regions, the years, the region and year index of every row in df and
+    the inflow and outflow arrays.
+    """
+    # set in/outflow names correctly
+    inflow_col = f"inflow ({UNIT})"
+    outflow_col = f"outflow ({UNIT})"
+
+    if isinstance(df["Region"].dtype, pd.CategoricalDtype):
+        # unique on the (int) codes instead of the region names
+        used, region_idx = np.unique(df["Region"].cat.codes.to_numpy(), return_inverse=True)
+        regions = np.asarray(df["Region"].cat.categories, dtype=object)[used]
+    else:
+        regions, region_idx = np.unique(df["Region"].to_numpy(), return_inverse=True)
+    years, year_idx = np.unique(df["year"].to_numpy(), return_inverse=True)
+    inflow = np.zeros((len(regions), len(years)))
+    outflow = np.zeros((len(regions), len(years)))
+    inflow[region_idx, year_idx] = df[inflow_col].to_numpy(dtype=float)
+    outflow[region_idx, year_idx] = df[outflow_col].to_numpy(dtype=float)
+    return regions, years, region_idx, year_idx, inflow, outflow
+
+
+def product_balances(inflow: np.ndarray,
+                     outflow: np.ndarray,
+                     outflow_conversion_rate: np.ndarray,
+                     inflow_conversion_rate: np.ndarray,
+                     material: str = "concrete",
+                     initial_stock: Optional[dict] = None) -> dict:
+    """run the stock balance for every product of a material (e.g. sand and gravel for concrete)
+
+    The products and their splits are taken from MATERIAL_PROD_SPLIT and
+    MATERIAL_USE_SPLIT. initial_stock is an optional dict with the stock per product
+    before the first year (e.g. to continue from an earlier calculation).
+
+    Returns a dict with the output column names as keys and arrays of shape
+    (..., region, year) as values.
+    """
+    if material not in MATERIAL_PROD_SPLIT or material not in MATERIAL_USE_SPLIT:
+        raise BaseException(f"No product split tables for material '{material}', "
+                            f"add it to MATERIAL_PROD_SPLIT and MATERIAL_USE_SPLIT in statics.py")
+    prod_split, use_split = MATERIAL_PROD_SPLIT[material], MATERIAL_USE_SPLIT[material]
+
+    data = {}
+    for product in prod_split.keys():
+        all_supply, rec_supply, stock, substitution = stock_balance(inflow, outflow,
+                                                                    outflow_conversion_rate,
+                                                                    inflow_conversion_rate,
+                                                                    prod_split[product],
+                                                                    use_split[product],
+                                                                    (initial_stock or {}).get(product))
+        data[f"all {product} supply ({UNIT})"] = all_supply  # how much is required for inflow
+        data[f"recycled {product} supply ({UNIT})"] = rec_supply  # how much is supplied from recycling
+        data[f"{product} stock ({UNIT})"] = stock  # how much stock there is
+        data[f"{product} substitution"] = substitution  # how much is substituted
+    return data
+
+
+@profiled
+def calculate_availability(df: pd.DataFrame,
+                           outflow_conversion_rate: Union[dict, float, int] = 1.0,
+                           inflow_conversion_rate: Union[dict, float, int] = 1.0,
+                           key_type: str = "year",
+                           material: str = "concrete") -> pd.DataFrame:
+    """calculate and add columns for sand and gravel supply and stock
+
+    Vectorized version of `calculate_availability_loop`, with identical arguments and
+    output. Data is reshaped to arrays with regions as rows and years as columns, the
+    stock carry-over is then done for all regions at once for every year
+    (see `stock_balance.stock_balance`).
+
+    The products (sand and gravel for concrete) are taken from the split tables of
+    material. If df has a 'material' column (from clean_and_reorganize with a list of
+    materials), every material is calculated with its own split tables and the results
+    are stacked to one long table with 'material' as first column. Product columns that
+    do not apply to a material are left empty, materials without split tables (e.g.
+    steel) only keep their inflow and outflow.
+    """
+    if "material" in df.columns:
+        results = []
+        for _material, group in df.groupby("material", sort=True, observed=True):
+            group = group.drop(columns="material")
+            if _material in MATERIAL_PROD_SPLIT and _material in MATERIAL_USE_SPLIT:
+                result = calculate_availability(group, outflow_conversion_rate, inflow_conversion_rate,
+                                                key_type, _material)
+            else:
+                dimensions = [dim for dim in BUILDING_DIMENSIONS if dim in group.columns]
+                result = group.sort_values(["Region"] + dimensions + ["year"]).reset_index(drop=True)
+            result.insert(0, "material", _material)
+            results.append(result)
+        result = pd.concat(results, ignore_index=True)
+        dtype = float_dtype(df)
+        return result.astype({"material": df["material"].dtype,
+                              **{col: dtype for col in result.columns if col not in df.columns}})
+
+    dimensions = [dim for dim in BUILDING_DIMENSIONS if dim in df.columns]
+    if dimensions:
+        return calculate_availability_disaggregated(df, dimensions, outflow_conversion_rate,
+                                                    inflow_conversion_rate, key_type, material)
+
+    df = df.sort_values(["Region", "year"], ascending=True)  # ensure the data is sorted as expected
+
+    regions, years, region_idx, year_idx, inflow, outflow = region_year_arrays(df)
+
+    # check and compile conversion rates to region x year arrays
+    ocr = compile_rate(outflow_conversion_rate, "outflow_conversion_rate", regions, years, key_type)
+    icr = compile_rate(inflow_conversion_rate, "inflow_conversion_rate", regions, years, key_type)
+
+    # results in the float type of the input (see frame_schema.py)
+    dtype = float_dtype(df)
+    data = {col: df[col].array for col in ["Region", "year", f"inflow ({UNIT})", f"outflow ({UNIT})"]}
+    for col, values in product_balances(inflow, outflow, ocr, icr, material).items():
+        data[col] = values[region_idx, year_idx].astype(dtype, copy=False)
+
+    return pd.DataFrame(data)
+
+
+def calculate_availability_disaggregated(df: pd.DataFrame,
+                                         dimensions: list,
+                                         outflow_conversion_rate: Union[dict, float, int] = 1.0,
+                                         inflow_conversion_rate: Union[dict, float, int] = 1.0,
+                                         key_type: str = "year",
+                                         material: str = "concrete") -> pd.DataFrame:
+    """calculate availability for data that is split over building dimensions (e.g. 'type' and 'area')
+
+    Recycled material from all building types and areas in a region goes to the same
+    (regional) market, so the stock balance is done on the regional totals. The result
+    is then allocated to every row of the dimensions:
+    - all supply (demand) is calculated from the inflow of the row
+    - recycled supply is allocated by the share of the row in the regional demand
+      (so the substitution rate is the regional substitution rate)
+    - stock is allocated by the share of the row in the cumulative regional outflow
+    Summing over the dimensions (aggregate_dimensions) gives the regional result.
+    """
+    inflow_col = f"inflow ({UNIT})"
+    outflow_col = f"outflow ({UNIT})"
+    df = df.sort_values(["Region"] + dimensions + ["year"]).reset_index(drop=True)
+
+    # stock balance on regional totals
+    regional = df.groupby(["Region", "year"], observed=True, as_index=False)[[inflow_col, outflow_col]].sum()
+    regional = calculate_availability(regional, outflow_conversion_rate, inflow_conversion_rate,
+                                      key_type, material)
+    regional["cumulative outflow"] = regional.groupby("Region")[outflow_col].cumsum()
+
+    result = df.merge(regional.drop(columns=[inflow_col, outflow_col]), on=["Region", "year"], how="left")
+    cumulative_outflow = result.groupby(["Region"] + dimensions, observed=True)[outflow_col].cumsum().to_numpy()
+    regional_cumulative_outflow = result.pop("cumulative outflow").to_numpy()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stock_share = np.where(regional_cumulative_outflow != 0,
+                               cumulative_outflow / regional_cumulative_outflow, 0.0)
+        for product, use_split in MATERIAL_USE_SPLIT[material].items():
+            demand = result[inflow_col].to_numpy(dtype=float) * use_split
+            regional_demand = result[f"all {product} supply ({UNIT})"].to_numpy()
+            demand_share = np.where(regional_demand != 0, demand / regional_demand, 0.0)
+            result[f"all {product} supply ({UNIT})"] = demand
+            result[f"recycled {product} supply ({UNIT})"] = result[f"recycled {product} supply ({UNIT})"] * demand_share
+            result[f"{product} stock ({UNIT})"] = result[f"{product} stock ({UNIT})"] * stock_share
+    return result.astype({col: float_dtype(df) for col in result.columns if result[col].dtype == np.float64})
+
+
+def aggregate_dimensions(df: pd.DataFrame) -> pd.DataFrame:
+    """sum availability results over the building dimensions (e.g. 'type' and 'area') to regional results
+
+    Amounts are summed, substitution rates are recalculated from the summed supply.
+    """
+    dimensions = [dim for dim in BUILDING_DIMENSIONS if dim in df.columns]
+    keys = [col for col in ["material", "Region", "year"] if col in df.columns]
+    substitution_cols = [col for col in df.columns if col.endswith(" substitution")]
+    columns = [col for col in df.columns if col not in dimensions]
+
+    df = (df.drop(columns=dimensions + substitution_cols)
+          .groupby(keys, observed=True, sort=True).sum(min_count=1).reset_index())
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for col in substitution_cols:
+            product = col[:-len(" substitution")]
+            all_supply = df[f"all {product} supply ({UNIT})"].to_numpy()
+            rec_supply = df[f"recycled {product} supply ({UNIT})"].to_numpy()
+            df[col] = np.where(all_supply != 0, rec_supply / all_supply, 0.0)
+
+    return df[columns]
+
+
+if __name__ == "__main__":
+    EXPORT_CSV = True  # also write the data as (full precision) csv
+
+    # read data
+    # Original file is from Deetman et al. (2020): https://github.com/SPDeetman/BUMA
+    # in the folder 'output'
+    ts = time()
+    with Stage("read", message="Data loaded", prints="end") as stage:
+        df_orig, stage.cache_hit = read_excel_cached("Supplementary Data (Original model).xlsx",
+                                                     sheet_name="material_output")
+        stage.output(df_orig)
+
+    # clean data
+    df_clean = clean_and_reorganize(df_orig)
+
+    # generate conversion rate per year
+
+    # linspace explanation:
+    # first number is lower rate, second higher, last the steps
+    # steps is 32, first step is lowest number (but we want 1 higher)
+    # the first is deleted, the 31 remaining are 2020-2050
+
+    # assume market share of 0% to (max) 50% growing between 2025-2050
+    outflow_conversion_rate = np.linspace(0, 0.5, (2050 - 2025 + 2))
+    outflow_conversion_rate = {2025 + i: rate for i, rate in enumerate(outflow_conversion_rate[1:])}
+    outflow_conversion_rate["any"] = 0
+    # outflow_conversion_rate = 1  # set if no limit
+
+    # assume market share of 0% to (max) 50% growing between 2025-2050
+    inflow_conversion_rate = np.linspace(0, 0.5, (2050 - 2025 + 2))
+    inflow_conversion_rate = {2025 + i: rate for i, rate in enumerate(inflow_conversion_rate[1:])}
+    inflow_conversion_rate["any"] = 0
+    # inflow_conversion_rate = 1  # set if no limit
+
+    # calculate new stock data
+    with Stage("calculate_availability", df_clean, "Data converted", prints="end") as stage:
+        df_done = stage.output(calculate_availability(df_clean,
+                                                      outflow_conversion_rate=outflow_conversion_rate,
+                                                      inflow_conversion_rate=inflow_conversion_rate))
+
+    # export for stock_to_scenario_formatting.py (feather) and optionally as csv
+    # (or use pipeline.py to run both steps without writing in-between files)
+    write_feather(df_done, "filtered_to_list.feather")
+    if EXPORT_CSV:
+        df_done.to_csv("filtered_to_list.csv", index=False)
+    print(f"Exported data | Total time taken: {round(time() - ts, 1)}s")
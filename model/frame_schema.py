@@ -0,0 +1,58 @@
+# file for the column types of the model dataframes
+"""
+Declared dtypes of the stock and scenario frames, applied at ingestion
+(clean_and_reorganize, stream_clean_and_reorganize) and kept through
+calculate_availability and reorder:
+- text columns with few unique values (regions, flows, variables, ...) are categoricals
+- 'year' is a small int
+- amounts are float64, or float32 when asked for (float32=True), halving the memory of
+  the amount columns at the cost of precision (about 7 significant digits)
+
+The stock balance itself is always calculated in float64, results are stored in the
+float type of the input.
+"""
+
+# imports
+import numpy as np
+import pandas as pd
+
+# columns that are stored as categoricals (if they exist in a frame)
+CATEGORY_COLUMNS = ["scenario", "material", "Region", "region", "flow", "type", "area", "variables", "unit"]
+YEAR_DTYPE = "int16"
+
+
+def schema_dtypes(df: pd.DataFrame, float32: bool = False) -> dict:
+    """return the dtype per column of df according to the schema, only for columns that change"""
+    dtypes = {}
+    for col, dtype in df.dtypes.items():
+        if col in CATEGORY_COLUMNS and not isinstance(dtype, pd.CategoricalDtype):
+            dtypes[col] = "category"
+        elif col == "year" and pd.api.types.is_integer_dtype(dtype) and dtype != YEAR_DTYPE:
+            dtypes[col] = YEAR_DTYPE
+        elif float32 and dtype == np.float64:
+            dtypes[col] = "float32"
+    return dtypes
+
+
+def apply_schema(df: pd.DataFrame, float32: bool = False) -> pd.DataFrame:
+    """return df with the dtypes of the schema, float columns are converted to float32 if float32"""
+    dtypes = schema_dtypes(df, float32)
+    if "year" in dtypes and not df["year"].between(np.iinfo(YEAR_DTYPE).min, np.iinfo(YEAR_DTYPE).max).all():
+        raise BaseException(f"Column 'year' does not fit in {YEAR_DTYPE}")
+    return df.astype(dtypes) if dtypes else df
+
+
+def float_dtype(df: pd.DataFrame) -> type:
+    """return the float type of the amounts in df: float32 if df has float32 columns, float64 otherwise"""
+    return np.float32 if any(dtype == np.float32 for dtype in df.dtypes) else np.float64
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> dict:
+    """return the memory usage of a frame before and after applying the schema"""
+    mb_before = before.memory_usage(index=True, deep=True).sum() / 1024 ** 2
+    mb_after = after.memory_usage(index=True, deep=True).sum() / 1024 ** 2
+    return {
+        "memory before": f"{round(mb_before, 2)}MB",
+        "memory after": f"{round(mb_after, 2)}MB",
+        "memory saved": f"{round(100 * (1 - mb_after / mb_before), 1) if mb_before else 0.0}%",
+    }
@@ -0,0 +1,176 @@
+# file for generating the scenario data of the datapackage for several pathways and recycling ambitions
+"""
+Builds all scenarios of scenario_data.csv in one run: every IAM pathway (a Deetman et
+al. (2020) material_output workbook per pathway, see PATHWAYS) is combined with every
+recycling ambition (conversion rates, see AMBITIONS). The scenarios are calculated in
+a process pool, results are combined in the order of PATHWAYS and AMBITIONS, so the
+output does not depend on the number of workers.
+
+Only the SSP2-Base workbook (WORKBOOK, the one pipeline.py uses) is set up in PATHWAYS,
+so the datapackage only has SSP2-Base scenarios and the process pool runs over the
+ambitions of that one pathway. Other pathways are added as a PATHWAYS entry with their
+own material_output workbook.
+
+The 'scenarios' block of datapackage.json is updated to the generated scenarios, the
+rest of the file is left as it is.
+
+Run from the 'model' folder: python generate_datapackage.py
+"""
+
+# imports
+from typing import Iterator, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+
+import pandas as pd
+
+from utils import Stage
+from excel_cache import read_excel_cached
+from extract_stock_data import clean_and_reorganize, calculate_availability
+from scenario_sweep import conversion_rate_ramp
+from stock_to_scenario_formatting import select_scenario_data, reorder, YEARS
+from pipeline import WORKBOOK, SHEET_NAME, SCENARIO_DATA_PATH
+from frame_schema import apply_schema
+from ensemble_store import EnsembleStore
+from statics import MARKET_SHARES
+
+DATAPACKAGE_PATH = os.path.join("..", "datapackage", "datapackage.json")
+IAM_MODEL = "image"
+
+PATHWAYS = {
+    # IAM pathway: material_output workbook of Deetman et al. (2020) for the pathway
+    # only SSP2-Base for now, no workbook of another pathway is used yet
+    "SSP2-Base": WORKBOOK,
+}
+
+AMBITIONS = {
+    # recycling ambition: conversion rates, growing from 0% in 2024 to the given rate in 2050
+    "rec50": {"outflow_conversion_rate": conversion_rate_ramp(end_rate=0.5),
+              "inflow_conversion_rate": conversion_rate_ramp(end_rate=0.5)},
+    "rec25": {"outflow_conversion_rate": conversion_rate_ramp(end_rate=0.25),
+              "inflow_conversion_rate": conversion_rate_ramp(end_rate=0.25)},
+    "rec100": {"outflow_conversion_rate": conversion_rate_ramp(end_rate=1.0),
+               "inflow_conversion_rate": conversion_rate_ramp(end_rate=1.0)},
+}
+DEFAULT_AMBITION = "rec50"  # scenarios with this ambition are named without it, e.g. 'SSP2-Base-image'
+
+
+def scenario_name(pathway: str, ambition: str) -> str:
+    """return the scenario name of a pathway and ambition, e.g. 'SSP2-Base-image-rec25'"""
+    name = f"{pathway}-{IAM_MODEL}"
+    return name if ambition == DEFAULT_AMBITION else f"{name}-{ambition}"
+
+
+def scenario_task(task: tuple) -> pd.DataFrame:
+    """calculate the scenario data of one scenario, task is (scenario, df_clean, rates, years, market_shares)"""
+    scenario, df_clean, rates, years, market_shares = task
+    df_done = calculate_availability(df_clean,
+                                     outflow_conversion_rate=rates.get("outflow_conversion_rate", 1.0),
+                                     inflow_conversion_rate=rates.get("inflow_conversion_rate", 1.0))
+    return reorder(select_scenario_data(df_done, years), scenario, market_shares)
+
+
+def run_tasks(tasks: list, n_workers: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """yield the results of scenario_task in the order of tasks, a process pool is only made if n_workers is not 1"""
+    if n_workers == 1:
+        yield from map(scenario_task, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        yield from executor.map(scenario_task, tasks)  # map keeps the order of the tasks
+
+
+def generate_scenario_data(inputs: dict,
+                           ambitions: dict = AMBITIONS,
+                           n_workers: Optional[int] = None,
+                           years: list = YEARS,
+                           market_shares: dict = MARKET_SHARES,
+                           store_path: Optional[str] = None) -> Tuple[pd.DataFrame, dict]:
+    """calculate the scenario data of every pathway x ambition
+
+    inputs has the cleaned data (clean_and_reorganize) per pathway. n_workers is the
+    number of processes (default: number of CPUs), 1 runs everything in this process.
+    If store_path is given, every scenario is also appended to an EnsembleStore in that
+    folder as soon as it is calculated (the variables, regions and years of the store
+    are those of the first scenario).
+
+    Returns the scenario data of all scenarios and the scenarios with the IAM
+    scenarios they are compatible with (the 'scenarios' block of datapackage.json).
+    """
+    tasks = []
+    scenarios = {}
+    for pathway, df_clean in inputs.items():
+        for ambition, rates in ambitions.items():
+            name = scenario_name(pathway, ambition)
+            if name in scenarios:
+                raise BaseException(f"Scenario '{name}' is generated twice")
+            scenarios[name] = [{"model": IAM_MODEL, "pathway": pathway}]
+            tasks.append((name, df_clean, rates, years, market_shares))
+
+    results = []
+    for result in run_tasks(tasks, n_workers):
+        if store_path is not None:
+            if not results:
+                store = EnsembleStore.create(store_path, sorted(result["variables"].astype(str).unique()),
+                                             sorted(result["region"].astype(str).unique()),
+                                             [int(col) for col in result.columns if str(col).isdigit()])
+            store.append_frame(result)
+        results.append(result)
+
+    return apply_schema(pd.concat(results, ignore_index=True)), scenarios
+
+
+def find_block(text: str, key: str) -> Tuple[int, int]:
+    """return the start and end position of the json object of a key in json text"""
+    start = text.index("{", text.index(f'"{key}"') + len(key) + 2)
+    depth, in_string, escaped = 0, False, False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return start, i + 1
+    raise BaseException(f"No end of block '{key}' found")
+
+
+def update_datapackage_scenarios(scenarios: dict, path: str = DATAPACKAGE_PATH) -> None:
+    """replace the 'scenarios' block of datapackage.json, the rest of the file is not changed"""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    json.loads(text)  # check that the file is valid before changing it
+
+    start, end = find_block(text, "scenarios")
+    line = text[text.rindex("\n", 0, start) + 1:start]
+    indent = line[:len(line) - len(line.lstrip())]  # indentation of the line of the key
+    block = json.dumps(scenarios, indent=4).replace("\n", "\n" + indent)
+    text = text[:start] + block + text[end:]
+    json.loads(text)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    with Stage("generate", message="Datapackage generated", prints="end") as stage:
+        inputs = {}
+        for pathway, workbook in PATHWAYS.items():
+            df_orig, _ = read_excel_cached(workbook, sheet_name=SHEET_NAME)
+            inputs[pathway] = clean_and_reorganize(df_orig, prints="none")
+
+        df_scenario, scenarios = generate_scenario_data(inputs)
+        df_scenario.to_csv(SCENARIO_DATA_PATH, index=False)
+        update_datapackage_scenarios(scenarios)
+        stage.output(df_scenario)
@@ -0,0 +1,143 @@
+# file for incremental recalculation of calculate_availability
+"""
+The stock carry-over is reset for every 'Region', so regions are independent. The
+IncrementalAvailability cache keeps a fingerprint of the inputs and conversion rates
+of every region and only recomputes the regions of which the fingerprint changed.
+When years are appended to the data (and the earlier years did not change), the
+calculation resumes from the cached stock of the last year instead of starting over.
+
+Example:
+    cache = IncrementalAvailability()
+    df_done = cache.update(df_clean, outflow_conversion_rate, inflow_conversion_rate)
+    # change the rate of one region, only that region is recomputed
+    df_done = cache.update(df_clean, new_outflow_conversion_rate, inflow_conversion_rate, key_type="year/region")
+    print(cache.last_update)
+"""
+
+# imports
+from typing import Union
+import hashlib
+import pickle
+import numpy as np
+import pandas as pd
+
+from extract_stock_data import region_year_arrays, product_balances
+from conversion_rates import compile_rate
+from stage_cache import stable_repr
+from frame_schema import float_dtype
+from statics import UNIT, MATERIAL_PROD_SPLIT, MATERIAL_USE_SPLIT
+
+
+class IncrementalAvailability:
+    """cache of calculate_availability results per region
+
+    Gives the same output as calculate_availability for data with 'Region', 'year',
+    inflow and outflow columns (one material, no building dimensions).
+    After every update, last_update has the regions that were reused, resumed (only
+    appended years calculated) and recomputed.
+    """
+
+    def __init__(self, material: str = "concrete"):
+        self.material = material
+        self.years = None  # years of the cached results
+        self.regions = {}  # region: {"fingerprint", "results" (column: array per year), "stock" (product: stock)}
+        self.last_update = {}
+
+    def fingerprint(self, years: np.ndarray, *rows: np.ndarray) -> str:
+        """return a hash of the years, the input rows of a region and the split tables of the material"""
+        h = hashlib.sha256(stable_repr([MATERIAL_PROD_SPLIT[self.material],
+                                        MATERIAL_USE_SPLIT[self.material]]).encode())
+        h.update(stable_repr(list(years)).encode())
+        for row in rows:
+            h.update(np.ascontiguousarray(row, dtype=float).tobytes())
+        return h.hexdigest()
+
+    def update(self,
+               df: pd.DataFrame,
+               outflow_conversion_rate: Union[dict, float, int] = 1.0,
+               inflow_conversion_rate: Union[dict, float, int] = 1.0,
+               key_type: str = "year") -> pd.DataFrame:
+        """calculate availability like calculate_availability, reusing cached regions where possible"""
+        df = df.sort_values(["Region", "year"], ascending=True)  # ensure the data is sorted as expected
+        regions, years, region_idx, year_idx, inflow, outflow = region_year_arrays(df)
+        ocr = np.asarray(compile_rate(outflow_conversion_rate, "outflow_conversion_rate", regions, years, key_type))
+        icr = np.asarray(compile_rate(inflow_conversion_rate, "inflow_conversion_rate", regions, years, key_type))
+
+        # number of cached years if the cached years are the first years of the new data
+        n_cached = None
+        if self.years is not None and len(self.years) < len(years) and \
+                np.array_equal(self.years, years[:len(self.years)]):
+            n_cached = len(self.years)
+
+        reuse, resume, recompute = [], [], []
+        fingerprints = []
+        for i, region in enumerate(regions):
+            rows = (inflow[i], outflow[i], ocr[i], icr[i])
+            fingerprints.append(self.fingerprint(years, *rows))
+            cached = self.regions.get(region)
+            if cached is None:
+                recompute.append(i)
+            elif cached["fingerprint"] == fingerprints[i]:
+                reuse.append(i)
+            elif n_cached is not None and \
+                    cached["fingerprint"] == self.fingerprint(years[:n_cached], *[row[:n_cached] for row in rows]):
+                resume.append(i)
+            else:
+                recompute.append(i)
+
+        new_regions = {region: self.regions[region] for region in regions[reuse]}
+
+        # all changed regions at once
+        if recompute:
+            idx = np.array(recompute)
+            results = product_balances(inflow[idx], outflow[idx], ocr[idx], icr[idx], self.material)
+            for n, i in enumerate(recompute):
+                new_regions[regions[i]] = {"results": {col: values[n] for col, values in results.items()}}
+
+        # appended years of all resumed regions at once, starting from the cached stock
+        if resume:
+            idx = np.array(resume)
+            initial_stock = {product: np.array([self.regions[regions[i]]["stock"][product] for i in resume])
+                             for product in MATERIAL_PROD_SPLIT[self.material]}
+            results = product_balances(inflow[idx, n_cached:], outflow[idx, n_cached:],
+                                       ocr[idx, n_cached:], icr[idx, n_cached:],
+                                       self.material, initial_stock)
+            for n, i in enumerate(resume):
+                cached_results = self.regions[regions[i]]["results"]
+                new_regions[regions[i]] = {"results": {col: np.concatenate([cached_results[col], values[n]])
+                                                       for col, values in results.items()}}
+
+        for i in recompute + resume:
+            region_cache = new_regions[regions[i]]
+            region_cache["fingerprint"] = fingerprints[i]
+            region_cache["stock"] = {product: region_cache["results"][f"{product} stock ({UNIT})"][-1]
+                                     for product in MATERIAL_PROD_SPLIT[self.material]}
+
+        self.years = years
+        self.regions = new_regions
+        self.last_update = {
+            "reused": list(regions[reuse]),
+            "resumed": list(regions[resume]),
+            "recomputed": list(regions[recompute]),
+        }
+
+        # build the output like calculate_availability
+        dtype = float_dtype(df)
+        data = {col: df[col].array for col in ["Region", "year", f"inflow ({UNIT})", f"outflow ({UNIT})"]}
+        for col in self.regions[regions[0]]["results"].keys():
+            values = np.stack([self.regions[region]["results"][col] for region in regions])
+            data[col] = values[region_idx, year_idx].astype(dtype, copy=False)
+        return pd.DataFrame(data)
+
+    def save(self, path: str) -> None:
+        """store the cache in a file"""
+        with open(path, "wb") as f:
+            pickle.dump(self.__dict__, f)
+
+    @classmethod
+    def load(cls, path: str) -> "IncrementalAvailability":
+        """load a cache stored with save"""
+        cache = cls()
+        with open(path, "rb") as f:
+            cache.__dict__.update(pickle.load(f))
+        return cache
@@ -0,0 +1,225 @@
+# file for reading the aggregate_LCI.csv inventory
+"""
+Streaming parser for Brightway-style block csv inventories (like
+datapackage/inventories/aggregate_LCI.csv):
+
+    Database,<name>
+    (empty row)
+    Activity,<name>
+    <field>,<value>          e.g. location, reference product, unit, code
+    Exchanges
+    <exchange header>        e.g. name,amount,database,location,unit,type,reference product
+    <exchange rows>
+    (empty row)
+    Activity,...
+
+iter_inventory reads the file line by line and yields the database, every activity
+and every exchange as soon as it is read. Inventory collects them into compact
+columnar arrays: every text column of the exchanges is an int32 code into one string
+table, amounts are a float64 array and the exchanges of activity i are the rows
+exchange_start[i]:exchange_start[i + 1]. Activities are indexed by
+(name, reference product, location).
+
+An Inventory can be saved as a folder with index.json (string table, activities) and
+one .npy file per exchange column. load_inventory keeps such a folder in CACHE_DIR,
+keyed by the content hash of the csv, and memory-maps the columns, so a lookup does
+not parse the csv or read all exchanges.
+
+Example:
+    inventory = load_inventory()
+    activity = inventory.lookup("advanced dry recovery (adr)")
+    activity["exchanges"]  # dataframe with the exchanges of the activity
+"""
+
+# imports
+from typing import Iterator, Optional, Tuple
+import csv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from excel_cache import file_hash
+
+INVENTORY_PATH = os.path.join("..", "datapackage", "inventories", "aggregate_LCI.csv")
+CACHE_DIR = os.path.join(".cache", "inventory")
+INDEX_FILE = "index.json"
+ACTIVITY_KEY = ["name", "reference product", "location"]
+
+
+def iter_inventory(path: str = INVENTORY_PATH) -> Iterator[Tuple[str, dict]]:
+    """yield ('database', {...}), ('activity', {...}) and ('exchange', {...}) items of a block csv
+
+    Exchanges belong to the last yielded activity. Empty cells are left out, the
+    exchange amount is a float.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        section = None  # None (between blocks), 'activity', 'header' or 'exchanges'
+        activity, header = None, None
+        for line_number, row in enumerate(csv.reader(f), start=1):
+            while row and row[-1] == "":
+                row.pop()
+            if not row:
+                if section == "activity":
+                    yield "activity", activity  # activity without exchanges
+                section, activity = None, None
+                continue
+
+            if section is None:
+                if row[0] == "Database":
+                    yield "database", {"name": row[1]}
+                elif row[0] == "Activity":
+                    section, activity = "activity", {"name": row[1]}
+                else:
+                    raise BaseException(f"{path}, line {line_number}: expected 'Database' or 'Activity', "
+                                        f"got '{row[0]}'")
+            elif section == "activity":
+                if row[0] == "Exchanges":
+                    yield "activity", activity
+                    section = "header"
+                else:
+                    activity[row[0]] = row[1] if len(row) > 1 else ""
+            elif section == "header":
+                header, section = row, "exchanges"
+            else:
+                if len(row) > len(header):
+                    raise BaseException(f"{path}, line {line_number}: exchange has more cells than the header")
+                exchange = {key: value for key, value in zip(header, row) if value != ""}
+                try:
+                    exchange["amount"] = float(exchange["amount"])
+                except (KeyError, ValueError):
+                    raise BaseException(f"{path}, line {line_number}: exchange without a valid amount")
+                yield "exchange", exchange
+        if section == "activity":
+            yield "activity", activity
+
+
+class Inventory:
+    """activities and columnar exchanges of a block csv inventory"""
+
+    def __init__(self, database: str, strings: list, activities: list, exchange_start: np.ndarray,
+                 columns: dict):
+        self.database = database
+        self.strings = strings  # string table of the exchange codes
+        self.activities = activities  # activity fields (name, location, ...)
+        self.exchange_start = exchange_start  # exchanges of activity i: exchange_start[i]:exchange_start[i + 1]
+        self.columns = columns  # exchange column: amounts (float) or codes into strings (int32, -1 is empty)
+        self.index = {}  # (name, reference product, location): activity number
+        self.names = {}  # name: activity numbers
+        for i, activity in enumerate(activities):
+            key = tuple(activity.get(field) for field in ACTIVITY_KEY)
+            if key in self.index:
+                raise BaseException(f"Duplicate activity {key}")
+            self.index[key] = i
+            self.names.setdefault(key[0], []).append(i)
+
+    @classmethod
+    def from_csv(cls, path: str = INVENTORY_PATH) -> "Inventory":
+        """parse a block csv inventory in one streaming pass"""
+        database = None
+        strings, codes = [], {}
+        activities, exchange_start = [], []
+        columns, n_exchanges = {"amount": []}, 0
+        for kind, item in iter_inventory(path):
+            if kind == "database":
+                database = item["name"]
+            elif kind == "activity":
+                activities.append(item)
+                exchange_start.append(n_exchanges)
+            elif kind == "exchange":
+                for key, value in item.items():
+                    if key not in columns:
+                        columns[key] = [-1] * n_exchanges
+                    if key == "amount":
+                        columns[key].append(value)
+                    else:
+                        columns[key].append(codes.setdefault(value, len(codes)))
+                        if len(codes) > len(strings):
+                            strings.append(value)
+                n_exchanges += 1
+                for key, values in columns.items():
+                    if len(values) < n_exchanges:
+                        values.append(-1)  # column not given for this exchange
+        exchange_start.append(n_exchanges)
+
+        columns = {key: np.array(values, dtype=float if key == "amount" else np.int32)
+                   for key, values in columns.items()}
+        return cls(database, strings, activities, np.array(exchange_start, dtype=np.int64), columns)
+
+    def __len__(self) -> int:
+        return len(self.activities)
+
+    def find(self, name: str, reference_product: Optional[str] = None, location: Optional[str] = None) -> list:
+        """return the numbers of the activities with name (and reference product and location if given)"""
+        return [i for i in self.names.get(name, [])
+                if reference_product in (None, self.activities[i].get("reference product"))
+                and location in (None, self.activities[i].get("location"))]
+
+    def exchanges(self, i: int) -> pd.DataFrame:
+        """return the exchanges of activity number i, only these rows of the columns are read"""
+        rows = slice(int(self.exchange_start[i]), int(self.exchange_start[i + 1]))
+        return pd.DataFrame({key: (np.asarray(values[rows]) if key == "amount" else
+                                   [self.strings[code] if code >= 0 else None for code in values[rows]])
+                             for key, values in self.columns.items()})
+
+    def lookup(self, name: str, reference_product: Optional[str] = None, location: Optional[str] = None) -> dict:
+        """return the fields and exchanges of one activity, it must be unique for the given fields"""
+        found = self.find(name, reference_product, location)
+        if len(found) != 1:
+            raise BaseException(f"{len(found)} activities found for {(name, reference_product, location)}")
+        return {**self.activities[found[0]], "exchanges": self.exchanges(found[0])}
+
+    def to_frame(self) -> pd.DataFrame:
+        """return all exchanges as one dataframe, with the key of their activity"""
+        activity_idx = np.repeat(np.arange(len(self)), np.diff(self.exchange_start))
+        table = np.asarray(self.strings + [None], dtype=object)  # code -1 is the last element: None
+        df = pd.DataFrame({f"activity {field}": np.asarray([a.get(field) for a in self.activities],
+                                                           dtype=object)[activity_idx]
+                           for field in ACTIVITY_KEY})
+        for key, values in self.columns.items():
+            df[key] = np.asarray(values) if key == "amount" else table[values]
+        return df
+
+    def save(self, path: str) -> None:
+        """save as a folder with index.json and a .npy file per exchange column"""
+        os.makedirs(path, exist_ok=True)
+        for key, values in self.columns.items():
+            np.save(os.path.join(path, f"{column_file(key)}.npy"), values)
+        np.save(os.path.join(path, "exchange_start.npy"), self.exchange_start)
+        index = {"database": self.database, "strings": self.strings, "activities": self.activities,
+                 "columns": list(self.columns)}
+        tmp_path = os.path.join(path, f"{INDEX_FILE}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(path, INDEX_FILE))  # the index is written last: the folder is complete
+
+    @classmethod
+    def load(cls, path: str) -> "Inventory":
+        """load a saved inventory, the exchange columns are memory-mapped"""
+        with open(os.path.join(path, INDEX_FILE), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        columns = {key: np.load(os.path.join(path, f"{column_file(key)}.npy"), mmap_mode="r")
+                   for key in index["columns"]}
+        exchange_start = np.load(os.path.join(path, "exchange_start.npy"))
+        return cls(index["database"], index["strings"], index["activities"], exchange_start, columns)
+
+
+def column_file(column: str) -> str:
+    """return a file name for an exchange column, e.g. 'reference_product'"""
+    return "".join(char if char.isalnum() else "_" for char in column)
+
+
+def load_inventory(path: str = INVENTORY_PATH, cache_dir: Optional[str] = CACHE_DIR) -> Inventory:
+    """read an inventory through the cache, the csv is only parsed when it changed
+
+    cache_dir None parses the csv without the cache.
+    """
+    if cache_dir is None:
+        return Inventory.from_csv(path)
+    cache_path = os.path.join(cache_dir, file_hash(path)[:32])
+    if os.path.isfile(os.path.join(cache_path, INDEX_FILE)):
+        return Inventory.load(cache_path)
+    inventory = Inventory.from_csv(path)
+    inventory.save(cache_path)
+    return inventory
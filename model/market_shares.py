@@ -0,0 +1,92 @@
+# file for compiling the market shares of conventional production routes
+"""
+MARKET_SHARES (statics.py) gives per share type (e.g. 'sand') the share of every
+conventional production route, for the 'default' region and for regions that differ
+from the default (e.g. 'BRA' and 'INDIA'):
+    {share_type: {region or "default": {route: share}}}
+
+The shares of a region can also be year dependent, with the shares per year:
+    {share_type: {region or "default": {year: {route: share}}}}
+shares are interpolated linearly between the given years and constant before the
+first and after the last given year.
+
+compile_share_matrix turns the shares of a share type into a dense
+region x year x route array (the default shares are broadcast, the given regions
+override their rows), so that reorder can apply it with one multiplication and the
+number of regions with their own shares does not matter for the runtime.
+"""
+
+# imports
+from typing import Tuple
+import numpy as np
+
+SHARE_TOLERANCE = 1e-6  # maximum deviation of the sum of the shares from 1
+
+
+def is_year_dependent(shares: dict) -> bool:
+    """return whether the shares of a region are given per year"""
+    return len(shares) > 0 and all(isinstance(key, (int, np.integer)) for key in shares.keys())
+
+
+def validate_market_shares(market_shares: dict) -> None:
+    """check that every share type has 'default' shares and that all shares sum to 1"""
+    errors = []
+    for share_type, region_shares in market_shares.items():
+        if "default" not in region_shares:
+            errors.append(f"'{share_type}' has no 'default' shares")
+        for region, shares in region_shares.items():
+            for year, year_shares in (shares.items() if is_year_dependent(shares) else [("any", shares)]):
+                total = sum(year_shares.values())
+                if abs(total - 1) > SHARE_TOLERANCE or any(share < 0 for share in year_shares.values()):
+                    errors.append(f"'{share_type}' | {region} | {year}: shares must be >= 0 and sum to 1, "
+                                  f"sum is {total}")
+    if errors:
+        raise BaseException("Invalid market shares:\n" + "\n".join(errors))
+
+
+def routes_of(region_shares: dict) -> list:
+    """return all routes of the shares of a share type, in order of appearance"""
+    routes = {}
+    for shares in region_shares.values():
+        for year_shares in (shares.values() if is_year_dependent(shares) else [shares]):
+            routes.update(dict.fromkeys(year_shares.keys()))
+    return list(routes.keys())
+
+
+def shares_per_year(shares: dict, routes: list, years: np.ndarray) -> np.ndarray:
+    """return the shares of a region as a year x route array"""
+    if not is_year_dependent(shares):
+        return np.broadcast_to(np.array([shares.get(route, 0.0) for route in routes], dtype=float),
+                               (len(years), len(routes)))
+    given_years = sorted(shares.keys())
+    given = np.array([[shares[year].get(route, 0.0) for route in routes] for year in given_years], dtype=float)
+    return np.stack([np.interp(years, given_years, given[:, i]) for i in range(len(routes))], axis=1)
+
+
+def compile_share_matrix(region_shares: dict,
+                         regions: np.ndarray,
+                         years: np.ndarray) -> Tuple[list, np.ndarray, np.ndarray]:
+    """compile the shares of one share type to a region x year x route array
+
+    Returns the routes, the share array and a region x route array that is True for
+    the routes that are given for a region (in any year), the other routes get share 0.
+    """
+    routes = routes_of(region_shares)
+    years = np.asarray(years, dtype=float)
+    matrix = np.empty((len(regions), len(years), len(routes)))
+    matrix[:] = shares_per_year(region_shares["default"], routes, years)
+    defined = np.empty((len(regions), len(routes)), dtype=bool)
+    defined[:] = np.isin(routes, routes_of({"default": region_shares["default"]}))
+
+    for i, region in enumerate(regions):
+        if region in region_shares and region != "default":
+            matrix[i] = shares_per_year(region_shares[region], routes, years)
+            defined[i] = np.isin(routes, routes_of({region: region_shares[region]}))
+    return routes, matrix, defined
+
+
+def compile_market_shares(market_shares: dict, regions: np.ndarray, years: np.ndarray) -> dict:
+    """validate market_shares and compile every share type, returns {share_type: compile_share_matrix(...)}"""
+    validate_market_shares(market_shares)
+    return {share_type: compile_share_matrix(region_shares, regions, years)
+            for share_type, region_shares in market_shares.items()}
@@ -0,0 +1,239 @@
+# file for Monte Carlo uncertainty propagation through the stock balance
+"""
+Monte Carlo mode: the product splits (GRAVEL_SAND_PROD_SPLIT, GRAVEL_SAND_USE_SPLIT),
+the end rates of the conversion rate ramps and the MARKET_SHARES of a share type are
+sampled from user-given distributions, all other parameters are kept at their point
+estimate.
+
+Distributions are given per parameter:
+    distributions = {
+        "prod_split/sand": {"dist": "triangular", "left": 0.17, "mode": 0.193, "right": 0.21},
+        "use_split/gravel": {"dist": "normal", "loc": 0.461, "scale": 0.02},
+        "outflow_end_rate": {"dist": "uniform", "low": 0.25, "high": 0.75},
+        "inflow_end_rate": {"dist": "uniform", "low": 0.25, "high": 0.75},
+        "market_shares/sand": {"dist": "dirichlet", "concentration": 50},
+    }
+    df_mc = monte_carlo(df_clean, distributions, n_draws=5000)
+
+Splits and rates are clipped to [0, 1]. Market shares are sampled per region from a
+Dirichlet distribution around the (year independent) shares of the region, the
+concentration sets the spread (higher is narrower).
+
+All draws are sampled up front (so the result does not depend on the number of
+workers) and evaluated in chunks with the batched stock balance (draws are a leading
+axis). The chunks are spread over a process pool, the inflow/outflow arrays and the
+output array are in shared memory, so only the sampled parameters of a chunk are sent
+to a worker.
+
+The output has the format of scenario_data (region, variables, unit and a column per
+year) with a 'statistic' column (e.g. 'p5', 'p50', 'p95' and 'mean').
+"""
+
+# imports
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+from extract_stock_data import region_year_arrays
+from stock_balance import stock_balance
+from conversion_rates import compile_rate
+from scenario_sweep import conversion_rate_ramp
+from market_shares import compile_market_shares
+from stock_to_scenario_formatting import RECYCLED_ROUTES, YEARS
+from statics import UNIT, PREMISE_REGIONS, MARKET_SHARES, GRAVEL_SAND_PROD_SPLIT, GRAVEL_SAND_USE_SPLIT
+
+DEFAULT_END_RATE = 0.5  # end rate of the conversion rate ramps when it is not sampled
+PERCENTILES = (5, 50, 95)
+
+_worker = {}  # shared arrays of a worker process
+
+
+def draw(spec: dict, n_draws: int, rng: np.random.Generator) -> np.ndarray:
+    """return n_draws samples of a distribution spec"""
+    dist = spec["dist"]
+    if dist == "fixed":
+        return np.full(n_draws, float(spec["value"]))
+    if dist == "uniform":
+        return rng.uniform(spec["low"], spec["high"], n_draws)
+    if dist == "normal":
+        return rng.normal(spec["loc"], spec["scale"], n_draws)
+    if dist == "triangular":
+        return rng.triangular(spec["left"], spec["mode"], spec["right"], n_draws)
+    if dist == "lognormal":
+        return rng.lognormal(spec["mean"], spec["sigma"], n_draws)
+    raise BaseException(f"Unknown distribution '{dist}', options are fixed, uniform, normal, triangular, "
+                        f"lognormal (and dirichlet for market shares)")
+
+
+def sample(distributions: dict,
+           n_draws: int,
+           share_matrices: dict,
+           seed: int = 0) -> dict:
+    """sample all parameters, returns {parameter: array with the draws as first axis}
+
+    Parameters without a distribution get their point estimate. Shares are returned as
+    draw x region x route arrays for every share type in share_matrices.
+    """
+    rng = np.random.default_rng(seed)
+    known = ([f"prod_split/{p}" for p in GRAVEL_SAND_PROD_SPLIT] + [f"use_split/{p}" for p in GRAVEL_SAND_USE_SPLIT]
+             + ["outflow_end_rate", "inflow_end_rate"] + [f"market_shares/{t}" for t in share_matrices])
+    unknown = [name for name in distributions if name not in known]
+    if unknown:
+        raise BaseException(f"Unknown parameters {unknown}, options are {known}")
+
+    params = {}
+    point_estimates = {**{f"prod_split/{p}": v for p, v in GRAVEL_SAND_PROD_SPLIT.items()},
+                       **{f"use_split/{p}": v for p, v in GRAVEL_SAND_USE_SPLIT.items()},
+                       "outflow_end_rate": DEFAULT_END_RATE, "inflow_end_rate": DEFAULT_END_RATE}
+    for name, value in point_estimates.items():
+        spec = distributions.get(name, {"dist": "fixed", "value": value})
+        params[name] = np.clip(draw(spec, n_draws, rng), 0, 1)
+
+    for share_type, (routes, matrix, defined) in share_matrices.items():
+        shares = np.broadcast_to(matrix[:, 0], (n_draws,) + matrix[:, 0].shape).copy()
+        spec = distributions.get(f"market_shares/{share_type}")
+        if spec is not None:
+            if spec["dist"] != "dirichlet":
+                raise BaseException(f"market_shares/{share_type} must have a 'dirichlet' distribution")
+            if not np.allclose(matrix, matrix[:, :1]):
+                raise BaseException(f"Year dependent market shares ('{share_type}') can not be sampled")
+            for r in range(matrix.shape[0]):
+                alpha = spec["concentration"] * matrix[r, 0, defined[r]]
+                shares[:, r, defined[r]] = rng.dirichlet(alpha, n_draws)
+        params[f"market_shares/{share_type}"] = shares
+    return params
+
+
+def output_variables(share_matrices: dict) -> list:
+    """return the output variables as (variables, product, share type or None, route index)"""
+    variables = [(f"Production|{product.capitalize()}|{route}", product, None, None)
+                 for product, route in RECYCLED_ROUTES.items()]
+    for share_type, (routes, _, _) in share_matrices.items():
+        product = share_type.split(",")[0]
+        if product in RECYCLED_ROUTES:
+            variables += [(f"Production|{product.capitalize()}|{route}", product, share_type, i)
+                          for i, route in enumerate(routes)]
+    return variables
+
+
+def evaluate_draws(inflow: np.ndarray,
+                   outflow: np.ndarray,
+                   rate_profile: np.ndarray,
+                   year_idx: np.ndarray,
+                   params: dict,
+                   variables: list) -> np.ndarray:
+    """run the stock balance for a chunk of draws, returns a draw x variable x region x (selected) year array"""
+    ocr = params["outflow_end_rate"][:, None, None] * rate_profile
+    icr = params["inflow_end_rate"][:, None, None] * rate_profile
+    supply = {}
+    for product in RECYCLED_ROUTES:
+        all_supply, rec_supply, _, _ = stock_balance(inflow, outflow, ocr, icr,
+                                                     params[f"prod_split/{product}"][:, None, None],
+                                                     params[f"use_split/{product}"][:, None, None])
+        supply[product] = (all_supply[..., year_idx], rec_supply[..., year_idx])
+
+    result = np.empty((len(params["outflow_end_rate"]), len(variables), inflow.shape[0], len(year_idx)))
+    for v, (_, product, share_type, route) in enumerate(variables):
+        all_supply, rec_supply = supply[product]
+        if share_type is None:
+            result[:, v] = rec_supply
+        else:
+            result[:, v] = (all_supply - rec_supply) * params[f"market_shares/{share_type}"][:, :, route, None]
+    return result
+
+
+def _attach(name: str, shape: tuple) -> np.ndarray:
+    """return an array view on a shared memory block, the block is kept open in _worker"""
+    shm = shared_memory.SharedMemory(name=name)
+    _worker.setdefault("blocks", []).append(shm)
+    return np.ndarray(shape, dtype=float, buffer=shm.buf)
+
+
+def _init_worker(arrays: dict, rate_profile: np.ndarray, year_idx: np.ndarray, variables: list) -> None:
+    """attach the shared inflow, outflow and output arrays in a worker process"""
+    for key, (name, shape) in arrays.items():
+        _worker[key] = _attach(name, shape)
+    _worker.update(rate_profile=rate_profile, year_idx=year_idx, variables=variables)
+
+
+def _run_chunk(chunk: tuple) -> None:
+    """evaluate a chunk of draws in a worker and write it to the shared output array"""
+    start, stop, params = chunk
+    _worker["output"][start:stop] = evaluate_draws(_worker["inflow"], _worker["outflow"], _worker["rate_profile"],
+                                                    _worker["year_idx"], params, _worker["variables"])
+
+
+def monte_carlo(df: pd.DataFrame,
+                distributions: dict,
+                n_draws: int = 1000,
+                seed: int = 0,
+                n_workers: Optional[int] = None,
+                chunk_size: int = 250,
+                percentiles: tuple = PERCENTILES,
+                years: list = YEARS,
+                market_shares: dict = MARKET_SHARES) -> pd.DataFrame:
+    """propagate the parameter distributions through the stock balance and market shares
+
+    df is cleaned data (clean_and_reorganize, one material, no dimensions). n_workers
+    is the number of processes (default: number of CPUs), 1 runs in this process.
+
+    Returns the percentiles and mean over the draws per region, variable and year.
+    """
+    df = df.sort_values(["Region", "year"], ascending=True)
+    regions, all_years, _, _, inflow, outflow = region_year_arrays(df)
+    premise_regions = np.array([PREMISE_REGIONS.get(region, region) for region in regions], dtype=object)
+    year_idx = np.flatnonzero(np.isin(all_years, years))
+    rate_profile = np.asarray(compile_rate(conversion_rate_ramp(end_rate=1.0), "conversion rate ramp",
+                                           regions, all_years))
+
+    share_matrices = compile_market_shares(market_shares, premise_regions, all_years[year_idx])
+    variables = output_variables(share_matrices)
+    params = sample(distributions, n_draws, share_matrices, seed)
+    chunks = [(start, min(start + chunk_size, n_draws),
+               {name: values[start:start + chunk_size] for name, values in params.items()})
+              for start in range(0, n_draws, chunk_size)]
+    shape = (n_draws, len(variables), len(regions), len(year_idx))
+
+    if n_workers == 1 or len(chunks) == 1:
+        output = np.concatenate([evaluate_draws(inflow, outflow, rate_profile, year_idx, chunk_params, variables)
+                                 for _, _, chunk_params in chunks])
+    else:
+        blocks = {}
+        try:
+            arrays = {}
+            for key, array_shape in [("inflow", inflow.shape), ("outflow", outflow.shape), ("output", shape)]:
+                blocks[key] = shared_memory.SharedMemory(create=True, size=max(int(np.prod(array_shape)) * 8, 1))
+                arrays[key] = (blocks[key].name, array_shape)
+            np.ndarray(inflow.shape, dtype=float, buffer=blocks["inflow"].buf)[:] = inflow
+            np.ndarray(outflow.shape, dtype=float, buffer=blocks["outflow"].buf)[:] = outflow
+
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                     initargs=(arrays, rate_profile, year_idx, variables)) as executor:
+                list(executor.map(_run_chunk, chunks))
+            output = np.ndarray(shape, dtype=float, buffer=blocks["output"].buf).copy()
+        finally:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+
+    # statistics per variable, region and year, only for the routes that a region has
+    statistics = {f"p{p}": np.percentile(output, p, axis=0) for p in percentiles}
+    statistics["mean"] = output.mean(axis=0)
+
+    data = []
+    for v, (variable, _, share_type, route) in enumerate(variables):
+        rows = np.ones(len(regions), dtype=bool) if share_type is None else share_matrices[share_type][2][:, route]
+        for statistic, values in statistics.items():
+            frame = pd.DataFrame(values[v][rows], columns=[str(year) for year in all_years[year_idx]])
+            frame.insert(0, "statistic", statistic)
+            frame.insert(0, "unit", UNIT)
+            frame.insert(0, "variables", variable)
+            frame.insert(0, "region", premise_regions[rows])
+            data.append(frame)
+    df = pd.concat(data, ignore_index=True)
+    order = {statistic: i for i, statistic in enumerate(statistics)}
+    return (df.sort_values(["region", "variables", "statistic"], key=lambda col: col.map(order)
+                           if col.name == "statistic" else col, kind="stable")
+            .reset_index(drop=True))
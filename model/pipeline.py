@@ -0,0 +1,204 @@
+# file for running the complete model in one go
+"""
+Single entry point for the model, data is passed between the steps in memory:
+read excel (cached) -> clean_and_reorganize -> calculate_availability
+-> select_scenario_data -> reorder -> scenario_data.csv
+
+Intermediate results are only written when asked for (availability_export), as csv or
+as feather (a memory-mappable Arrow file) when the path ends with '.feather'.
+
+run_cached_pipeline runs the same steps as stages that are cached on disk (see
+stage_cache), a stage only reruns when its inputs, parameters or code change. E.g.
+changing MARKET_SHARES only reruns reorder, not the excel read or the stock balance.
+
+Set PROFILE_PATH to record the time, CPU time and peak memory of every stage (see
+utils.Stage) and write them as a Chrome trace.
+
+Run from the 'model' folder: python pipeline.py
+"""
+
+# imports
+from typing import Optional, Tuple, Union
+from time import time
+import os
+import pandas as pd
+
+from utils import write_feather, Stage, enable_profiling, write_profile
+from excel_cache import read_excel_cached, file_hash
+from extract_stock_data import (clean_and_reorganize, calculate_availability, calculate_availability_disaggregated,
+                                region_year_arrays, product_balances)
+from scenario_sweep import conversion_rate_ramp
+from stock_to_scenario_formatting import select_scenario_data, reorder, YEARS
+from market_shares import compile_market_shares, compile_share_matrix, shares_per_year
+from stage_cache import stage_key, run_stage, STAGE_CACHE_DIR
+from statics import MARKET_SHARES, IMAGE_REGIONS, PREMISE_REGIONS, MATERIAL_PROD_SPLIT, MATERIAL_USE_SPLIT
+import stock_balance
+import conversion_rates
+import frame_schema
+
+# Original file is from Deetman et al. (2020): https://github.com/SPDeetman/BUMA
+# in the folder 'output'
+WORKBOOK = "Supplementary Data (Original model).xlsx"
+SHEET_NAME = "material_output"
+SCENARIO_DATA_PATH = os.path.join("..", "datapackage", "scenario_data", "scenario_data.csv")
+PROFILE_PATH = None  # e.g. "profile.json", write a Chrome trace of all stages (chrome://tracing)
+
+
+def export(df: pd.DataFrame, path: str) -> None:
+    """write df to path as feather ('.feather') or csv"""
+    if path.lower().endswith(".feather"):
+        write_feather(df, path)
+    else:
+        df.to_csv(path, index=False)
+
+
+def run_pipeline(df_orig: Optional[pd.DataFrame] = None,
+                 workbook: str = WORKBOOK,
+                 sheet_name: str = SHEET_NAME,
+                 outflow_conversion_rate: Union[dict, float, int, None] = None,
+                 inflow_conversion_rate: Union[dict, float, int, None] = None,
+                 key_type: str = "year",
+                 float32: bool = False,
+                 scenario: str = "SSP2-Base-image",
+                 years: list = YEARS,
+                 market_shares: dict = MARKET_SHARES,
+                 availability_export: Optional[str] = None,
+                 scenario_data_export: Optional[str] = SCENARIO_DATA_PATH,
+                 prints: str = "end") -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """run all steps of the model and return the availability and scenario data
+
+    df_orig is the material_output sheet, it is read from workbook (through the
+    excel cache) if not given. Conversion rates that are not given default to the
+    0% to 50% ramp over 2025-2050 (see scenario_sweep.conversion_rate_ramp).
+    float32 stores all amounts as float32 instead of float64 (see frame_schema.py).
+
+    availability_export and scenario_data_export are optional paths to write the
+    availability data (csv or feather) and the premise scenario data (csv) to.
+    """
+    with Stage("pipeline", message="Pipeline done", prints=prints) as pipeline:
+        if df_orig is None:
+            with Stage("read", message="Data loaded", prints=prints) as stage:
+                df_orig, stage.cache_hit = read_excel_cached(workbook, sheet_name=sheet_name)
+                stage.output(df_orig)
+
+        df_clean = clean_and_reorganize(df_orig, prints=prints, float32=float32)
+
+        if outflow_conversion_rate is None:
+            outflow_conversion_rate = conversion_rate_ramp()
+        if inflow_conversion_rate is None:
+            inflow_conversion_rate = conversion_rate_ramp()
+
+        with Stage("availability", df_clean, "Data converted", prints) as stage:
+            df_done = stage.output(calculate_availability(df_clean,
+                                                          outflow_conversion_rate=outflow_conversion_rate,
+                                                          inflow_conversion_rate=inflow_conversion_rate,
+                                                          key_type=key_type))
+        if availability_export is not None:
+            export(df_done, availability_export)
+
+        with Stage("scenario data", df_done, "Scenario data created", prints) as stage:
+            df_scenario = stage.output(reorder(select_scenario_data(df_done, years), scenario, market_shares))
+        if scenario_data_export is not None:
+            df_scenario.to_csv(scenario_data_export, index=False)
+        pipeline.output(df_scenario)
+
+    return df_done, df_scenario
+
+
+def run_cached_pipeline(workbook: str = WORKBOOK,
+                        sheet_name: str = SHEET_NAME,
+                        outflow_conversion_rate: Union[dict, float, int, None] = None,
+                        inflow_conversion_rate: Union[dict, float, int, None] = None,
+                        key_type: str = "year",
+                        float32: bool = False,
+                        scenario: str = "SSP2-Base-image",
+                        years: list = YEARS,
+                        market_shares: dict = MARKET_SHARES,
+                        scenario_data_export: Optional[str] = SCENARIO_DATA_PATH,
+                        cache_dir: str = STAGE_CACHE_DIR,
+                        prints: str = "end") -> pd.DataFrame:
+    """run_pipeline with every stage cached on disk, returns the scenario data
+
+    Stages: ingest (excel cache) -> clean_and_reorganize -> calculate_availability
+    -> reorder -> datapackage export. Every stage is keyed by the keys of its input
+    stage, its parameters and its code (see stage_cache). Only the stages after the
+    first changed stage are computed and an input stage is only read from the cache
+    when the stage after it is not cached, the datapackage export (writing the csv)
+    is always done.
+    """
+    ts = time()
+    if outflow_conversion_rate is None:
+        outflow_conversion_rate = conversion_rate_ramp()
+    if inflow_conversion_rate is None:
+        inflow_conversion_rate = conversion_rate_ramp()
+
+    # stage keys, the ingest stage is keyed by the content of the workbook
+    ingest_key = file_hash(workbook) + f"/{sheet_name}"
+    clean_key = stage_key("clean", [ingest_key],
+                          {"IMAGE_REGIONS": IMAGE_REGIONS, "float32": float32},
+                          [clean_and_reorganize, frame_schema])
+    availability_key = stage_key("availability", [clean_key],
+                                 {"outflow_conversion_rate": outflow_conversion_rate,
+                                  "inflow_conversion_rate": inflow_conversion_rate,
+                                  "key_type": key_type,
+                                  "MATERIAL_PROD_SPLIT": MATERIAL_PROD_SPLIT,
+                                  "MATERIAL_USE_SPLIT": MATERIAL_USE_SPLIT},
+                                 [calculate_availability, calculate_availability_disaggregated,
+                                  region_year_arrays, product_balances, stock_balance, conversion_rates, frame_schema])
+    reorder_key = stage_key("reorder", [availability_key],
+                            {"scenario": scenario, "years": years, "market_shares": market_shares,
+                             "PREMISE_REGIONS": PREMISE_REGIONS},
+                            [select_scenario_data, reorder, compile_market_shares, compile_share_matrix,
+                             shares_per_year, frame_schema])
+
+    # lazy stages, a stage only requests its input when it is not cached
+    status = {}
+    outputs = {}
+
+    def stage(name, key, compute):
+        if name in outputs:
+            return outputs[name]
+        with Stage(name, message=f"Stage '{name}'", prints="end" if prints == "all" else "none") as s:
+            outputs[name], s.cache_hit = run_stage(name, key, compute, cache_dir)
+            s.output(outputs[name])
+        status[name] = s.status()
+        return outputs[name]
+
+    def ingest():
+        with Stage("ingest") as s:
+            df, s.cache_hit = read_excel_cached(workbook, sheet_name=sheet_name)
+            s.output(df)
+        status["ingest"] = s.status()
+        return df
+
+    def clean():
+        return clean_and_reorganize(ingest(), prints="none", float32=float32)
+
+    def availability():
+        return calculate_availability(stage("clean", clean_key, clean),
+                                      outflow_conversion_rate=outflow_conversion_rate,
+                                      inflow_conversion_rate=inflow_conversion_rate,
+                                      key_type=key_type)
+
+    def scenario_data():
+        return reorder(select_scenario_data(stage("availability", availability_key, availability), years),
+                       scenario, market_shares)
+
+    df_scenario = stage("reorder", reorder_key, scenario_data)
+
+    # datapackage export
+    if scenario_data_export is not None:
+        df_scenario.to_csv(scenario_data_export, index=False)
+
+    if prints in ["all", "end"]:
+        print(f"Pipeline done | Total time taken: {round(time() - ts, 1)}s | stages run: "
+              f"{[name for name, s in status.items() if s.get('cache') != 'hit']}")
+    return df_scenario
+
+
+if __name__ == "__main__":
+    if PROFILE_PATH is not None:
+        enable_profiling()
+    run_cached_pipeline()
+    if PROFILE_PATH is not None:
+        write_profile(PROFILE_PATH)
@@ -0,0 +1,168 @@
+# file for rolling up regional results to region groups
+"""
+A region mapping (e.g. GROUPED_REGIONS) is compiled to a sparse group x region
+aggregation matrix A, with A[g, r] = 1 if region r belongs to group g. Rolling up any
+array with a region axis is then one sparse matrix product over all other axes
+(years, scenarios, variables, draws, ...) at once.
+
+A region can be in several groups, e.g. to roll up to continents and the world in one
+go:
+    mapping = {region: [group, "World"] for region, group in GROUPED_REGIONS.items()}
+
+Amounts (inflow, outflow, supply, stock, scenario_data production) are summed.
+Substitution rates are not summed or averaged, they are recalculated from the summed
+recycled supply and all supply of the group.
+
+Mappings are validated when the matrix is built: every region of the data must be
+mapped, group names must be clean (no leading/trailing symbols like '#') and must
+not differ only in symbols or case from another group.
+
+Example:
+    df_groups = aggregate_regions(df_done, GROUPED_REGIONS)  # calculate_availability output
+    df_groups = aggregate_regions(df_scenario, GROUPED_PREMISE_REGIONS, region_col="region")
+"""
+
+# imports
+from typing import Tuple
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from statics import UNIT, IMAGE_REGIONS, GROUPED_REGIONS, PREMISE_REGIONS, IMAGE_REGION_COLORS
+
+
+def normalized_name(name: str) -> str:
+    """return a group name without symbols and case, to find near duplicates"""
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def validate_mapping(mapping: dict, regions=None) -> None:
+    """check a region mapping {region: group or list of groups}
+
+    If regions is given, every region must be in the mapping.
+    """
+    errors = []
+    groups = {}
+    for region, region_groups in mapping.items():
+        region_groups = [region_groups] if isinstance(region_groups, str) else list(region_groups)
+        if not region_groups:
+            errors.append(f"'{region}' is not in any group")
+        if len(set(region_groups)) < len(region_groups):
+            errors.append(f"'{region}' is in the same group more than once: {region_groups}")
+        for group in region_groups:
+            if not isinstance(group, str) or not re.fullmatch(r"[A-Za-z0-9](.*[A-Za-z0-9().])?", group):
+                errors.append(f"'{region}' has an invalid group name {group!r}")
+            else:
+                groups.setdefault(normalized_name(group), set()).add(group)
+    for names in groups.values():
+        if len(names) > 1:
+            errors.append(f"Group names differ only in symbols or case: {sorted(names)}")
+    if regions is not None:
+        missing = [str(region) for region in regions if region not in mapping]
+        if missing:
+            errors.append(f"Regions without a group: {missing}")
+    if errors:
+        raise BaseException("Invalid region mapping:\n" + "\n".join(errors))
+
+
+def validate_region_statics() -> None:
+    """check that the region mappings in statics.py cover the same IMAGE regions"""
+    image_regions = set(IMAGE_REGIONS.values())
+    errors = [f"{name} does not match IMAGE_REGIONS, differences: {sorted(image_regions ^ set(mapping))}"
+              for name, mapping in [("GROUPED_REGIONS", GROUPED_REGIONS), ("PREMISE_REGIONS", PREMISE_REGIONS),
+                                    ("IMAGE_REGION_COLORS", IMAGE_REGION_COLORS)]
+              if set(mapping) != image_regions]
+    if len(set(PREMISE_REGIONS.values())) < len(PREMISE_REGIONS):
+        errors.append("PREMISE_REGIONS maps several IMAGE regions to the same PREMISE region")
+    if errors:
+        raise BaseException("Invalid region statics:\n" + "\n".join(errors))
+    validate_mapping(GROUPED_REGIONS, image_regions)
+
+
+validate_region_statics()
+
+GROUPED_PREMISE_REGIONS = {
+    # GROUPED_REGIONS for PREMISE region names (e.g. in scenario_data)
+    PREMISE_REGIONS[region]: group for region, group in GROUPED_REGIONS.items()}
+
+
+def aggregation_matrix(mapping: dict, regions) -> Tuple[list, sparse.csr_matrix]:
+    """compile a mapping to a sparse group x region matrix for the given regions
+
+    Groups are sorted by name. Returns the groups and the matrix.
+    """
+    validate_mapping(mapping, regions)
+    pairs = [(group, r) for r, region in enumerate(regions)
+             for group in ([mapping[region]] if isinstance(mapping[region], str) else mapping[region])]
+    groups = sorted({group for group, _ in pairs})
+    group_idx = {group: g for g, group in enumerate(groups)}
+    rows = np.array([group_idx[group] for group, _ in pairs], dtype=int)
+    cols = np.array([r for _, r in pairs], dtype=int)
+    matrix = sparse.csr_matrix((np.ones(len(pairs)), (rows, cols)), shape=(len(groups), len(regions)))
+    return groups, matrix
+
+
+def aggregate_array(values: np.ndarray, matrix: sparse.csr_matrix, axis: int = 0) -> np.ndarray:
+    """sum the region axis of an array to groups, all other axes are kept"""
+    values = np.moveaxis(np.asarray(values, dtype=float), axis, 0)
+    result = matrix @ values.reshape(values.shape[0], -1)
+    return np.moveaxis(result.reshape((matrix.shape[0],) + values.shape[1:]), 0, axis)
+
+
+def aggregate_regions(df: pd.DataFrame, mapping: dict, region_col: str = "Region") -> pd.DataFrame:
+    """roll up a frame with a region column to the groups of mapping
+
+    Float columns are summed (NaN if no region of the group has a value), columns
+    ending with ' substitution' are recalculated from the summed supply, all other
+    columns (year, material, scenario, variables, unit, building dimensions, ...) are
+    kept as keys. Works for calculate_availability output and the scenario_data layout.
+    """
+    substitution_cols = [col for col in df.columns if str(col).endswith(" substitution")]
+    value_cols = [col for col in df.columns if col != region_col and col not in substitution_cols
+                  and pd.api.types.is_float_dtype(df[col])]
+    keys = [col for col in df.columns if col != region_col and col not in value_cols + substitution_cols]
+
+    regions, region_idx = np.unique(df[region_col].astype(str).to_numpy(), return_inverse=True)
+    groups, matrix = aggregation_matrix(mapping, regions)
+    if keys:
+        key_idx = df.groupby(keys, observed=True, sort=True, dropna=False).ngroup().to_numpy()
+    else:
+        key_idx = np.zeros(len(df), dtype=int)
+    n_keys = key_idx.max() + 1 if len(df) else 0
+    if len(np.unique(region_idx * n_keys + key_idx)) < len(df):
+        raise BaseException(f"Duplicate rows for the same {region_col} and {keys}")
+
+    # region x key x column arrays, the sums and the number of summed values per group
+    values = df[value_cols].to_numpy(dtype=float)
+    present = np.zeros((len(regions), n_keys, len(value_cols)))
+    amounts = np.zeros((len(regions), n_keys, len(value_cols)))
+    present[region_idx, key_idx] = ~np.isnan(values)
+    amounts[region_idx, key_idx] = np.nan_to_num(values, nan=0.0)
+    sums = aggregate_array(amounts, matrix)
+    counts = aggregate_array(present, (matrix != 0).astype(float))
+    sums[counts == 0] = np.nan
+
+    # only groups that have a region with the key
+    has_key = np.zeros((len(regions), n_keys))
+    has_key[region_idx, key_idx] = 1
+    group_idx, out_key_idx = np.nonzero(aggregate_array(has_key, matrix))
+
+    first = pd.Series(np.arange(len(df))).groupby(key_idx).first().to_numpy()
+    result = df[keys].iloc[first[out_key_idx]].reset_index(drop=True)
+    result.insert(0, region_col, np.asarray(groups, dtype=object)[group_idx])
+    result = pd.concat([result, pd.DataFrame(sums[group_idx, out_key_idx], columns=value_cols)], axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for col in substitution_cols:
+            product = col[:-len(" substitution")]
+            all_supply = result[f"all {product} supply ({UNIT})"].to_numpy()
+            rec_supply = result[f"recycled {product} supply ({UNIT})"].to_numpy()
+            result[col] = np.where(all_supply != 0, rec_supply / all_supply, 0.0)
+
+    result = result[list(df.columns)]
+    dtypes = {col: df[col].dtype for col in value_cols + substitution_cols}
+    if isinstance(df[region_col].dtype, pd.CategoricalDtype):
+        dtypes[region_col] = "category"
+    return result.astype(dtypes)
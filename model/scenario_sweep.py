@@ -0,0 +1,95 @@
+# file for evaluating many conversion rate assumptions at once
+"""
+Batched scenario sweep over conversion rate trajectories.
+
+Every scenario is a pair of outflow/inflow conversion rates (in any format accepted by
+`calculate_availability`). All scenarios are stacked in a scenario x region x year
+array and the stock balance is done for all of them in one pass.
+
+Example, sweep over the end rate of the 2025-2050 ramp:
+    scenarios = {
+        f"ramp to {rate}": {
+            "outflow_conversion_rate": conversion_rate_ramp(end_rate=rate),
+            "inflow_conversion_rate": conversion_rate_ramp(end_rate=rate),
+        } for rate in [0.1, 0.25, 0.5, 1]}
+    scenarios["no limit"] = {"outflow_conversion_rate": 1, "inflow_conversion_rate": 1}
+    df_sweep = sweep_conversion_rates(df_clean, scenarios)
+"""
+
+# imports
+from typing import Optional
+import pandas as pd
+import numpy as np
+
+from extract_stock_data import region_year_arrays, product_balances
+from conversion_rates import check_key_type, compile_rate
+from utils import profiled
+from statics import UNIT
+
+
+def conversion_rate_ramp(start_year: int = 2025,
+                         end_year: int = 2050,
+                         end_rate: float = 0.5,
+                         start_rate: float = 0.0,
+                         cap: Optional[float] = None,
+                         hold_until: Optional[int] = None) -> dict:
+    """return a year-keyed conversion rate dict growing linearly from start_rate to end_rate
+
+    start_rate is the rate in the year before start_year (and the rate of all years
+    that are not given), so the first ramp year is already one step above it.
+    With the defaults this is identical to the ramp in `extract_stock_data.py`:
+    np.linspace(0, 0.5, (2050 - 2025 + 2))[1:] for 2025-2050, 0 for any other year.
+
+    cap limits the rate to a maximum, hold_until keeps the end_rate for the years after
+    end_year up to and including hold_until.
+    """
+    rates = np.linspace(start_rate, end_rate, (end_year - start_year + 2))[1:]
+    if cap is not None:
+        rates = np.minimum(rates, cap)
+    rate = {start_year + i: float(r) for i, r in enumerate(rates)}
+    if hold_until is not None:
+        rate.update({year: rate[end_year] for year in range(end_year + 1, hold_until + 1)})
+    rate["any"] = start_rate
+    return rate
+
+
+@profiled
+def sweep_conversion_rates(df: pd.DataFrame,
+                           scenarios: dict,
+                           key_type: str = "year") -> pd.DataFrame:
+    """calculate sand and gravel supply and stock for many conversion rate scenarios at once
+
+    scenarios is a dict with the scenario id as key and a dict with (optional)
+    'outflow_conversion_rate' and 'inflow_conversion_rate' as value, rates that are not
+    given default to 1.0 like in `calculate_availability`.
+
+    Returns a tidy dataframe with a 'scenario' column followed by the columns of
+    `calculate_availability`, scenarios are in the order they were given.
+    """
+    if len(scenarios) == 0:
+        raise BaseException("At least one scenario must be given")
+    check_key_type(key_type)
+
+    df = df.sort_values(["Region", "year"], ascending=True)  # ensure the data is sorted as expected
+    regions, years, region_idx, year_idx, inflow, outflow = region_year_arrays(df)
+
+    # stack the rates of all scenarios to scenario x region x year
+    ocr = np.empty((len(scenarios), len(regions), len(years)))
+    icr = np.empty((len(scenarios), len(regions), len(years)))
+    for i, (scenario, rates) in enumerate(scenarios.items()):
+        ocr[i] = compile_rate(rates.get("outflow_conversion_rate", 1.0),
+                              f"{scenario}: outflow_conversion_rate", regions, years, key_type)
+        icr[i] = compile_rate(rates.get("inflow_conversion_rate", 1.0),
+                              f"{scenario}: inflow_conversion_rate", regions, years, key_type)
+
+    # all scenarios in one pass, in/outflow are broadcast over the scenarios
+    balances = product_balances(inflow, outflow, ocr, icr)
+
+    n_scenarios, n_rows = len(scenarios), len(df)
+    data = {"scenario": np.repeat(np.array(list(scenarios.keys()), dtype=object), n_rows)}
+    for col in ["Region", "year", f"inflow ({UNIT})", f"outflow ({UNIT})"]:
+        data[col] = np.tile(df[col].to_numpy(), n_scenarios)
+    for col, values in balances.items():
+        data[col] = values[:, region_idx, year_idx].ravel()
+
+    return pd.DataFrame(data)
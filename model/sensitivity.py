@@ -0,0 +1,240 @@
+# file for global sensitivity analysis of the stock model
+"""
+Sobol (Saltelli design) and Morris (elementary effects) sensitivity analysis of the
+recycled sand and gravel supply of `calculate_availability` to its parameters: the
+product splits, the conversion rate caps (outflow and inflow) and the start/end year
+and start/end rate of the conversion rate ramp.
+
+A problem is given like in SALib, with uniform bounds per parameter:
+    problem = {
+        "names": ["prod_split/sand", "outflow_end_rate", "start_year", ...],
+        "bounds": [[0.17, 0.21], [0.25, 0.75], [2020, 2035], ...],
+    }
+Parameters that are not in the problem get their point estimate (see POINT_ESTIMATES).
+
+The ramp is start_rate before start_year, grows linearly to end_rate in end_year
+(like scenario_sweep.conversion_rate_ramp) and stays at end_rate after end_year.
+Years can be fractional, so the output is continuous in the start and end year.
+
+All runs of a design are evaluated in batches with the vectorized stock balance (runs
+are a leading axis). Indices are returned per output, region and year.
+
+Example:
+    df_sobol = sobol_analysis(df_clean, PROBLEM, n_base=1024)
+    df_morris = morris_analysis(df_clean, PROBLEM, n_trajectories=100)
+"""
+
+# imports
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+
+from extract_stock_data import region_year_arrays
+from stock_balance import stock_balance
+from statics import UNIT, GRAVEL_SAND_PROD_SPLIT, GRAVEL_SAND_USE_SPLIT
+
+POINT_ESTIMATES = {
+    **{f"prod_split/{product}": split for product, split in GRAVEL_SAND_PROD_SPLIT.items()},
+    **{f"use_split/{product}": split for product, split in GRAVEL_SAND_USE_SPLIT.items()},
+    "outflow_end_rate": 0.5,
+    "inflow_end_rate": 0.5,
+    "start_rate": 0.0,
+    "start_year": 2025,
+    "end_year": 2050,
+}
+
+PROBLEM = {
+    # default problem: splits +-10%, conversion rate caps, ramp start rate and start/end year
+    "names": ["prod_split/sand", "prod_split/gravel", "use_split/sand", "use_split/gravel",
+              "outflow_end_rate", "inflow_end_rate", "start_rate", "start_year", "end_year"],
+    "bounds": [[0.9 * GRAVEL_SAND_PROD_SPLIT["sand"], 1.1 * GRAVEL_SAND_PROD_SPLIT["sand"]],
+               [0.9 * GRAVEL_SAND_PROD_SPLIT["gravel"], 1.1 * GRAVEL_SAND_PROD_SPLIT["gravel"]],
+               [0.9 * GRAVEL_SAND_USE_SPLIT["sand"], 1.1 * GRAVEL_SAND_USE_SPLIT["sand"]],
+               [0.9 * GRAVEL_SAND_USE_SPLIT["gravel"], 1.1 * GRAVEL_SAND_USE_SPLIT["gravel"]],
+               [0.1, 1.0], [0.1, 1.0], [0.0, 0.1], [2020, 2035], [2040, 2060]],
+}
+
+OUTPUT_YEARS = list(range(2021, 2051))
+BATCH_SIZE = 2048  # runs per batch of the stock balance
+
+
+def check_problem(problem: dict) -> None:
+    """check that the problem has known parameter names and valid bounds"""
+    unknown = [name for name in problem["names"] if name not in POINT_ESTIMATES]
+    if unknown:
+        raise BaseException(f"Unknown parameters {unknown}, options are {list(POINT_ESTIMATES)}")
+    if len(problem["names"]) != len(problem["bounds"]):
+        raise BaseException("The problem must have bounds for every parameter")
+    if any(low >= high for low, high in problem["bounds"]):
+        raise BaseException("The lower bound of every parameter must be below the upper bound")
+
+
+def scale(unit_samples: np.ndarray, problem: dict) -> np.ndarray:
+    """scale samples from the unit hypercube to the bounds of the problem"""
+    bounds = np.asarray(problem["bounds"], dtype=float)
+    return bounds[:, 0] + unit_samples * (bounds[:, 1] - bounds[:, 0])
+
+
+def ramp(years: np.ndarray, start_year: np.ndarray, end_year: np.ndarray,
+         start_rate: np.ndarray, end_rate: np.ndarray) -> np.ndarray:
+    """return the conversion rate ramp of every run as a run x year array"""
+    years = np.asarray(years, dtype=float)[None, :]
+    start_year, end_year = start_year[:, None], end_year[:, None]
+    start_rate, end_rate = start_rate[:, None], end_rate[:, None]
+    progress = np.clip((years - start_year + 1) / (end_year - start_year + 1), 0, 1)
+    return start_rate + (end_rate - start_rate) * progress
+
+
+def evaluate(inflow: np.ndarray,
+             outflow: np.ndarray,
+             years: np.ndarray,
+             output_idx: np.ndarray,
+             names: list,
+             X: np.ndarray,
+             batch_size: int = BATCH_SIZE) -> dict:
+    """run the stock balance for every run (row) of X, returns {output: run x region x output year array}"""
+    params = {name: np.full(len(X), float(value)) for name, value in POINT_ESTIMATES.items()}
+    params.update({name: X[:, i] for i, name in enumerate(names)})
+
+    outputs = {f"recycled {product} supply ({UNIT})": np.empty((len(X), inflow.shape[0], len(output_idx)))
+               for product in GRAVEL_SAND_PROD_SPLIT}
+    for start in range(0, len(X), batch_size):
+        batch = {name: values[start:start + batch_size] for name, values in params.items()}
+        ocr = ramp(years, batch["start_year"], batch["end_year"], batch["start_rate"], batch["outflow_end_rate"])
+        icr = ramp(years, batch["start_year"], batch["end_year"], batch["start_rate"], batch["inflow_end_rate"])
+        for product in GRAVEL_SAND_PROD_SPLIT:
+            _, rec_supply, _, _ = stock_balance(inflow, outflow, ocr[:, None, :], icr[:, None, :],
+                                                batch[f"prod_split/{product}"][:, None, None],
+                                                batch[f"use_split/{product}"][:, None, None])
+            outputs[f"recycled {product} supply ({UNIT})"][start:start + batch_size] = rec_supply[..., output_idx]
+    return outputs
+
+
+def model_arrays(df: pd.DataFrame, output_years: list) -> tuple:
+    """return the regions, years, output year index, inflow and outflow of cleaned data"""
+    df = df.sort_values(["Region", "year"], ascending=True)
+    regions, years, _, _, inflow, outflow = region_year_arrays(df)
+    output_idx = np.flatnonzero(np.isin(years, output_years))
+    return regions, years, output_idx, inflow, outflow
+
+
+def to_frame(indices: dict, names: list, regions: np.ndarray, years: np.ndarray) -> pd.DataFrame:
+    """convert {output: {index name: parameter x region x year array}} to a tidy dataframe"""
+    data = []
+    for output, output_indices in indices.items():
+        shape = next(iter(output_indices.values())).shape
+        grid = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), np.arange(shape[2]), indexing="ij")
+        frame = pd.DataFrame({
+            "output": output,
+            "Region": regions[grid[1].ravel()],
+            "year": years[grid[2].ravel()],
+            "parameter": np.asarray(names, dtype=object)[grid[0].ravel()],
+            **{name: values.ravel() for name, values in output_indices.items()},
+        })
+        data.append(frame)
+    return pd.concat(data, ignore_index=True)
+
+
+def saltelli_design(problem: dict, n_base: int, seed: int = 0) -> np.ndarray:
+    """return the Saltelli design: A, B and AB_i (A with column i from B), n_base * (k + 2) runs
+
+    A and B are the two halves of a scrambled Sobol sequence of dimension 2k.
+    """
+    k = len(problem["names"])
+    base = qmc.Sobol(d=2 * k, scramble=True, seed=seed).random(n_base)
+    A, B = base[:, :k], base[:, k:]
+    AB = np.repeat(A[None], k, axis=0)
+    for i in range(k):
+        AB[i, :, i] = B[:, i]
+    return scale(np.concatenate([A, B, AB.reshape(-1, k)]), problem)
+
+
+def sobol_analysis(df: pd.DataFrame,
+                   problem: dict = PROBLEM,
+                   n_base: int = 1024,
+                   seed: int = 0,
+                   output_years: list = OUTPUT_YEARS) -> pd.DataFrame:
+    """first order (S1) and total (ST) Sobol indices per output, region and year
+
+    Estimators of Saltelli et al. (2010) for S1 and Jansen (1999) for ST. n_base should
+    be a power of 2, the design has n_base * (k + 2) runs. Indices are NaN where the
+    output has no variance (e.g. years before any recycling).
+    """
+    check_problem(problem)
+    k = len(problem["names"])
+    regions, years, output_idx, inflow, outflow = model_arrays(df, output_years)
+    X = saltelli_design(problem, n_base, seed)
+    outputs = evaluate(inflow, outflow, years, output_idx, problem["names"], X)
+
+    indices = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for output, Y in outputs.items():
+            f_A, f_B = Y[:n_base], Y[n_base:2 * n_base]
+            f_AB = Y[2 * n_base:].reshape((k, n_base) + Y.shape[1:])
+            variance = np.var(np.concatenate([f_A, f_B]), axis=0)
+            variance = np.where(variance > 0, variance, np.nan)
+            indices[output] = {
+                "S1": np.mean(f_B[None] * (f_AB - f_A[None]), axis=1) / variance,
+                "ST": 0.5 * np.mean((f_A[None] - f_AB) ** 2, axis=1) / variance,
+            }
+    return to_frame(indices, problem["names"], regions, years[output_idx])
+
+
+def morris_design(problem: dict, n_trajectories: int, levels: int = 4, seed: int = 0) -> tuple:
+    """return the Morris design (n_trajectories * (k + 1) runs), the changed parameter and step of every run
+
+    Every trajectory starts at a random grid point and changes one parameter at a time
+    (in random order) by delta = levels / (2 * (levels - 1)). The changed parameter
+    and step (+delta or -delta) of the first run of a trajectory are -1 and 0.
+    """
+    rng = np.random.default_rng(seed)
+    k = len(problem["names"])
+    delta = levels / (2 * (levels - 1))
+    grid = np.arange(levels) / (levels - 1)
+
+    runs = np.empty((n_trajectories, k + 1, k))
+    changed = np.full((n_trajectories, k + 1), -1)
+    steps = np.zeros((n_trajectories, k + 1))
+    for t in range(n_trajectories):
+        point = rng.choice(grid[grid + delta <= 1 + 1e-12], size=k)
+        direction = rng.choice([-1, 1], size=k)
+        point = np.where(direction < 0, point + delta, point)  # start high if stepping down
+        runs[t, 0] = point
+        for j, i in enumerate(rng.permutation(k)):
+            point = point.copy()
+            point[i] += direction[i] * delta
+            runs[t, j + 1] = point
+            changed[t, j + 1] = i
+            steps[t, j + 1] = direction[i] * delta
+    return scale(runs.reshape(-1, k), problem), changed, steps
+
+
+def morris_analysis(df: pd.DataFrame,
+                    problem: dict = PROBLEM,
+                    n_trajectories: int = 100,
+                    levels: int = 4,
+                    seed: int = 0,
+                    output_years: list = OUTPUT_YEARS) -> pd.DataFrame:
+    """Morris elementary effects (mu, mu_star, sigma) per output, region and year
+
+    Elementary effects are in output units per unit of the scaled (0-1) parameter range.
+    """
+    check_problem(problem)
+    k = len(problem["names"])
+    regions, years, output_idx, inflow, outflow = model_arrays(df, output_years)
+    X, changed, steps = morris_design(problem, n_trajectories, levels, seed)
+    outputs = evaluate(inflow, outflow, years, output_idx, problem["names"], X)
+
+    indices = {}
+    for output, Y in outputs.items():
+        Y = Y.reshape((n_trajectories, k + 1) + Y.shape[1:])
+        effects = (Y[:, 1:] - Y[:, :-1]) / steps[:, 1:, None, None]  # trajectory x step x region x year
+        # order the effects by parameter instead of by step
+        order = np.argsort(changed[:, 1:], axis=1)
+        effects = np.take_along_axis(effects, order[:, :, None, None], axis=1)
+        indices[output] = {
+            "mu": effects.mean(axis=0),
+            "mu_star": np.abs(effects).mean(axis=0),
+            "sigma": effects.std(axis=0, ddof=1) if n_trajectories > 1 else np.full(effects.shape[1:], np.nan),
+        }
+    return to_frame(indices, problem["names"], regions, years[output_idx])
@@ -0,0 +1,101 @@
+# file for caching the output of model steps (stages) on disk
+"""
+Content-hash caching of stage outputs.
+
+The key of a stage is a hash of the keys of its inputs (upstream stages), its
+parameters and the source code of the functions/modules it runs. The output is stored
+as a feather file named after the stage and its key. A stage is only computed when no
+file exists for its key, older versions of a stage are evicted so that at most
+max_versions are kept per stage.
+
+Stages are evaluated lazily: the computation of a stage is a function that requests
+its inputs, so when a stage is cached its upstream stages are not read at all.
+"""
+
+# imports
+from typing import Callable, Tuple
+import hashlib
+import inspect
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils import write_feather, read_feather
+
+STAGE_CACHE_DIR = os.path.join(".cache", "stages")
+STAGE_MAX_VERSIONS = 3  # number of cached versions kept per stage
+
+
+def stable_repr(value) -> str:
+    """return a representation of (nested) parameters that does not depend on dict order or python session"""
+    if isinstance(value, dict):
+        items = sorted(f"{stable_repr(k)}:{stable_repr(v)}" for k, v in value.items())
+        return "{" + ",".join(items) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(stable_repr(v) for v in value) + "]"
+    if isinstance(value, np.ndarray):
+        return f"array({value.dtype},{value.shape},{hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()})"
+    if isinstance(value, pd.DataFrame):
+        content = pd.util.hash_pandas_object(value, index=True).to_numpy()
+        return f"frame({stable_repr(list(value.columns))},{stable_repr(content)})"
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return repr(float(value))
+    return repr(value)
+
+
+def code_version(*code) -> str:
+    """return a hash of the source code of functions and/or modules"""
+    h = hashlib.sha256()
+    for obj in code:
+        h.update(inspect.getsource(obj).encode())
+    return h.hexdigest()
+
+
+def stage_key(name: str, input_keys: list, params: dict, code: list) -> str:
+    """return the cache key of a stage from its input keys, parameters and code"""
+    h = hashlib.sha256()
+    for part in [name, stable_repr(input_keys), stable_repr(params), code_version(*code)]:
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def stage_path(name: str, key: str, cache_dir: str = STAGE_CACHE_DIR) -> str:
+    """return the cache file path for a stage and key"""
+    return os.path.join(cache_dir, f"{name}-{key[:32]}.feather")
+
+
+def evict_stale(name: str, cache_dir: str = STAGE_CACHE_DIR, max_versions: int = STAGE_MAX_VERSIONS) -> list:
+    """remove all but the max_versions most recently used files of a stage, returns removed files"""
+    if not os.path.isdir(cache_dir):
+        return []
+    files = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir)
+             if f.startswith(f"{name}-") and f.endswith(".feather")]
+    files.sort(key=os.path.getmtime, reverse=True)  # most recently used first
+    for path in files[max_versions:]:
+        os.remove(path)
+    return files[max_versions:]
+
+
+def run_stage(name: str,
+              key: str,
+              compute: Callable[[], pd.DataFrame],
+              cache_dir: str = STAGE_CACHE_DIR,
+              max_versions: int = STAGE_MAX_VERSIONS) -> Tuple[pd.DataFrame, bool]:
+    """return the output of a stage from the cache, or compute and cache it
+
+    Returns the output and whether it was a cache hit.
+    """
+    path = stage_path(name, key, cache_dir)
+    if os.path.isfile(path):
+        df = read_feather(path)
+        os.utime(path)  # mark as recently used for the eviction
+        return df, True
+
+    df = compute()
+    write_feather(df, path)
+    evict_stale(name, cache_dir, max_versions)
+    return df, False
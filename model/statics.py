@@ -1,6 +1,12 @@
 # file for static variables required in multiple files
 UNIT = "kt"
 
+BUILDING_DIMENSIONS = [
+    # building dimensions of the Deetman et al. (2020) data that can be kept instead of summed
+    "type",  # building type, e.g. residential or commercial types
+    "area",  # urban or rural
+    ]
+
 IMAGE_REGIONS = {
     # Mapping IMAGE region number (key) to IMAGE region name (value)
     # IMAGE regions: https://web.archive.org/web/20231128100726/https://models.pbl.nl/image/index.php/Region_classification_map
@@ -37,7 +43,7 @@ GROUPED_REGIONS = {
     # IMAGE regions: https://web.archive.org/web/20231128100726/https://models.pbl.nl/image/index.php/Region_classification_map
     "Canada": "North America",
     "USA": "North America",
-    "Mexico": "#North America",
+    "Mexico": "North America",
     "Central America": "Rest of America",
     "Brazil": "Rest of America",
     "Rest of South America": "Rest of America",
@@ -138,6 +144,7 @@ PREMISE_REGION_COLORS = {
 MARKET_SHARES = {
     # market shares of conventional production routes
     # production routes are based on ecoinvent market shares
+    # regions without own shares get the 'default' shares, shares can be year dependent (see market_shares.py)
     "gravel, crushed": {
         "default": {
             "GRAVEL_CRUSHED": 1,
@@ -165,16 +172,28 @@ MARKET_SHARES = {
 }
 
 GRAVEL_SAND_PROD_SPLIT = {
-    "gravel": 0.614,
-    "sand": 0.193
+    "sand": 0.193,
+    "gravel": 0.614
 }  # amounts based on ADR/HAS production. 1kg concrete can be converted to these products.
 
 GRAVEL_SAND_USE_SPLIT = {
-    "gravel": 0.461061682106339,
-    "sand": 0.373182244079256
+    "sand": 0.373182244079256,
+    "gravel": 0.461061682106339
 }  # amounts based on sand/gravel fraction in "concrete, all types to generic market for concrete, normal strength" ROW
    # summed from inventory results for "market for gravel" (round and crushed) and "market for sand"
 
+MATERIAL_PROD_SPLIT = {
+    # Mapping material (key) to the products its eol outflow can be converted to (value)
+    # add a split table here to calculate recycled supply for other materials (e.g. brick)
+    "concrete": GRAVEL_SAND_PROD_SPLIT,
+}
+
+MATERIAL_USE_SPLIT = {
+    # Mapping material (key) to the products used to make the material inflow (value)
+    # must have the same products as MATERIAL_PROD_SPLIT for the material
+    "concrete": GRAVEL_SAND_USE_SPLIT,
+}
+
 METHODS = [
     "EF v3.1, climate change, global warming potential (GWP100)",
     "EF v3.1, climate change: fossil, global warming potential (GWP100)",
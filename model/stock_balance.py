@@ -0,0 +1,69 @@
+# file for the vectorized stock balance used by calculate_availability
+"""
+Stock balance on arrays instead of rows.
+
+The carry-over of recycled material stock is only sequential along time, so the
+inputs are kept as arrays with time as the LAST axis. Any leading axes (e.g. regions,
+or scenarios x regions) are independent and are computed together: every year
+step is a single NumPy operation over all of them.
+"""
+
+# imports
+from typing import Tuple, Optional
+import numpy as np
+
+
+def stock_balance(inflow: np.ndarray,
+                  outflow: np.ndarray,
+                  outflow_conversion_rate: np.ndarray,
+                  inflow_conversion_rate: np.ndarray,
+                  prod_split: float,
+                  use_split: float,
+                  initial_stock: Optional[np.ndarray] = None,
+                  ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """calculate recycled supply and stock for one product (e.g. sand) over all rows at once.
+
+    All arrays must be broadcastable to a common shape (..., years). The rules are
+    identical to `balance_check` in `extract_stock_data.calculate_availability_loop`:
+    - more recycled material available than demand: full demand is supplied, the
+      remainder goes to stock
+    - less available and not enough stock: capped supply plus all stock, stock is depleted
+    - less available but stock covers the gap: full demand is supplied from stock
+
+    initial_stock is the stock before the first year (default 0), with the shape of
+    the leading axes.
+
+    Returns all supply (demand), recycled supply, stock and substitution rate, each
+    with the shape (..., years).
+    """
+    # maximum recycled availability from eol material and total demand for new stock
+    available = outflow * outflow_conversion_rate * prod_split
+    demand = inflow * use_split
+    # supply when stock has to be depleted, moderated by the inflow conversion rate
+    capped_supply = np.minimum(demand * inflow_conversion_rate, available)
+    balance = available - demand
+
+    shape = np.broadcast_shapes(available.shape, demand.shape, capped_supply.shape)
+    demand = np.broadcast_to(demand, shape)
+    capped_supply = np.broadcast_to(capped_supply, shape)
+    balance = np.broadcast_to(balance, shape)
+
+    rec_supply = np.empty(shape)
+    stock = np.empty(shape)
+    if initial_stock is None:
+        current = np.zeros(shape[:-1])
+    else:
+        current = np.array(np.broadcast_to(initial_stock, shape[:-1]), dtype=float)
+
+    for t in range(shape[-1]):
+        bal = balance[..., t]
+        # not enough material available and not enough stock to supply full demand
+        deplete = ~(bal > 0) & ((bal * -1) > current)
+        rec_supply[..., t] = np.where(deplete, capped_supply[..., t] + current, demand[..., t])
+        current = np.where(deplete, 0.0, current + bal)
+        stock[..., t] = current
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        substitution = np.where(demand != 0, rec_supply / demand, 0.0)
+
+    return np.array(demand), rec_supply, stock, substitution
@@ -1,105 +1,153 @@
 # imports
+from typing import Optional
 import pandas as pd
+import numpy as np
 import os
 
-from utils import df_status
+from utils import df_status, read_feather, profiled
 
-from statics import UNIT, PREMISE_REGIONS, MARKET_SHARES
+from frame_schema import apply_schema, float_dtype
+from market_shares import compile_market_shares
+from statics import UNIT, PREMISE_REGIONS, MARKET_SHARES, BUILDING_DIMENSIONS
 
 
-# read data
-df_orig = pd.read_csv("filtered_to_list.csv")
-
-print(f"Data loaded: {df_status(df_orig)}")
-
-# filter to only scenario data and right region names and drop irrelevant cols
+# years in the scenario data
 YEARS = [2025, 2030, 2035, 2040, 2045, 2050]
 
-# filter on years
-df_clean = df_orig[df_orig["year"].isin(YEARS)]
-# rename regions
-df_clean = df_clean.replace({"Region": PREMISE_REGIONS})
-# drop irrelevant cols
-df_clean = df_clean[["Region", "year",
-                     f"all sand supply ({UNIT})", f"recycled sand supply ({UNIT})",
-                     f"all gravel supply ({UNIT})", f"recycled gravel supply ({UNIT})"]]
-
-print(f"df cleaned: {df_status(df_clean)}")
-
-
-def reorder(df, scenario, MARKET_SHARES):
-    """TODO description"""
-
-    # get the correct market shares from MARKET_SHARES for the share_type (e.g. gravel, round) and region (e.g. BRA)
-    # will return dict of source types (variable, e.g. SAND_QUARRY) and amounts as key/values from MARKET_SHARES above
-    get_shares = lambda share_type, region: MARKET_SHARES[share_type].get(region, MARKET_SHARES[share_type]["default"])
-
-    def share_per_route(share_type):
-        """TODO description:
-        Calculate a share per conventional production route
-        """
-
-        _data = []
-
-        # infer aggregate type column
-        _share_type = share_type.split(",")[0]
-
-        total_conventional = (float(
-            row[f"all {_share_type} supply ({UNIT})"])
-            - float(row[f"recycled {_share_type} supply ({UNIT})"]))
-        for variable, share in get_shares(share_type, row["Region"]).items():
-            material = share_type.split(',')[0].capitalize()
-            var_name = f"Production|{material}|{variable}"
-            _row = {
-                "scenario": scenario,
-                "region": row["Region"],
-                "variables": var_name,
-                "unit": UNIT,
-                "year": str(row["year"]),
-                "amount": total_conventional * share,
-            }
-            _data.append(_row)
-        return _data
-
-    data = []
-
-    for _, row in df.iterrows():
-
-        data.append(
-            {  # sand HAS
-                "scenario": scenario,
-                "region": row["Region"],
-                "variables": "Production|Sand|SAND_HAS",
-                "unit": UNIT,
-                "year": str(row["year"]),
-                "amount": float(row[f"recycled sand supply ({UNIT})"]),
-            })
-
-        data = data + share_per_route("sand")
-
-        data.append(
-            { # gravel ADR
-            "scenario": scenario,
-            "region": row["Region"],
-            "variables": "Production|Gravel|GRAVEL_ADR",
-            "unit": UNIT,
-            "year": str(row["year"]),
-            "amount": float(row[f"recycled gravel supply ({UNIT})"]),
-        })
-
-        data = data + share_per_route("gravel, crushed")
-        data = data + share_per_route("gravel, round")
-
-    df = pd.DataFrame(data)
-
-    df = df.pivot_table(index=["scenario", "region", "variables", "unit"], columns="year", values="amount").reset_index()
-
-    return df
-
-df_reorder = reorder(df_clean, "SSP2-Base-image", MARKET_SHARES)
-
-print(f"df cleaned: {df_status(df_reorder)}")
-
-export_path = os.path.join(*[os.getcwd(), "..", "datapackage", "scenario_data", "scenario_data.csv"])
-
-df_reorder.to_csv(export_path, index=False)
+# recycled production route per aggregate type
+RECYCLED_ROUTES = {
+    "sand": "SAND_HAS",
+    "gravel": "GRAVEL_ADR",
+}
+
+
+@profiled
+def select_scenario_data(df: pd.DataFrame, years: list = YEARS) -> pd.DataFrame:
+    """filter availability data to the scenario years, rename regions to PREMISE regions and drop irrelevant cols
+
+    Regions are renamed through categorical codes, so every region name is mapped
+    only once instead of once per row.
+    """
+    # filter on years
+    df = df.loc[df["year"].isin(years)]
+
+    # rename regions
+    regions = df["Region"].astype("category")
+    premise_regions = np.array([PREMISE_REGIONS.get(region, region) for region in regions.cat.categories],
+                               dtype=object)
+
+    # drop irrelevant cols
+    columns = ([col for col in ["scenario", "material"] if col in df.columns]
+               + ["Region"] + [dim for dim in BUILDING_DIMENSIONS if dim in df.columns] + ["year"]
+               + [f"all sand supply ({UNIT})", f"recycled sand supply ({UNIT})",
+                  f"all gravel supply ({UNIT})", f"recycled gravel supply ({UNIT})"])
+    return apply_schema(df[columns].assign(Region=premise_regions[regions.cat.codes.to_numpy()]))
+
+
+@profiled
+def reorder(df: pd.DataFrame,
+            scenario: Optional[str],
+            MARKET_SHARES: dict,
+            scenario_shares: Optional[dict] = None) -> pd.DataFrame:
+    """convert recycled and total sand and gravel supply to production volumes per route
+
+    Recycled supply is production of the recycled routes (SAND_HAS, GRAVEL_ADR), the
+    remaining (conventional) supply is split over the conventional routes with the
+    market shares of the region in MARKET_SHARES (see market_shares.py, shares can be
+    year dependent). scenario_shares optionally gives other market shares per scenario.
+
+    The supply is pivoted to group x year arrays (a group is a scenario, region and
+    dimensions combination) and multiplied with the compiled region x year x route
+    share array of every share type, giving the premise scenario_data format (one
+    column per year) directly.
+    If scenario is None, df must have a 'scenario' column, so that many scenarios can
+    be converted at once. BUILDING_DIMENSIONS in df (e.g. 'type' and 'area') are kept
+    as extra columns after 'region'. The output has the column types of frame_schema.py.
+    """
+    dtype = float_dtype(df)
+    df = df.reset_index(drop=True)
+    dimensions = [dim for dim in BUILDING_DIMENSIONS if dim in df.columns]
+    scenarios = df["scenario"] if scenario is None else pd.Series(scenario, index=df.index)
+    keys = pd.DataFrame({
+        "scenario": scenarios,
+        "region": df["Region"],
+        **{dim: df[dim] for dim in dimensions},
+    })
+
+    # sorted groups and years, every row of df is one group x year cell
+    grouped = keys.groupby(list(keys.columns), sort=True, observed=True)
+    group_idx = grouped.ngroup().to_numpy()
+    groups = grouped.size().index.to_frame(index=False)
+    years, year_idx = np.unique(df["year"].to_numpy(), return_inverse=True)
+    if len(np.unique(group_idx * len(years) + year_idx)) < len(df):
+        raise BaseException("Data has duplicate entries for a scenario, region (and dimensions) and year")
+    regions, group_region = np.unique(groups["region"].to_numpy(dtype=object), return_inverse=True)
+
+    def wide(col):
+        values = np.full((len(groups), len(years)), np.nan)
+        values[group_idx, year_idx] = df[col].to_numpy(dtype=float)
+        return values
+
+    # blocks of output rows: (groups, variables, values group x year)
+    blocks = []
+
+    # recycled production routes
+    for material, route in RECYCLED_ROUTES.items():
+        blocks.append((np.arange(len(groups)), f"Production|{material.capitalize()}|{route}",
+                       wide(f"recycled {material} supply ({UNIT})")))
+
+    # conventional production routes, the remaining supply split with the market shares of the region
+    conventional = {material: wide(f"all {material} supply ({UNIT})") - wide(f"recycled {material} supply ({UNIT})")
+                    for material in RECYCLED_ROUTES.keys()}
+    scenario_shares = scenario_shares or {}
+    group_shares = np.array([id(scenario_shares.get(sc, MARKET_SHARES)) for sc in groups["scenario"]])
+    for shares in {id(shares): shares for shares in [MARKET_SHARES, *scenario_shares.values()]}.values():
+        in_shares = np.flatnonzero(group_shares == id(shares))
+        if len(in_shares) == 0:
+            continue
+        for share_type, (routes, matrix, defined) in compile_market_shares(shares, regions, years).items():
+            material = share_type.split(",")[0]
+            if material not in conventional:
+                continue
+            share_region = group_region[in_shares]
+            values = conventional[material][in_shares, :, None] * matrix[share_region]  # group x year x route
+            for r, route in enumerate(routes):
+                rows = defined[share_region, r]
+                blocks.append((in_shares[rows], f"Production|{material.capitalize()}|{route}", values[rows, :, r]))
+
+    # output in the order of the groups, then variables
+    group_rows = np.concatenate([rows for rows, _, _ in blocks])
+    variables = np.concatenate([np.full(len(rows), variable, dtype=object) for rows, variable, _ in blocks])
+    values = np.concatenate([block_values for _, _, block_values in blocks])
+    order = np.lexsort((variables.astype(str), group_rows))
+
+    df = groups.iloc[group_rows[order]].reset_index(drop=True)
+    df["variables"] = variables[order]
+    df["unit"] = UNIT
+    df = pd.concat([df, pd.DataFrame(values[order], columns=[str(year) for year in years])], axis=1)
+
+    # column types of the schema, amounts in the float type of the input
+    return apply_schema(df, float32=dtype == np.float32)
+
+
+if __name__ == "__main__":
+    # read data, the feather artifact of extract_stock_data.py if it exists
+    if os.path.isfile("filtered_to_list.feather"):
+        df_orig = read_feather("filtered_to_list.feather")
+    else:
+        df_orig = pd.read_csv("filtered_to_list.csv")
+
+    print(f"Data loaded: {df_status(df_orig)}")
+
+    # filter to only scenario data and right region names and drop irrelevant cols
+    df_clean = select_scenario_data(df_orig)
+
+    print(f"df cleaned: {df_status(df_clean)}")
+
+    df_reorder = reorder(df_clean, "SSP2-Base-image", MARKET_SHARES)
+
+    print(f"df cleaned: {df_status(df_reorder)}")
+
+    export_path = os.path.join(*[os.getcwd(), "..", "datapackage", "scenario_data", "scenario_data.csv"])
+
+    df_reorder.to_csv(export_path, index=False)
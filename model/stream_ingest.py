@@ -0,0 +1,151 @@
+# file for streaming ingestion of the Deetman et al. (2020) material_output data
+"""
+Streaming alternative to reading the full material_output sheet and running
+`extract_stock_data.clean_and_reorganize` on it.
+
+Rows are read one at a time (excel, openpyxl read-only mode) or per chunk (csv), the
+material and flow filters and the IMAGE_REGIONS mapping are applied while reading and
+the sum over 'type' and 'area' is done incrementally. Peak memory scales with the
+selected subset instead of the full workbook.
+
+The output has the same format as `clean_and_reorganize`.
+"""
+
+# imports
+from typing import Iterator, Tuple, Union, Optional
+import numpy as np
+import pandas as pd
+
+from utils import Stage
+from frame_schema import apply_schema
+from statics import UNIT, IMAGE_REGIONS, BUILDING_DIMENSIONS
+
+# columns of material_output that are not years
+ID_COLUMNS = ["Region", "flow", "type", "area", "material"]
+
+
+def iter_excel_rows(workbook: str, sheet_name: str = "material_output") -> Iterator[tuple]:
+    """yield the rows of an excel sheet as tuples, the first row is the header"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(workbook, read_only=True, data_only=True)
+    try:
+        yield from wb[sheet_name].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def key_columns(materials: Union[str, list] = "concrete", keep: Optional[list] = None) -> list:
+    """return the columns that flows are summed per (excluding 'flow'), like in clean_and_reorganize"""
+    multi_material = not isinstance(materials, str)
+    return ((["material"] if multi_material else []) + ["Region"]
+            + [dim for dim in BUILDING_DIMENSIONS if dim in (keep or [])])
+
+
+def sum_rows(rows: Iterator[tuple],
+             materials: Union[str, list] = "concrete",
+             keep: Optional[list] = None) -> Tuple[list, dict]:
+    """filter and sum rows of material_output per key_columns and flow
+
+    rows is an iterator over tuples of which the first is the header. Only rows of the
+    given material(s) and with a flow other than 'stock' are kept. keep is an optional
+    list of BUILDING_DIMENSIONS that are not summed.
+
+    Returns the years and a dict with the values of key_columns and flow as key (e.g.
+    (Region name, flow)) and an array with the summed amount per year as value.
+    """
+    selected = set([materials] if isinstance(materials, str) else materials)
+
+    header = list(next(rows))
+    idx = {col: header.index(col) for col in ID_COLUMNS}
+    key_idx = [idx[col] for col in key_columns(materials, keep) + ["flow"]]
+    region_pos = key_columns(materials, keep).index("Region")
+    year_idx = [i for i, col in enumerate(header) if col not in ID_COLUMNS and col is not None]
+    years = [header[i] for i in year_idx]
+
+    sums = {}
+    for row in rows:
+        if row[idx["material"]] not in selected or row[idx["flow"]] == "stock":
+            continue
+        key = [row[i] for i in key_idx]
+        key[region_pos] = IMAGE_REGIONS[key[region_pos]]
+        key = tuple(key)
+        # blank cells count as 0, like the pandas sums of clean_and_reorganize and sum_csv_chunks
+        values = np.nan_to_num(np.array([row[i] for i in year_idx], dtype=float), nan=0.0)
+        if key in sums:
+            sums[key] += values
+        else:
+            sums[key] = values
+    return years, sums
+
+
+def sum_csv_chunks(path: str,
+                   materials: Union[str, list] = "concrete",
+                   keep: Optional[list] = None,
+                   chunksize: int = 10_000) -> Tuple[list, dict]:
+    """same as sum_rows, but reading a csv export of material_output in chunks
+
+    Only the running sum per key is kept in memory, kept dimensions are categoricals.
+    """
+    selected = [materials] if isinstance(materials, str) else materials
+    keys = key_columns(materials, keep) + ["flow"]
+    total = None
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        chunk = chunk.loc[chunk["material"].isin(selected) & (chunk["flow"] != "stock")]
+        chunk = chunk.drop(columns=[col for col in ID_COLUMNS if col not in keys])
+        chunk["Region"] = chunk["Region"].map(IMAGE_REGIONS)
+        chunk = chunk.astype({col: "category" for col in keys})
+        chunk = chunk.groupby(keys, observed=True).sum()
+        total = chunk if total is None else total.add(chunk, fill_value=0)
+
+    # csv headers are strings, convert year columns back to int like in the excel sheet
+    years = [int(year) if str(year).isdigit() else year for year in total.columns]
+    index = total.index if isinstance(total.index, pd.MultiIndex) else [(key,) for key in total.index]
+    sums = {tuple(key): values for key, values in zip(index, total.to_numpy(dtype=float))}
+    return years, sums
+
+
+def to_list(years: list, sums: dict, id_columns: list) -> pd.DataFrame:
+    """convert summed flows to the list format of clean_and_reorganize: id_columns, year, inflow and outflow"""
+    order = np.argsort(years, kind="stable")  # years in ascending order, like after a pivot
+    years = [years[i] for i in order]
+    rows = sorted({key[:-1] for key in sums.keys()})  # e.g. (Region,)
+    flows = sorted({key[-1] for key in sums.keys()})
+
+    df = pd.DataFrame({col: np.repeat([row[i] for row in rows], len(years)) for i, col in enumerate(id_columns)})
+    df = df.astype({dim: "category" for dim in BUILDING_DIMENSIONS if dim in id_columns})
+    df["year"] = np.tile(np.array(years), len(rows))
+    for flow in flows:
+        df[flow] = np.concatenate([sums[row + (flow,)][order] if row + (flow,) in sums
+                                   else np.full(len(years), np.nan)
+                                   for row in rows])
+    df.rename(columns={"inflow": f"inflow ({UNIT})", "outflow": f"outflow ({UNIT})"}, inplace=True)
+    return df
+
+
+def stream_clean_and_reorganize(path: str,
+                                sheet_name: str = "material_output",
+                                materials: Union[str, list] = "concrete",
+                                keep: Optional[list] = None,
+                                prints: str = "end",
+                                float32: bool = False) -> pd.DataFrame:
+    """read, filter and reorganize material_output in a single streaming pass
+
+    path can be the excel workbook or a csv export of the material_output sheet
+    (.csv), which is read in chunks. materials is the material to keep or a list of
+    materials and keep the BUILDING_DIMENSIONS to keep, like in clean_and_reorganize.
+    The output has the column types of frame_schema.py, with float32 amounts if float32.
+
+    prints is optional variable for printing convenience data, options are
+    - end (print only final result)
+    - anything else (don't print)
+    """
+    with Stage("stream_clean_and_reorganize", message="Streamed, cleaned and reorganized",
+               prints="end" if prints == "end" else "none") as stage:
+        if path.lower().endswith(".csv"):
+            years, sums = sum_csv_chunks(path, materials, keep)
+        else:
+            years, sums = sum_rows(iter_excel_rows(path, sheet_name), materials, keep)
+        stage.step("Filtered and summed rows")
+        df = stage.output(apply_schema(to_list(years, sums, key_columns(materials, keep)), float32))
+    return df
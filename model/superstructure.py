@@ -0,0 +1,209 @@
+# file for exporting the market changes of the aggregate scenarios as a superstructure scenario difference file
+"""
+Fast path for the 'external' changes of the datapackage, without building a premise
+NewDatabase (see run_locally.py): premise turns the production volumes of the
+production pathways (scenario_data.csv) into the shares of the pathways in the
+markets of config.yaml. These shares are calculated here directly, for all markets,
+regions, scenarios and years at once, and written as a superstructure scenario
+difference file (one row per market input, one column per scenario and year), which
+can be imported in the Activity Browser on top of a database with these markets.
+
+The share of pathway p in a market in a region and year is the production volume of
+p over the sum of the production volumes of all pathways the market includes
+(interpolated linearly between the years of scenario_data). Markets without any
+production volume in a region get no inputs there.
+
+The markets are created in every region, like the datasets listed in 'regionalize' of
+config.yaml. Other pathway datasets are not copied to the regions by premise, these
+are linked in their location in the database (SUPPLIER_LOCATIONS), which needs the
+codes of the database.
+
+Only the market inputs are exported, the relinking of the consumers of replaced
+markets ('replaces' in config.yaml) is done once when the markets are created.
+
+Run from the 'model' folder: python superstructure.py
+"""
+
+# imports
+from typing import Optional
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from utils import Stage
+from stock_to_scenario_formatting import YEARS
+
+SCENARIO_DATA_PATH = os.path.join("..", "datapackage", "scenario_data", "scenario_data.csv")
+CONFIG_PATH = os.path.join("..", "datapackage", "configuration_file", "config.yaml")
+DATAPACKAGE_PATH = os.path.join("..", "datapackage", "datapackage.json")
+SDF_PATH = "scenario_difference_file.csv"
+SDF_SEPARATOR = ";"
+DATABASE = "premise_sand_gravel"  # database with the markets and pathways
+SUPPLIER_LOCATIONS = ["RoW", "GLO"]  # location of a dataset that is not regionalized, in order of preference
+
+SDF_COLUMNS = ["from activity name", "from reference product", "from location", "from categories",
+               "from database", "from key", "to activity name", "to reference product", "to location",
+               "to categories", "to database", "to key", "flow type"]
+
+
+def scenario_columns(scenarios: list, iam_scenarios: dict, years: list) -> list:
+    """return the column name of every scenario and year, like premise: '<model> - <pathway> - <year>'
+
+    Scenarios that are compatible with the same IAM scenario get their name added.
+    """
+    names = {}
+    for scenario in scenarios:
+        iam = (iam_scenarios.get(scenario) or [{}])[0]
+        names[scenario] = f"{iam.get('model', 'unknown')} - {iam.get('pathway', 'unknown')}"
+    duplicates = {name for name in names.values() if list(names.values()).count(name) > 1}
+    return [f"{names[s]}{f' - {s}' if names[s] in duplicates else ''} - {year}" for s in scenarios for year in years]
+
+
+def volume_array(df: pd.DataFrame, variables: list, years: list) -> tuple:
+    """reshape scenario data to a scenario x region x variable x year array, interpolated to years
+
+    Variables that a region does not have are 0. Returns the scenarios, regions and array.
+    """
+    data_years = [col for col in df.columns if str(col).isdigit()]
+    df = df.loc[df["variables"].isin(variables)]
+    scenarios, scenario_idx = np.unique(df["scenario"].astype(str).to_numpy(), return_inverse=True)
+    regions, region_idx = np.unique(df["region"].astype(str).to_numpy(), return_inverse=True)
+    variable_idx = pd.Index(variables).get_indexer(df["variables"])
+
+    values = np.zeros((len(scenarios), len(regions), len(variables), len(data_years)))
+    values[scenario_idx, region_idx, variable_idx] = df[data_years].to_numpy(dtype=float)
+    # linear interpolation as a data year x year weight matrix (constant outside the data years)
+    x = np.asarray(data_years, dtype=float)
+    weights = np.stack([np.interp(years, x, unit) for unit in np.eye(len(x))])
+    return scenarios, regions, values @ weights
+
+
+def market_shares(df: pd.DataFrame, config: dict, years: list = YEARS) -> tuple:
+    """return the shares of the pathways in the markets of config for all scenarios, regions and years
+
+    Returns the scenarios, regions, the (market, pathway) pairs and a
+    pair x scenario x region x year share array.
+    """
+    pathways = config.get("production pathways") or {}
+    variables = [settings["production volume"]["variable"] for settings in pathways.values()]
+    scenarios, regions, volumes = volume_array(df, variables, years)
+    pathway_idx = {pathway: i for i, pathway in enumerate(pathways)}
+
+    pairs, shares = [], []
+    for market in config.get("markets") or []:
+        unknown = [pathway for pathway in market.get("includes", []) if pathway not in pathway_idx]
+        if unknown:
+            raise BaseException(f"Market '{market['name']}' includes unknown pathways {unknown}")
+        included = volumes[:, :, [pathway_idx[pathway] for pathway in market["includes"]]]
+        total = included.sum(axis=2, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            market_share = np.where(total > 0, included / total, 0.0)  # scenario x region x pathway x year
+        pairs += [(market, pathway) for pathway in market["includes"]]
+        shares.append(np.moveaxis(market_share, 2, 0))
+    if not shares:
+        return scenarios, regions, pairs, np.zeros((0,) + volumes.shape[:2] + (len(years),))
+    return scenarios, regions, pairs, np.concatenate(shares)
+
+
+def activity_key(codes: Optional[dict], name: str, product: str, location: str, database: str) -> str:
+    """return the key of an activity as '(database, code)', empty without codes"""
+    if codes is None:
+        return ""
+    code = codes.get((name, product, location))
+    if code is None:
+        raise BaseException(f"Activity ('{name}', '{product}', '{location}') is not in the database")
+    return str((database, code))
+
+
+def supplier_location(locations: Optional[dict], regionalized: set, name: str, product: str, region: str) -> str:
+    """return the location of the pathway dataset that supplies a market in region
+
+    Regionalized datasets have a copy in region, the location of other datasets comes
+    from locations, the {(name, reference product): locations} of the database: the
+    first of SUPPLIER_LOCATIONS, else its only location.
+    """
+    if (name, product) in regionalized:
+        return region
+    if locations is None:
+        raise BaseException(f"Dataset ('{name}', '{product}') is not regionalized in config.yaml, "
+                            f"the codes of the database are needed for its location")
+    found = locations.get((name, product), set())
+    for location in SUPPLIER_LOCATIONS:
+        if location in found:
+            return location
+    if len(found) != 1:
+        raise BaseException(f"Dataset ('{name}', '{product}') is not regionalized in config.yaml and has "
+                            f"no single location in the database: {sorted(found)}")
+    return next(iter(found))
+
+
+def scenario_difference(df: pd.DataFrame,
+                        config: dict,
+                        iam_scenarios: dict,
+                        years: list = YEARS,
+                        database: str = DATABASE,
+                        codes: Optional[dict] = None) -> pd.DataFrame:
+    """return the scenario difference frame of the market shares
+
+    iam_scenarios is the 'scenarios' block of datapackage.json. codes is an optional
+    {(name, reference product, location): code} lookup of the database, to fill the
+    keys (every activity must be in it) and to find the location of the pathway
+    datasets that are not regionalized (needed if a market includes one). Inputs that
+    are 0 in all scenarios are left out.
+    """
+    scenarios, regions, pairs, shares = market_shares(df, config, years)
+    pathways = config.get("production pathways") or {}
+    regionalized = {(d.get("name"), d.get("reference product"))
+                    for d in (config.get("regionalize") or {}).get("datasets") or []}
+    locations = None
+    if codes is not None:
+        locations = {}
+        for name, product, location in codes:
+            locations.setdefault((name, product), set()).add(location)
+    columns = scenario_columns(list(scenarios), iam_scenarios, years)
+
+    # pair x region rows, scenario x year columns
+    values = np.moveaxis(shares, 2, 1).reshape(len(pairs) * len(regions), -1)
+    keep = np.flatnonzero((values != 0).any(axis=1))
+    rows = []
+    for i in keep:
+        (market, pathway), region = pairs[i // len(regions)], regions[i % len(regions)]
+        alias = pathways[pathway]["ecoinvent alias"]
+        location = supplier_location(locations, regionalized, alias["name"], alias["reference product"], region)
+        rows.append((alias["name"], alias["reference product"], location, "", database,
+                     activity_key(codes, alias["name"], alias["reference product"], location, database),
+                     market["name"], market["reference product"], region, "", database,
+                     activity_key(codes, market["name"], market["reference product"], region, database),
+                     "technosphere"))
+    sdf = pd.DataFrame(rows, columns=SDF_COLUMNS)
+    return pd.concat([sdf, pd.DataFrame(values[keep], columns=columns)], axis=1)
+
+
+def export_scenario_difference(path: str = SDF_PATH,
+                               scenario_data_path: str = SCENARIO_DATA_PATH,
+                               config_path: str = CONFIG_PATH,
+                               datapackage_path: str = DATAPACKAGE_PATH,
+                               years: list = YEARS,
+                               database: str = DATABASE,
+                               codes: Optional[dict] = None) -> pd.DataFrame:
+    """read the datapackage files, write the scenario difference file (csv or xlsx) and return it"""
+    df = pd.read_csv(scenario_data_path, encoding="utf-8-sig")
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    with open(datapackage_path, "r", encoding="utf-8") as f:
+        iam_scenarios = json.load(f).get("scenarios", {})
+
+    sdf = scenario_difference(df, config, iam_scenarios, years, database, codes)
+    if path.endswith(".xlsx"):
+        sdf.to_excel(path, index=False)
+    else:
+        sdf.to_csv(path, index=False, sep=SDF_SEPARATOR)
+    return sdf
+
+
+if __name__ == "__main__":
+    with Stage("superstructure", message="Scenario difference file written", prints="end") as stage:
+        stage.output(export_scenario_difference())
@@ -0,0 +1,153 @@
+# file for generating synthetic data in the format of the Deetman et al. (2020) material_output sheet
+"""
+Synthetic material_output data, so that the model can be run (and benchmarked) without
+the original workbook. Also a synthetic technosphere around the aggregate_LCI.csv
+inventory, so that batch_lca can be run without ecoinvent.
+
+The layout is the same as the material_output sheet: one row per Region (code), flow
+(inflow, outflow, stock), type, area and material, and one column per year.
+With more than 26 regions, the extra regions are (fictional) sub-national units of the
+IMAGE regions, e.g. 'Brazil 1', their names are given by synthetic_region_names.
+
+Example:
+    df_orig = synthetic_material_output(n_regions=260, materials=["concrete", "steel"])
+    df_clean = clean_and_reorganize(df_orig, region_names=synthetic_region_names(260))
+"""
+
+# imports
+from typing import Iterable
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from statics import IMAGE_REGIONS, METHODS
+
+FLOWS = ["inflow", "outflow", "stock"]
+TYPES = ["detached", "semi-detached", "appartments", "high-rise", "office", "retail+", "hotels+", "govt+"]
+AREAS = ["urban", "rural", "commercial"]
+MATERIALS = ["concrete", "steel", "wood", "brick", "copper", "aluminium", "glass"]
+
+
+def synthetic_region_names(n_regions: int = 26) -> dict:
+    """return the region code: region name mapping of synthetic data with n_regions
+
+    The first 26 regions are the IMAGE_REGIONS, the next are sub-national units of
+    the IMAGE regions.
+    """
+    names = {}
+    for code in range(1, n_regions + 1):
+        image_region = IMAGE_REGIONS[(code - 1) % len(IMAGE_REGIONS) + 1]
+        unit = (code - 1) // len(IMAGE_REGIONS)
+        names[code] = image_region if unit == 0 else f"{image_region} {unit}"
+    return names
+
+
+def synthetic_material_output(n_regions: int = 26,
+                              years: Iterable[int] = range(1970, 2051),
+                              materials: list = ("concrete",),
+                              n_types: int = len(TYPES),
+                              n_areas: int = len(AREAS),
+                              seed: int = 0) -> pd.DataFrame:
+    """return synthetic data in the format of the material_output sheet
+
+    Inflow grows over time with a random level per region, type, area and material,
+    outflow lags the inflow and stock is the cumulative difference. Type and area
+    names are taken from TYPES and AREAS (numbered beyond their length). The data
+    only depends on the arguments, the same seed gives the same data.
+    """
+    years = list(years)
+    types = [TYPES[i] if i < len(TYPES) else f"type {i}" for i in range(n_types)]
+    areas = [AREAS[i] if i < len(AREAS) else f"area {i}" for i in range(n_areas)]
+    materials = list(materials)
+    rng = np.random.default_rng(seed)
+
+    # one series per region, type, area and material
+    index = pd.MultiIndex.from_product([range(1, n_regions + 1), types, areas, materials],
+                                       names=["Region", "type", "area", "material"])
+    n = len(index)
+    t = np.arange(len(years), dtype=float)
+    level = rng.lognormal(mean=2.0, sigma=1.0, size=(n, 1))
+    growth = rng.uniform(0.0, 0.04, size=(n, 1))
+    noise = rng.uniform(0.8, 1.2, size=(n, len(years)))
+    inflow = level * np.exp(growth * t) * noise
+
+    # outflow follows the inflow with a lag of 'lag' years and a part of it
+    lag = rng.integers(20, 50, size=n)
+    lagged = np.zeros_like(inflow)
+    for i in np.unique(lag):
+        rows = lag == i
+        lagged[rows, i:] = inflow[rows, :-i] if i < len(years) else 0
+    outflow = lagged * rng.uniform(0.3, 0.9, size=(n, 1))
+    stock = np.cumsum(inflow - outflow, axis=1)
+
+    ids = index.to_frame(index=False)
+    values = np.concatenate([inflow, outflow, stock])
+    return pd.DataFrame({
+        "Region": np.tile(ids["Region"].to_numpy(), len(FLOWS)),
+        "flow": np.repeat(FLOWS, n),
+        **{col: np.tile(ids[col].to_numpy(), len(FLOWS)) for col in ["type", "area", "material"]},
+        **{year: values[:, i] for i, year in enumerate(years)},
+    })
+
+
+def synthetic_technosphere(inventory,
+                           routes: dict,
+                           regions: list,
+                           years: Iterable[int] = range(2025, 2051, 5),
+                           n_flows: int = 20,
+                           seed: int = 0) -> tuple:
+    """return a synthetic LCA system per year around the activities of an inventory (inventory.Inventory)
+
+    Every activity of the inventory is copied to every region, with its exchanges
+    linked within the region. Exchanges with activities outside the inventory (e.g.
+    electricity from ecoinvent) and route activities (routes is {route: (name,
+    reference product)}) that are not in the inventory become background activities,
+    which emit random amounts of n_flows elementary flows that decline over the years.
+    The technosphere matrix is the same (object) for all years.
+
+    Returns the activities (name, reference product, location; row i is product and
+    activity i), the flows, the systems {("synthetic", year): (technosphere,
+    biosphere)} and random characterization factors {method: {flow: factor}} of METHODS.
+    """
+    years = list(years)
+    rng = np.random.default_rng(seed)
+    foreground = [(a["name"], a.get("reference product")) for a in inventory.activities]
+    exchanges = inventory.to_frame()
+    external = exchanges.loc[exchanges["type"] == "technosphere", ["name", "reference product"]]
+    background = list(dict.fromkeys([key for key in map(tuple, external.to_numpy()) if key not in foreground]
+                                    + [key for key in routes.values() if key not in foreground]))
+    keys = foreground + background
+    activities = pd.DataFrame([(name, product, region) for region in regions for name, product in keys],
+                              columns=["name", "reference product", "location"])
+    idx = {(name, product, region): i for i, (name, product, region) in enumerate(activities.to_numpy())}
+
+    # production on the diagonal, inputs of the foreground activities within their region
+    rows, cols, values = list(range(len(activities))), list(range(len(activities))), [1.0] * len(activities)
+    for i, activity in enumerate(inventory.activities):
+        for _, exchange in inventory.exchanges(i).iterrows():
+            key = (exchange["name"], exchange["reference product"])
+            for region in regions:
+                col = idx[keys[i] + (region,)]
+                if exchange["type"] == "production":
+                    values[col] = exchange["amount"]
+                elif exchange["type"] == "technosphere":
+                    rows.append(idx[key + (region,)])
+                    cols.append(col)
+                    values.append(-exchange["amount"])
+    technosphere = sparse.csr_matrix((values, (rows, cols)), shape=(len(activities), len(activities)))
+
+    # emissions of the background activities, declining by a random rate per activity
+    flows = [f"flow {i}" for i in range(n_flows)]
+    background_cols = np.flatnonzero(np.tile(np.arange(len(keys)) >= len(foreground), len(regions)))
+    intensity = rng.lognormal(mean=0.0, sigma=1.0, size=(n_flows, len(background_cols)))
+    intensity *= rng.random((n_flows, len(background_cols))) < 0.5  # sparse emissions
+    decline = rng.uniform(0.0, 0.03, size=len(background_cols))
+    systems = {}
+    for year in years:
+        factor = (1 - decline) ** (year - years[0])
+        biosphere = sparse.lil_matrix((n_flows, len(activities)))
+        biosphere[:, background_cols] = intensity * factor
+        systems[("synthetic", year)] = (technosphere, biosphere.tocsr())
+
+    cfs = {method: {flow: float(rng.lognormal()) for flow in flows if rng.random() < 0.3} for method in METHODS}
+    return activities, flows, systems, cfs
@@ -1,4 +1,28 @@
-def df_status(df, _t = None
+# imports
+from typing import Callable, Optional
+from time import perf_counter, process_time
+import functools
+import json
+import os
+import threading
+import tracemalloc
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+FEATHER_COLUMNS_KEY = b"columns"  # schema metadata key for the original column labels
+
+# stage profiling (see Stage), off by default
+PROFILE = {
+    "enabled": False,
+    "memory": False,  # trace peak memory with tracemalloc (slows down the stages)
+    "records": [],  # finished stages, in order of finishing
+}
+_open_stages = []  # stages that are running, innermost last
+
+
+def df_status(df, _t = None, cache_hit = None
               ) -> dict:
     """Return some info from the df in a dict """
     status = {
@@ -6,4 +30,204 @@ def df_status(df, _t = None
         }
     if _t:
         status["time taken"] = f"{round(_t, 1)}s"
+    if cache_hit is not None:
+        status["cache"] = "hit" if cache_hit else "miss"
     return status
+
+
+def write_feather(df: pd.DataFrame, path: str) -> None:
+    """write df to an uncompressed feather file (an Arrow file that can be memory-mapped)
+
+    Feather needs string column labels, the original labels (e.g. int years) are kept in
+    the metadata and restored by read_feather. The file is written to a temporary file
+    first, so an interrupted write never leaves a broken file.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    columns = [c.item() if hasattr(c, "item") else c for c in df.columns]
+    table = pa.Table.from_pandas(df.set_axis([str(c) for c in columns], axis=1), preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           FEATHER_COLUMNS_KEY: json.dumps(columns).encode()})
+    tmp_path = f"{path}.tmp"
+    feather.write_feather(table, tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+
+
+def read_feather(path: str) -> pd.DataFrame:
+    """memory-map a feather file written by write_feather and return it with the original column labels"""
+    table = feather.read_table(path, memory_map=True)
+    df = table.to_pandas()
+    columns = (table.schema.metadata or {}).get(FEATHER_COLUMNS_KEY)
+    if columns is not None:
+        df.columns = json.loads(columns)
+    return df
+
+
+def enable_profiling(memory: bool = True) -> None:
+    """record every Stage (and profiled function), optionally with peak memory"""
+    PROFILE["enabled"] = True
+    PROFILE["memory"] = memory
+
+
+def disable_profiling() -> None:
+    """stop recording stages, the records are kept until clear_profile"""
+    PROFILE["enabled"] = False
+
+
+def clear_profile() -> None:
+    """remove all recorded stages"""
+    PROFILE["records"] = []
+
+
+def df_memory(df) -> Optional[int]:
+    """return the memory usage of a dataframe in bytes, None if df is not a dataframe"""
+    if not isinstance(df, pd.DataFrame):
+        return None
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def _mb(n_bytes: Optional[int]) -> Optional[float]:
+    return n_bytes / 1024 ** 2 if n_bytes is not None else None
+
+
+class Stage:
+    """context manager that measures a stage of the model
+
+    The wall time is always measured (this costs nothing), so the stage can print its
+    status: prints 'end' prints the status at the end of the stage, 'all' also prints
+    every step. When profiling is enabled (enable_profiling), the CPU time, peak memory
+    (tracemalloc), rows in/out and dataframe memory are recorded in PROFILE["records"].
+
+    Example:
+        with Stage("clean", df_orig, "Cleaned", prints="all") as stage:
+            df = df_orig.loc[df_orig["flow"] != "stock"]
+            stage.step("Filtered flows", df)
+            df = stage.output(df.groupby("Region").sum())
+    """
+
+    def __init__(self, name: str, df_in=None, message: Optional[str] = None, prints: str = "none"):
+        self.name = name
+        self.df_in = df_in
+        self.message = message if message is not None else name
+        self.prints = prints
+        self.df_out = None
+        self.cache_hit = None
+        self.record = None
+
+    def __enter__(self) -> "Stage":
+        self.profile = PROFILE["enabled"]
+        if self.profile:
+            self.record = {
+                "name": self.name,
+                "rows in": len(self.df_in) if self.df_in is not None else None,
+                "df memory in (MB)": _mb(df_memory(self.df_in)),
+                "steps": [],
+            }
+            self.trace_memory = PROFILE["memory"]
+            if self.trace_memory:
+                self.started_tracing = not tracemalloc.is_tracing()
+                if self.started_tracing:
+                    tracemalloc.start()
+                current, peak = tracemalloc.get_traced_memory()
+                if _open_stages:  # keep the peak of the outer stage before resetting it for this stage
+                    outer = _open_stages[-1]
+                    outer._peak = max(outer._peak, peak)
+                tracemalloc.reset_peak()
+                self._start_memory = current
+                self._peak = current
+            _open_stages.append(self)
+            self._cpu = process_time()
+        self._t = perf_counter()
+        self._t_step = self._t
+        return self
+
+    def step(self, message: str, df=None) -> None:
+        """mark the end of a step in the stage, printed if prints is 'all'"""
+        t = perf_counter()
+        if self.record is not None:
+            self.record["steps"].append({"name": message, "start": self._t_step, "wall time (s)": t - self._t_step,
+                                         "rows": len(df) if df is not None else None})
+        if self.prints == "all":
+            print(f"{message}: {df_status(df)}" if df is not None else message)
+        self._t_step = t
+
+    def output(self, df):
+        """set the output of the stage and return it"""
+        self.df_out = df
+        return df
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.wall_time = perf_counter() - self._t
+        if self.profile:
+            self.record["start"] = self._t
+            self.record["wall time (s)"] = self.wall_time
+            self.record["cpu time (s)"] = process_time() - self._cpu
+            if self.trace_memory:
+                peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+                self.record["peak memory (MB)"] = _mb(peak - self._start_memory)
+                if self.started_tracing:
+                    tracemalloc.stop()
+            _open_stages.remove(self)
+            if _open_stages and self.trace_memory:
+                outer = _open_stages[-1]
+                outer._peak = max(outer._peak, peak)
+            self.record["rows out"] = len(self.df_out) if isinstance(self.df_out, pd.DataFrame) else None
+            self.record["df memory out (MB)"] = _mb(df_memory(self.df_out))
+            if self.cache_hit is not None:
+                self.record["cache"] = "hit" if self.cache_hit else "miss"
+            if exc_type is not None:
+                self.record["error"] = repr(exc_value)
+            self.record["thread"] = threading.get_ident()
+            PROFILE["records"].append(self.record)
+        if exc_type is None and self.prints in ["all", "end"]:
+            print(f"{self.message}: {self.status()}")
+
+    def status(self) -> dict:
+        """return df_status of the output, with the profile data if it was recorded"""
+        status = df_status(self.df_out, self.wall_time, self.cache_hit) if self.df_out is not None else {
+            "time taken": f"{round(self.wall_time, 1)}s"}
+        if self.record is not None:
+            status["cpu time"] = f"{round(self.record['cpu time (s)'], 1)}s"
+            if "peak memory (MB)" in self.record:
+                status["peak memory"] = f"{round(self.record['peak memory (MB)'], 1)}MB"
+        return status
+
+
+def profiled(func: Callable) -> Callable:
+    """decorator that runs func as a Stage when profiling is enabled
+
+    The first dataframe argument is the input of the stage and a dataframe result is
+    the output. When profiling is disabled, func is called directly.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PROFILE["enabled"]:
+            return func(*args, **kwargs)
+        df_in = next((arg for arg in list(args) + list(kwargs.values()) if isinstance(arg, pd.DataFrame)), None)
+        with Stage(func.__name__, df_in) as stage:
+            return stage.output(func(*args, **kwargs))
+    return wrapper
+
+
+def write_profile(path: str, records: Optional[list] = None) -> None:
+    """write the recorded stages as a Chrome trace file (chrome://tracing, Perfetto)
+
+    Every stage (and step) is a complete ('X') event with the measurements as args,
+    the records themselves are stored under 'stages' in the same JSON file.
+    """
+    records = PROFILE["records"] if records is None else records
+    t0 = min((record["start"] for record in records), default=0)
+    events = []
+    for record in records:
+        args = {k: v for k, v in record.items() if k not in ["name", "start", "steps", "thread"]}
+        events.append({"name": record["name"], "cat": "stage", "ph": "X", "pid": os.getpid(),
+                       "tid": record["thread"], "ts": (record["start"] - t0) * 1e6,
+                       "dur": record["wall time (s)"] * 1e6, "args": args})
+        for step in record["steps"]:
+            events.append({"name": step["name"], "cat": "step", "ph": "X", "pid": os.getpid(),
+                           "tid": record["thread"], "ts": (step["start"] - t0) * 1e6,
+                           "dur": step["wall time (s)"] * 1e6, "args": {"rows": step["rows"]}})
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms", "stages": records}, f, indent=1, default=str)
@@ -0,0 +1,7 @@
+# file for the pytest setup: the model modules import each other from the 'model' folder
+import os
+import sys
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model")
+DATAPACKAGE_DIR = os.path.join(os.path.dirname(MODEL_DIR), "datapackage")
+sys.path.insert(0, MODEL_DIR)
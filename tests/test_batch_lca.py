@@ -0,0 +1,90 @@
+# file for testing batch_lca on a synthetic technosphere around aggregate_LCI.csv
+import os
+
+import numpy as np
+import pytest
+import yaml
+
+import batch_lca
+from batch_lca import characterization_matrix, config_routes, route_demands, demand_matrix
+from inventory import Inventory
+from synthetic_data import synthetic_technosphere
+from statics import METHODS
+
+from conftest import DATAPACKAGE_DIR
+
+REGIONS = ["BRA", "INDIA", "WEU"]
+YEARS = [2025, 2030, 2050]
+
+
+@pytest.fixture(scope="module")
+def system():
+    """small synthetic system: the inventory activities in 3 regions with background activities"""
+    inventory = Inventory.from_csv(os.path.join(DATAPACKAGE_DIR, "inventories", "aggregate_LCI.csv"))
+    with open(os.path.join(DATAPACKAGE_DIR, "configuration_file", "config.yaml"), "r") as f:
+        routes = config_routes(yaml.safe_load(f))
+    activities, flows, systems, cfs = synthetic_technosphere(inventory, routes, REGIONS, YEARS, n_flows=8)
+    demands = route_demands(activities, routes, REGIONS)
+    return activities, flows, systems, cfs, demands, routes
+
+
+def test_scores_match_dense_solve(system):
+    activities, flows, systems, cfs, demands, routes = system
+    C = characterization_matrix(cfs, flows)
+    df = batch_lca.batch_lca(systems, demands, C)
+    assert len(df) == len(systems) * len(demands) * len(METHODS)
+    assert len(demands) == len(routes) * len(REGIONS)
+
+    for (scenario, year), (A, B) in systems.items():
+        F = demand_matrix(demands, A.shape[0])
+        CB = (C @ B).toarray()
+        scores = df.loc[(df["scenario"] == scenario) & (df["year"] == year), "score"].to_numpy()
+        scores = scores.reshape(len(demands), len(METHODS))  # demands (outer) x methods (inner)
+        for d in range(len(demands)):
+            expected = CB @ np.linalg.solve(A.toarray(), F[:, d])
+            np.testing.assert_allclose(scores[d], expected, rtol=1e-10, atol=1e-14)
+
+
+def test_factorization_reused(system, monkeypatch):
+    activities, flows, systems, cfs, demands, _ = system
+    C = characterization_matrix(cfs, flows)
+    calls = []
+    factorize = batch_lca.factorize
+    monkeypatch.setattr(batch_lca, "factorize", lambda A: calls.append(A) or factorize(A))
+
+    # the same technosphere in 2 scenarios x 3 years: factorized once
+    A = systems[("synthetic", YEARS[0])][0]
+    assert all(technosphere is A for technosphere, _ in systems.values())
+    shared = {(scenario, year): systems[("synthetic", year)] for scenario in ["a", "b"] for year in YEARS}
+    df = batch_lca.batch_lca(shared, demands, C)
+    assert len(calls) == 1
+    assert df["scenario"].nunique() == 2 and df["year"].nunique() == len(YEARS)
+
+    # a different technosphere per scenario: factorized once per technosphere
+    calls.clear()
+    A_other = A.copy()
+    separate = {**{("a", year): systems[("synthetic", year)] for year in YEARS},
+                **{("b", year): (A_other, systems[("synthetic", year)][1]) for year in YEARS}}
+    df_separate = batch_lca.batch_lca(separate, demands, C)
+    assert len(calls) == 2
+    np.testing.assert_allclose(df_separate["score"].to_numpy(), df["score"].to_numpy())
+
+
+def test_singular_technosphere_raises(system):
+    _, _, systems, _, _, _ = system
+    A = systems[("synthetic", YEARS[0])][0].tolil()
+    A[0, :] = 0
+    with pytest.raises(BaseException):
+        batch_lca.factorize(A.tocsr())
+
+
+def test_shape_mismatch_raises(system):
+    _, flows, systems, cfs, demands, _ = system
+    C = characterization_matrix(cfs, flows)
+    with pytest.raises(BaseException, match="not one per method"):
+        batch_lca.batch_lca(systems, demands, C, methods=METHODS[:1])
+    A, B = systems[("synthetic", YEARS[0])]
+    with pytest.raises(BaseException, match="the biosphere matrix has"):
+        batch_lca.batch_lca({("synthetic", YEARS[0]): (A, B[:, :-1])}, demands, C)
+    with pytest.raises(BaseException, match="the characterization matrix has"):
+        batch_lca.batch_lca({("synthetic", YEARS[0]): (A, B[:-1])}, demands, C)
@@ -0,0 +1,75 @@
+# file for testing the datapackage consistency checker
+import os
+import shutil
+
+from check_datapackage import check_datapackage, check_inventory
+from inventory import Inventory
+
+from conftest import DATAPACKAGE_DIR
+
+HEADER = "name,amount,database,location,unit,type,reference product"
+
+
+def write_inventory(path, activities, header=HEADER):
+    """write a block csv inventory with activities [(name, product, location, [exchange rows])]"""
+    lines = ["Database,test", ""]
+    for name, product, location, exchanges in activities:
+        lines += [f"Activity,{name}", f"location,{location}", f"reference product,{product}",
+                  "unit,kilogram", "Exchanges", header] + exchanges + [""]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def test_datapackage_is_consistent():
+    assert check_datapackage(DATAPACKAGE_DIR) == []
+
+
+def test_mismatches_are_reported(tmp_path):
+    datapackage_dir = str(tmp_path / "datapackage")
+    shutil.copytree(DATAPACKAGE_DIR, datapackage_dir)
+    config_path = os.path.join(datapackage_dir, "configuration_file", "config.yaml")
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = f.read()
+    with open(config_path, "w", encoding="utf-8") as f:
+        f.write(config.replace("variable: Production|Sand|SAND_PIT", "variable: Production|Sand|SAND_PITX"))
+
+    errors = check_datapackage(datapackage_dir)
+    assert any("'Production|Sand|SAND_PIT' has no production pathway" in error for error in errors)
+    assert any("'Production|Sand|SAND_PITX' is not in scenario_data" in error for error in errors)
+
+
+def test_production_exchanges_per_activity_key(tmp_path):
+    path = str(tmp_path / "inventory.csv")
+    write_inventory(path, [
+        # same name in two locations: one production exchange each, no error
+        ("quarry", "sand", "BRA", ["quarry,1,test,BRA,kilogram,production,sand"]),
+        ("quarry", "sand", "WEU", ["quarry,1,test,WEU,kilogram,production,sand"]),
+        # two production exchanges: one error for this activity only
+        ("crusher", "gravel", "GLO", ["crusher,1,test,GLO,kilogram,production,gravel",
+                                      "crusher,1,test,GLO,kilogram,production,gravel"]),
+        ("crusher", "gravel", "BRA", ["crusher,1,test,BRA,kilogram,production,gravel"]),
+    ])
+    errors = check_inventory(Inventory.from_csv(path), {"schema": {"fields": [{"name": name} for name in
+                                                                                HEADER.split(",")]}}, {})
+    assert errors == ["inventory activity ('crusher', 'gravel', 'GLO') has 2 production exchanges, not 1"]
+
+
+def test_empty_activity_and_no_type_column(tmp_path):
+    path = str(tmp_path / "inventory.csv")
+    write_inventory(path, [
+        ("quarry", "sand", "BRA", ["quarry,1,test,BRA,kilogram,production,sand"]),
+        ("crusher", "gravel", "GLO", []),  # no exchanges
+        ("washer", "sand", "GLO", ["washer,1,test,GLO,kilogram,production,sand",
+                                   "quarry,2,test,BRA,kilogram,technosphere,sand"]),
+    ])
+    fields = {"schema": {"fields": [{"name": name} for name in HEADER.split(",")]}}
+    assert check_inventory(Inventory.from_csv(path), fields, {}) == \
+        ["inventory activity ('crusher', 'gravel', 'GLO') has 0 production exchanges, not 1"]
+
+    # without a 'type' column no exchange is a production exchange
+    header = "name,amount,database,location,unit,reference product"
+    write_inventory(path, [("quarry", "sand", "BRA", ["quarry,1,test,BRA,kilogram,sand"]),
+                           ("washer", "sand", "GLO", ["quarry,2,test,BRA,kilogram,sand"])], header)
+    assert check_inventory(Inventory.from_csv(path), fields, {}) == \
+        [f"inventory activity {key} has 0 production exchanges, not 1"
+         for key in [("quarry", "sand", "BRA"), ("washer", "sand", "GLO")]]
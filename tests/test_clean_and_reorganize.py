@@ -0,0 +1,17 @@
+# file for testing clean_and_reorganize on wide sheets (benchmark sizes)
+import warnings
+
+import pandas as pd
+import pytest
+
+from extract_stock_data import clean_and_reorganize
+from synthetic_data import synthetic_material_output
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"keep": ["type", "area"]}, {"materials": ["concrete", "brick"]}])
+def test_wide_sheet_not_fragmented(kwargs):
+    df = synthetic_material_output(years=range(1800, 2101), materials=["concrete", "brick"], n_types=2, n_areas=2)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", pd.errors.PerformanceWarning)
+        result = clean_and_reorganize(df, prints="none", **kwargs)
+    assert result["year"].nunique() == 301
@@ -0,0 +1,35 @@
+# file for testing the chunked ensemble store
+import numpy as np
+import pytest
+
+from ensemble_store import EnsembleStore
+
+VARIABLES = ["Production|Gravel|GRAVEL_ADR", "Production|Sand|SAND_HAS", "Production|Sand|SAND_RIVER"]
+REGIONS = ["BRA", "INDIA", "WEU", "USA"]
+YEARS = [2025, 2030, 2035]
+
+
+@pytest.fixture
+def store(tmp_path):
+    values = np.random.default_rng(0).random((5, len(VARIABLES), len(REGIONS), len(YEARS)))
+    store = EnsembleStore.create(str(tmp_path / "ensemble"), VARIABLES, REGIONS, YEARS, chunk_size=2)
+    store.append([f"s{i}" for i in range(3)], values[:3])
+    store.append([f"s{i}" for i in range(3, 5)], values[3:])
+    return EnsembleStore(str(tmp_path / "ensemble")), values
+
+
+def test_select(store):
+    store, values = store
+    assert store.shape == values.shape
+    np.testing.assert_array_equal(store.select(), values)
+    np.testing.assert_array_equal(store.select(region="WEU"), values[:, :, 2])
+    np.testing.assert_array_equal(store.select(scenario=["s4", "s1"], variables=VARIABLES[1], year=[2035, 2025]),
+                                  values[[4, 1]][:, 1][:, :, [2, 0]])
+
+
+def test_duplicate_scenarios(store):
+    store, values = store
+    with pytest.raises(BaseException, match=r"\['s1'\]"):
+        store.append(["s1", "s9"], values[:2])
+    with pytest.raises(BaseException, match=r"\['s8'\]"):
+        store.append(["s8", "s8"], values[:2])
@@ -0,0 +1,28 @@
+# file for testing the scenario generation over pathways and ambitions
+import pandas as pd
+import pytest
+
+import generate_datapackage
+from extract_stock_data import clean_and_reorganize
+from synthetic_data import synthetic_material_output
+
+
+@pytest.fixture(scope="module")
+def inputs():
+    df = synthetic_material_output(years=range(2000, 2061), n_types=2, n_areas=2)
+    return {"SSP2-Base": clean_and_reorganize(df, prints="none")}
+
+
+def test_one_worker_makes_no_pool(inputs, monkeypatch):
+    pools = []
+    pool = generate_datapackage.ProcessPoolExecutor
+    monkeypatch.setattr(generate_datapackage, "ProcessPoolExecutor",
+                        lambda *args, **kwargs: pools.append(1) or pool(*args, **kwargs))
+    df, scenarios = generate_datapackage.generate_scenario_data(inputs, n_workers=1)
+    assert pools == []
+    assert list(scenarios) == [generate_datapackage.scenario_name("SSP2-Base", ambition)
+                               for ambition in generate_datapackage.AMBITIONS]
+
+    df_pool, _ = generate_datapackage.generate_scenario_data(inputs, n_workers=2)
+    assert pools == [1]
+    pd.testing.assert_frame_equal(df_pool, df)
@@ -0,0 +1,46 @@
+# file for testing the multi-material availability pass
+import numpy as np
+import pandas as pd
+import pytest
+
+from extract_stock_data import clean_and_reorganize, calculate_availability, aggregate_dimensions
+from synthetic_data import synthetic_material_output
+from statics import UNIT
+
+YEARS = list(range(2000, 2051))
+
+
+@pytest.fixture(scope="module")
+def raw():
+    return synthetic_material_output(n_regions=26, years=YEARS, materials=["concrete", "brick"],
+                                     n_types=2, n_areas=2)
+
+
+@pytest.mark.parametrize("keep", [None, ["type", "area"]])
+def test_two_materials(raw, keep):
+    df_multi = clean_and_reorganize(raw, prints="none", materials=["concrete", "brick"], keep=keep)
+    df_done = calculate_availability(df_multi, 0.5, 0.5)
+    assert sorted(df_done["material"].unique()) == ["brick", "concrete"]
+    assert len(df_done) == len(df_multi)
+
+    # concrete is the same as a single material run
+    df_single = calculate_availability(clean_and_reorganize(raw, prints="none", keep=keep), 0.5, 0.5)
+    concrete = df_done.loc[df_done["material"] == "concrete"].drop(columns="material").reset_index(drop=True)
+    pd.testing.assert_frame_equal(concrete, df_single, check_categorical=False)
+
+    # brick has no split tables: in/outflow are kept, product columns are empty
+    brick = df_done.loc[df_done["material"] == "brick"]
+    product_cols = [col for col in df_done.columns if col not in df_multi.columns]
+    assert product_cols and brick[product_cols].isna().all().all()
+    assert (brick[f"inflow ({UNIT})"].sum() ==
+            pytest.approx(df_multi.loc[df_multi["material"] == "brick", f"inflow ({UNIT})"].sum()))
+
+    if keep:
+        regional = aggregate_dimensions(df_done)
+        assert sorted(regional["material"].unique()) == ["brick", "concrete"]
+
+
+def test_float32_kept(raw):
+    df_multi = clean_and_reorganize(raw, prints="none", materials=["concrete", "brick"], float32=True)
+    df_done = calculate_availability(df_multi, 0.5, 0.5)
+    assert all(df_done[col].dtype == np.float32 for col in df_done.columns if col not in ["material", "Region", "year"])
@@ -0,0 +1,40 @@
+# file for testing that the cached pipeline only reads the stages it needs
+import pytest
+
+import pipeline
+import stage_cache
+from synthetic_data import synthetic_material_output
+
+
+@pytest.fixture
+def workbook(tmp_path, monkeypatch):
+    """synthetic material_output workbook, all caches in tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "material_output.xlsx")
+    synthetic_material_output(years=range(2000, 2061), n_types=2, n_areas=2).to_excel(
+        path, sheet_name=pipeline.SHEET_NAME, index=False)
+    return path
+
+
+def run(workbook, **kwargs):
+    return pipeline.run_cached_pipeline(workbook, scenario_data_export=None, cache_dir="stages", prints="none",
+                                        **kwargs)
+
+
+def test_cache_hit_reads_only_reorder(workbook, monkeypatch):
+    expected = run(workbook)
+    read = []
+    read_feather = stage_cache.read_feather
+    monkeypatch.setattr(stage_cache, "read_feather", lambda path: read.append(path) or read_feather(path))
+    result = run(workbook)
+    assert len(read) == 1 and "reorder" in read[0]
+    assert result.equals(expected)
+
+
+def test_changed_years_reads_only_availability(workbook, monkeypatch):
+    run(workbook)
+    read = []
+    read_feather = stage_cache.read_feather
+    monkeypatch.setattr(stage_cache, "read_feather", lambda path: read.append(path) or read_feather(path))
+    run(workbook, years=pipeline.YEARS[:-1])
+    assert len(read) == 1 and "availability" in read[0]
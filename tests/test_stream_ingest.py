@@ -0,0 +1,33 @@
+# file for testing that the streaming ingest gives the same result as clean_and_reorganize
+import numpy as np
+import pandas as pd
+import pytest
+
+from extract_stock_data import clean_and_reorganize
+from stream_ingest import stream_clean_and_reorganize
+from synthetic_data import synthetic_material_output
+
+
+@pytest.fixture(scope="module")
+def sheet(tmp_path_factory):
+    """synthetic material_output with blank cells, as excel workbook and csv export"""
+    df = synthetic_material_output(n_regions=26, years=range(2000, 2011), materials=["concrete", "brick"],
+                                   n_types=2, n_areas=2)
+    df.iloc[0, df.columns.get_loc(2005)] = np.nan  # blank cell in a summed row
+    df.loc[(df["flow"] == "outflow") & (df["material"] == "concrete"), 2003] = np.nan  # blank year of a flow
+    folder = tmp_path_factory.mktemp("sheet")
+    xlsx, csv = str(folder / "material_output.xlsx"), str(folder / "material_output.csv")
+    df.to_excel(xlsx, sheet_name="material_output", index=False)
+    df.to_csv(csv, index=False)
+    return df, xlsx, csv
+
+
+@pytest.mark.parametrize("source", ["xlsx", "csv"])
+@pytest.mark.parametrize("keep", [None, ["type"]])
+def test_stream_matches_clean_and_reorganize(sheet, source, keep):
+    df, xlsx, csv = sheet
+    expected = clean_and_reorganize(df.copy(), prints="none", materials=["concrete", "brick"], keep=keep)
+    result = stream_clean_and_reorganize(xlsx if source == "xlsx" else csv, materials=["concrete", "brick"],
+                                         keep=keep, prints="none")
+    assert not result.isna().any().any()
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_categorical=False, rtol=1e-12)
@@ -0,0 +1,136 @@
+# file for testing the scenario difference export against a stand-in database
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+
+from superstructure import (export_scenario_difference, activity_key, supplier_location, SDF_COLUMNS,
+                            SDF_SEPARATOR, DATABASE)
+from stock_to_scenario_formatting import YEARS
+
+from conftest import DATAPACKAGE_DIR
+
+SCENARIO_DATA_PATH = os.path.join(DATAPACKAGE_DIR, "scenario_data", "scenario_data.csv")
+CONFIG_PATH = os.path.join(DATAPACKAGE_DIR, "configuration_file", "config.yaml")
+DATAPACKAGE_PATH = os.path.join(DATAPACKAGE_DIR, "datapackage.json")
+
+
+@pytest.fixture(scope="module")
+def config():
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
+@pytest.fixture(scope="module")
+def scenario_data():
+    return pd.read_csv(SCENARIO_DATA_PATH, encoding="utf-8-sig")
+
+
+@pytest.fixture(scope="module")
+def regionalized(config):
+    return {(d["name"], d["reference product"]) for d in config["regionalize"]["datasets"]}
+
+
+@pytest.fixture(scope="module")
+def codes(config, scenario_data, regionalized):
+    """stand-in database with the activities premise creates: the markets and the regionalized datasets in
+    every region, the other pathway datasets only in their ecoinvent locations"""
+    codes = {}
+    for pathway, settings in config["production pathways"].items():
+        alias = settings["ecoinvent alias"]
+        if (alias["name"], alias["reference product"]) not in regionalized:
+            for location in ["CH", "RoW"]:
+                codes[(alias["name"], alias["reference product"], location)] = f"{pathway.lower()}_{location}"
+    for region in scenario_data["region"].unique():
+        for name, product in regionalized:
+            codes[(name, product, region)] = f"{name}_{product}_{region}"
+        for i, market in enumerate(config["markets"]):
+            codes[(market["name"], market["reference product"], region)] = f"market_{i}_{region}"
+    return codes
+
+
+@pytest.fixture(scope="module")
+def sdf_path(tmp_path_factory):
+    return str(tmp_path_factory.mktemp("superstructure") / "scenario_difference_file.csv")
+
+
+@pytest.fixture(scope="module")
+def sdf(codes, sdf_path):
+    return export_scenario_difference(sdf_path, SCENARIO_DATA_PATH, CONFIG_PATH, DATAPACKAGE_PATH, codes=codes)
+
+
+def scenario_cols(sdf: pd.DataFrame) -> list:
+    return [col for col in sdf.columns if col not in SDF_COLUMNS]
+
+
+def test_shares_sum_to_one(sdf):
+    sums = sdf.groupby(["to activity name", "to location"])[scenario_cols(sdf)].sum()
+    np.testing.assert_allclose(sums.to_numpy(), 1.0)
+
+
+@pytest.mark.parametrize("market, name, variable, included", [
+    ("market for gravel, crushed, incl recycled", "adr gravel", "Production|Gravel|GRAVEL_ADR",
+     ["GRAVEL_ADR", "GRAVEL_CRUSHED"]),
+    ("market for sand, incl recycled", "has sand", "Production|Sand|SAND_HAS",
+     ["SAND_HAS", "SAND_QUARRY", "SAND_RIVER", "SAND_PIT", "SAND_ZINC"]),
+])
+def test_recycled_shares(sdf, scenario_data, market, name, variable, included):
+    df = scenario_data.loc[scenario_data["scenario"] == "SSP2-Base-image"]
+    variables = [v for v in df["variables"].unique() if v.split("|")[-1] in included]
+    totals = df.loc[df["variables"].isin(variables)].groupby("region")[[str(y) for y in YEARS]].sum()
+    recycled = df.loc[df["variables"] == variable].set_index("region")[[str(y) for y in YEARS]]
+    expected = (recycled / totals.loc[recycled.index]).sort_index()
+
+    rows = sdf.loc[(sdf["to activity name"] == market) & (sdf["from activity name"] == name)]
+    actual = rows.set_index("from location")[[f"image - SSP2-Base - {y}" for y in YEARS]].sort_index()
+    assert list(actual.index) == list(expected.index)
+    np.testing.assert_allclose(actual.to_numpy(), expected.to_numpy(), rtol=1e-12)
+
+
+def test_keys_from_stand_in_database(sdf, codes):
+    row = sdf.iloc[0]
+    code = codes[(row["from activity name"], row["from reference product"], row["from location"])]
+    assert row["from key"] == str((DATABASE, code))
+    assert activity_key(codes, "adr gravel", "gravel, crushed, from adr", "BRA", DATABASE) == \
+        str((DATABASE, "adr gravel_gravel, crushed, from adr_BRA"))
+
+
+@pytest.mark.parametrize("name", ["sand quarry operation, open pit mine", "zinc mine operation"])
+def test_not_regionalized_supplier_location(sdf, scenario_data, name):
+    rows = sdf.loc[sdf["from activity name"] == name]
+    assert len(rows)
+    assert set(rows["from location"]) == {"RoW"}
+    assert not set(rows["from location"]) & set(scenario_data["region"])
+    assert set(rows["to location"]) <= set(scenario_data["region"])
+
+
+def test_not_regionalized_supplier_location_lookup(regionalized):
+    name, product = "zinc mine operation", "sand"
+    assert supplier_location({(name, product): {"GLO"}}, regionalized, name, product, "BRA") == "GLO"
+    assert supplier_location({(name, product): {"CA-QC"}}, regionalized, name, product, "BRA") == "CA-QC"
+    assert supplier_location(None, regionalized, "has sand", "sand, from has", "BRA") == "BRA"
+    with pytest.raises(BaseException, match="no single location"):
+        supplier_location({(name, product): {"CA-QC", "PE"}}, regionalized, name, product, "BRA")
+    with pytest.raises(BaseException, match="not regionalized"):
+        supplier_location(None, regionalized, name, product, "BRA")
+    with pytest.raises(BaseException, match="not regionalized"):
+        export_scenario_difference(os.devnull, SCENARIO_DATA_PATH, CONFIG_PATH, DATAPACKAGE_PATH)
+
+
+def test_missing_activity_raises(codes):
+    with pytest.raises(BaseException, match="not in the database"):
+        activity_key(codes, "adr gravel", "gravel, crushed, from adr", "XYZ", DATABASE)
+    missing = {key: code for key, code in codes.items() if key != ("has sand", "sand, from has", "BRA")}
+    with pytest.raises(BaseException, match="has sand"):
+        export_scenario_difference(os.devnull, SCENARIO_DATA_PATH, CONFIG_PATH, DATAPACKAGE_PATH, codes=missing)
+
+
+def test_file_round_trip(sdf, sdf_path):
+    df = pd.read_csv(sdf_path, sep=SDF_SEPARATOR, keep_default_na=False, float_precision="round_trip")
+    assert list(df.columns) == SDF_COLUMNS + [f"image - SSP2-Base - {y}" for y in YEARS]
+    assert list(df.columns) == list(sdf.columns)
+    pd.testing.assert_frame_equal(df[scenario_cols(sdf)], sdf[scenario_cols(sdf)])
+    for col in SDF_COLUMNS:
+        assert df[col].astype(str).tolist() == sdf[col].astype(str).tolist()